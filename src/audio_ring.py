@@ -0,0 +1,244 @@
+# audio_ring.py
+import asyncio
+import bisect
+import threading
+
+# linear16, mono, 16 kHz — the format main.py asks Deepgram for.
+BYTES_PER_SECOND = 16000 * 2
+
+
+class AudioRingBuffer:
+    """
+    Preallocated ring of raw audio written by the microphone callback.
+
+    Positions are absolute byte counts since the first write, so they double as
+    the shared audio clock for every connection. Readers get memoryview slices
+    of the ring itself; nothing is copied after the single write into it.
+    """
+
+    def __init__(self, seconds=10.0, bytes_per_second=BYTES_PER_SECOND):
+        self.bytes_per_second = bytes_per_second
+        self.capacity = int(seconds * bytes_per_second)
+        self._buffer = bytearray(self.capacity)
+        self._view = memoryview(self._buffer)
+        self.lock = threading.Lock()
+        self.write_position = 0
+
+    @property
+    def oldest_position(self):
+        return max(0, self.write_position - self.capacity)
+
+    def write(self, data):
+        """Copy one frame into the ring. Called from the microphone thread."""
+        data = memoryview(data).cast("B")
+        skipped = 0
+        if len(data) > self.capacity:
+            # Only the newest audio fits, but the clock still advances by the whole frame.
+            skipped = len(data) - self.capacity
+            data = data[-self.capacity:]
+        with self.lock:
+            self.write_position += skipped
+            offset = self.write_position % self.capacity
+            first = min(len(data), self.capacity - offset)
+            self._view[offset:offset + first] = data[:first]
+            if first < len(data):
+                self._view[:len(data) - first] = data[first:]
+            self.write_position += len(data)
+
+    def view(self, position, max_bytes):
+        """
+        Return a zero-copy memoryview of up to max_bytes starting at position,
+        stopping at the end of the ring (the caller reads again for the rest).
+        """
+        with self.lock:
+            end = min(self.write_position, position + max_bytes)
+            if position < self.oldest_position or end <= position:
+                return None
+            offset = position % self.capacity
+            length = min(end - position, self.capacity - offset)
+            return self._view[offset:offset + length]
+
+
+class RingReader:
+    """
+    One connection's cursor into an AudioRingBuffer.
+
+    policy "coalesce" sends everything pending as large messages and only loses
+    audio if the ring itself laps the reader (an overrun). policy "drop" also
+    skips ahead to live audio once the reader lags more than max_lag_seconds.
+
+    The reader remembers every jump it makes, so timestamps in the stream it
+    produced (what Deepgram saw) can be mapped back onto the ring's clock.
+    """
+
+    def __init__(self, ring, name, policy="coalesce", max_lag_seconds=1.0, max_chunk_seconds=0.5):
+        if policy not in ("coalesce", "drop"):
+            raise ValueError(f"Unknown ring reader policy: {policy}")
+        self.ring = ring
+        self.name = name
+        self.policy = policy
+        self.max_lag_bytes = int(max_lag_seconds * ring.bytes_per_second)
+        self.max_chunk_bytes = int(max_chunk_seconds * ring.bytes_per_second)
+        self.position = ring.write_position
+        self.bytes_sent = 0
+        self.overruns = 0
+        self.dropped_bytes = 0
+        self.max_lag_seen = 0
+        # (stream byte, ring position) at each discontinuity, in stream order.
+        self._segments = [(0, self.position)]
+
+    @property
+    def lag_bytes(self):
+        return self.ring.write_position - self.position
+
+    def _jump(self, position):
+        if position != self.position:
+            self.position = position
+            self._segments.append((self.bytes_sent, position))
+
+    def next_chunk(self):
+        """Return the next memoryview to send, or None when caught up."""
+        lag = self.lag_bytes
+        self.max_lag_seen = max(self.max_lag_seen, lag)
+        oldest = self.ring.oldest_position
+        if self.position < oldest:
+            # The writer lapped us; that audio is gone.
+            self.overruns += 1
+            self.dropped_bytes += oldest - self.position
+            self._jump(oldest)
+        elif self.policy == "drop" and lag > self.max_lag_bytes:
+            target = self.ring.write_position - self.max_lag_bytes
+            self.dropped_bytes += target - self.position
+            self._jump(target)
+        return self.ring.view(self.position, self.max_chunk_bytes)
+
+    def advance(self, chunk, sent=True):
+        """Move past a chunk returned by next_chunk once it has been handed to the connection."""
+        start = self.position
+        self.position += len(chunk)
+        if sent:
+            self.bytes_sent += len(chunk)
+        else:
+            self._segments.append((self.bytes_sent, self.position))
+        if start < self.ring.oldest_position:
+            # The writer lapped the chunk while it was being sent, so it may be torn.
+            self.overruns += 1
+
+    def seek_live(self):
+        """Skip to the newest audio without counting it as dropped (e.g. while the connection is idle)."""
+        self._jump(self.ring.write_position)
+
+    def rewind(self, seconds):
+        """Step back so the last `seconds` of audio are sent again, e.g. after activation or a reconnect."""
+        target = self.ring.write_position - int(seconds * self.ring.bytes_per_second)
+        target -= target % 2  # Keep 16-bit samples aligned.
+        self._jump(max(target, self.ring.oldest_position))
+
+    def restart_stream(self, seconds=0.0):
+        """
+        Start a new stream (e.g. a replacement connection, whose timestamps
+        begin at zero), replaying the last `seconds` of audio first.
+        """
+        self.rewind(seconds)
+        self.bytes_sent = 0
+        self._segments = [(0, self.position)]
+
+    def to_ring_seconds(self, stream_seconds):
+        """Map a time in this reader's stream (e.g. a Deepgram timestamp) onto the ring's audio clock."""
+        stream_byte = int(stream_seconds * self.ring.bytes_per_second)
+        index = bisect.bisect_right(self._segments, (stream_byte, float("inf"))) - 1
+        segment_stream, segment_ring = self._segments[max(0, index)]
+        return (segment_ring + stream_byte - segment_stream) / self.ring.bytes_per_second
+
+    def stats(self):
+        bps = self.ring.bytes_per_second
+        return {
+            "lag_seconds": round(self.lag_bytes / bps, 3),
+            "max_lag_seconds": round(self.max_lag_seen / bps, 3),
+            "overruns": self.overruns,
+            "dropped_seconds": round(self.dropped_bytes / bps, 3),
+            "sent_seconds": round(self.bytes_sent / bps, 3),
+        }
+
+
+class AudioFanout:
+    """
+    Fans the microphone audio out to every connection through one ring.
+
+    The microphone callback only copies the frame into the ring and wakes the
+    per-connection sender tasks, so a slow websocket send delays only its own
+    connection. With a LanguageGate, idle connections follow live audio without
+    sending and rewind to replay the gate's buffer when they are activated.
+    """
+
+    def __init__(self, ring=None, language_gate=None, policy="coalesce"):
+        self.ring = ring if ring is not None else AudioRingBuffer()
+        self.language_gate = language_gate
+        self.policy = policy
+        self.readers = {}
+        self._senders = {}
+        self._wakeups = {}
+        self._tasks = []
+        self._loop = None
+
+    def add_connection(self, name, send, policy=None):
+        """Register a connection; send is a coroutine function taking a bytes-like chunk."""
+        self.readers[name] = RingReader(self.ring, name, policy or self.policy)
+        self._senders[name] = send
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        for name in self.readers:
+            self._wakeups[name] = asyncio.Event()
+            self._tasks.append(asyncio.create_task(self._send_loop(name), name=f"audio-{name}"))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def write(self, data):
+        """Microphone callback: store the frame and wake the senders."""
+        self.ring.write(data)
+        if self._loop is not None:
+            for wakeup in self._wakeups.values():
+                self._loop.call_soon_threadsafe(wakeup.set)
+
+    async def _send_loop(self, name):
+        reader = self.readers[name]
+        send = self._senders[name]
+        wakeup = self._wakeups[name]
+        gate = self.language_gate
+        while True:
+            await wakeup.wait()
+            wakeup.clear()
+            if gate is not None:
+                if not gate.is_active(name):
+                    reader.seek_live()
+                    continue
+                replay_seconds = gate.take_replay(name)
+                if replay_seconds:
+                    reader.rewind(replay_seconds)
+            while True:
+                chunk = reader.next_chunk()
+                if chunk is None:
+                    break
+                try:
+                    sent = await send(chunk) is not False
+                except Exception as e:
+                    print(f"[{name}] Error sending audio: {e}")
+                    sent = False
+                reader.advance(chunk, sent=sent)
+
+    def to_source_time(self, name, stream_seconds):
+        """Map a Deepgram timestamp from connection `name` onto the shared microphone clock."""
+        reader = self.readers.get(name)
+        return reader.to_ring_seconds(stream_seconds) if reader is not None else stream_seconds
+
+    def stats(self):
+        return {name: reader.stats() for name, reader in self.readers.items()}
+
+    def report(self):
+        for name, stats in self.stats().items():
+            print(f"[Audio {name}] {stats}")
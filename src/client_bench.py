@@ -0,0 +1,85 @@
+# client_bench.py
+"""
+First-token latency with and without warm, reused OpenAI connections.
+
+Runs the same turns against a local FakeChatCompletionsServer that charges
+--connect-ms for every new connection (standing in for TCP/TLS setup) and
+closes connections idle for --idle-timeout seconds, with turns --gap seconds
+apart, using:
+
+  cold     a new AsyncOpenAI client per turn
+  default  one AsyncOpenAI client with default settings
+  managed  ClientManager (long keep-alive, pre-warmed, idle keep-alive requests)
+
+Usage:
+    python client_bench.py [--turns 6] [--gap 1.5] [--connect-ms 80] [--idle-timeout 1.0]
+"""
+import argparse
+import asyncio
+import openai
+from clients import ClientManager
+from fake_servers import FakeChatCompletionsServer
+from gpt_integration import StreamMetrics, stream_gpt4_response
+from output_sink import NullSink
+from replay import percentile
+
+
+class _Dialogue:
+    def add_gpt_response(self, response_text, partial=False):
+        pass
+
+
+async def run_mode(mode, args, base_url):
+    metrics = StreamMetrics()
+    manager = None
+    shared = None
+    if mode == "managed":
+        manager = await ClientManager(api_key="bench", base_url=base_url,
+                                      keepalive_interval=args.idle_timeout / 2).start()
+        shared = manager.openai
+    elif mode == "default":
+        shared = openai.AsyncOpenAI(api_key="bench", base_url=base_url)
+    try:
+        for turn in range(args.turns):
+            if turn:
+                await asyncio.sleep(args.gap)
+            client = shared or openai.AsyncOpenAI(api_key="bench", base_url=base_url)
+            await stream_gpt4_response("[Speaker: 0, Language: en-US]: hello", _Dialogue(), turn, metrics=metrics,
+                                       sink=NullSink(), openai_client=client)
+            if shared is None:
+                await client.close()
+    finally:
+        if manager is not None:
+            await manager.stop()
+        elif shared is not None:
+            await shared.close()
+    return list(metrics.first_token_latencies), manager.stats() if manager else None
+
+
+async def run(args):
+    print(f"{'mode':<10}{'p50 ms':>9}{'p99 ms':>9}{'conns':>7}  reuse")
+    for mode in ("cold", "default", "managed"):
+        chat = FakeChatCompletionsServer(first_token_delay=args.first_token_ms / 1000, token_interval=0.0,
+                                         connect_delay=args.connect_ms / 1000, idle_timeout=args.idle_timeout).start()
+        try:
+            latencies, stats = await run_mode(mode, args, chat.base_url)
+        finally:
+            chat.stop()
+        reuse = f"{stats['reused']}/{stats['requests']} requests reused" if stats else ""
+        print(f"{mode:<10}{percentile(latencies, 0.5) * 1000:>9.1f}{percentile(latencies, 0.99) * 1000:>9.1f}"
+              f"{chat.connections:>7}  {reuse}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=6)
+    parser.add_argument("--gap", type=float, default=1.5, help="seconds between turns")
+    parser.add_argument("--connect-ms", type=float, default=80.0, help="simulated connection setup cost")
+    parser.add_argument("--idle-timeout", type=float, default=1.0, help="server closes idle connections after this")
+    parser.add_argument("--first-token-ms", type=float, default=100.0)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
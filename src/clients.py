@@ -0,0 +1,248 @@
+# clients.py
+import asyncio
+import importlib.util
+import os
+import time
+import httpx
+from deepgram import LiveTranscriptionEvents
+
+
+class ClientManager:
+    """
+    One warm AsyncOpenAI client for every GPT call.
+
+    The underlying httpx pool keeps connections alive far longer than httpx's
+    5 s default (HTTP/2 when the `h2` package is installed), start() opens a
+    connection before the first turn, and while the dialogue is idle a cheap
+    request every keepalive_interval seconds stops the server from closing it,
+    so a turn rarely pays for a TCP/TLS handshake. stats() counts how many
+    requests reused a pooled connection.
+
+    openai is imported by the constructor rather than at module level, so
+    callers can build the manager in a worker thread while other startup
+    work proceeds.
+    """
+
+    def __init__(self, api_key=None, base_url=None, keepalive_interval=20.0, keepalive_expiry=300.0,
+                 max_connections=32, timeout=60.0, http2=None):
+        import openai
+        self.keepalive_interval = keepalive_interval
+        self.http2 = importlib.util.find_spec("h2") is not None if http2 is None else http2
+        self.requests = 0
+        self.connections_opened = 0
+        self.tls_handshakes = 0
+        self.warmups = 0
+        self.last_request_at = 0.0
+        self.http_client = httpx.AsyncClient(
+            http2=self.http2,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections,
+                                keepalive_expiry=keepalive_expiry),
+            timeout=timeout,
+            event_hooks={"request": [self._on_request]},
+        )
+        self.openai = openai.AsyncOpenAI(api_key=api_key or os.getenv("OPENAI_API_KEY"), base_url=base_url,
+                                         http_client=self.http_client)
+        self._api_status_error = openai.APIStatusError
+        self._keepalive_task = None
+
+    async def start(self):
+        await self.warm()
+        if self.keepalive_interval:
+            self._keepalive_task = asyncio.create_task(self._keepalive_loop(), name="openai-keepalive")
+        return self
+
+    async def stop(self):
+        if self._keepalive_task is not None:
+            self._keepalive_task.cancel()
+            await asyncio.gather(self._keepalive_task, return_exceptions=True)
+            self._keepalive_task = None
+        await self.http_client.aclose()
+
+    async def warm(self):
+        """Open (or refresh) a pooled connection with a cheap request."""
+        self.warmups += 1
+        try:
+            await self.openai.models.list()
+        except Exception as e:
+            # An error response still leaves the connection in the pool.
+            if not isinstance(e, self._api_status_error):
+                print(f"[Clients] Warm-up request failed: {e}")
+
+    async def _keepalive_loop(self):
+        while True:
+            await asyncio.sleep(self.keepalive_interval)
+            if time.monotonic() - self.last_request_at >= self.keepalive_interval:
+                await self.warm()
+
+    async def _on_request(self, request):
+        self.requests += 1
+        self.last_request_at = time.monotonic()
+        request.extensions["trace"] = self._trace
+
+    async def _trace(self, event, info):
+        # httpcore reports connection setup only when a request could not reuse a pooled connection.
+        if event == "connection.connect_tcp.complete":
+            self.connections_opened += 1
+        elif event == "connection.start_tls.complete":
+            self.tls_handshakes += 1
+
+    def stats(self):
+        reused = max(0, self.requests - self.connections_opened)
+        return {
+            "requests": self.requests,
+            "connections_opened": self.connections_opened,
+            "tls_handshakes": self.tls_handshakes,
+            "reused": reused,
+            "reuse_rate": round(reused / self.requests, 3) if self.requests else 0.0,
+            "warmups": self.warmups,
+            "http2": self.http2,
+        }
+
+    def report(self):
+        print(f"[Clients] OpenAI {self.stats()}")
+
+
+class DeepgramSupervisor:
+    """
+    Owns the Deepgram websocket connections and keeps them alive.
+
+    Audio reaches a connection through the supervisor, so a connection can be
+    replaced without the AudioFanout noticing. Every heartbeat_interval
+    seconds each connection is checked and sent a KeepAlive (which also keeps
+    connections idled by a LanguageGate open). A connection that closes or
+    fails is reopened with exponential backoff; its ring reader is rewound by
+    replay_seconds so speech during the outage is transcribed, and its clock
+    restarts to match the new connection's timestamps.
+    """
+
+    def __init__(self, deepgram, audio_fanout=None, heartbeat_interval=5.0, replay_seconds=2.0, max_backoff=10.0):
+        self.deepgram = deepgram
+        self.audio_fanout = audio_fanout
+        self.heartbeat_interval = heartbeat_interval
+        self.replay_seconds = replay_seconds
+        self.max_backoff = max_backoff
+        self.connections = {}
+        self.counters = {}
+        self._specs = {}
+        self._reconnecting = {}
+        self._stopping = False
+        self._heartbeat_task = None
+
+    async def add(self, name, options, addons=None, setup=None):
+        """
+        Open a supervised connection. setup(connection) registers event
+        handlers and is called again for every replacement connection.
+        Returns False if the first connection attempt fails.
+        """
+        self._specs[name] = (options, addons, setup)
+        self.counters[name] = {"connects": 0, "reconnects": 0, "failures": 0, "heartbeats": 0}
+        connection = await self._connect(name)
+        if connection is None:
+            return False
+        self.connections[name] = connection
+        if self.audio_fanout is not None:
+            self.audio_fanout.add_connection(name, self._sender(name))
+        return True
+
+    async def start(self):
+        self._heartbeat_task = asyncio.create_task(self._heartbeat_loop(), name="deepgram-heartbeat")
+
+    async def stop(self):
+        self._stopping = True
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+        tasks = [t for t in [self._heartbeat_task, *self._reconnecting.values()] if t is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for connection in self.connections.values():
+            try:
+                await connection.finish()
+            except Exception as e:
+                print(f"[Deepgram] Error closing connection: {e}")
+
+    async def _connect(self, name):
+        options, addons, setup = self._specs[name]
+        connection = self.deepgram.listen.asyncwebsocket.v("1")
+        if setup is not None:
+            setup(connection)
+        connection.on(LiveTranscriptionEvents.Close, self._on_lost(name, connection, closed=True))
+        connection.on(LiveTranscriptionEvents.Error, self._on_lost(name, connection, closed=False))
+        try:
+            connected = await connection.start(options, addons=addons)
+        except Exception as e:
+            print(f"[Deepgram {name}] Connect failed: {e}")
+            connected = False
+        if not connected:
+            self.counters[name]["failures"] += 1
+            return None
+        self.counters[name]["connects"] += 1
+        return connection
+
+    def _sender(self, name):
+        async def send(chunk):
+            if name in self._reconnecting:
+                return False
+            return await self.connections[name].send(chunk)
+        return send
+
+    def _on_lost(self, name, connection, closed):
+        async def lost(*args, **kwargs):
+            if self.connections.get(name) is not connection:
+                return
+            # Not every error ends the connection.
+            if closed or not await connection.is_connected():
+                self._schedule_reconnect(name)
+        return lost
+
+    def _schedule_reconnect(self, name):
+        if self._stopping or name in self._reconnecting:
+            return
+        self._reconnecting[name] = asyncio.create_task(self._reconnect(name), name=f"deepgram-reconnect-{name}")
+
+    async def _reconnect(self, name):
+        backoff = 0.5
+        old = self.connections.get(name)
+        try:
+            if old is not None:
+                try:
+                    await old.finish()
+                except Exception:
+                    pass
+            while not self._stopping:
+                connection = await self._connect(name)
+                if connection is not None:
+                    self.connections[name] = connection
+                    self.counters[name]["reconnects"] += 1
+                    if self.audio_fanout is not None:
+                        self.audio_fanout.readers[name].restart_stream(self.replay_seconds)
+                    print(f"[Deepgram {name}] Reconnected")
+                    return
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+        finally:
+            self._reconnecting.pop(name, None)
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            for name, connection in list(self.connections.items()):
+                if name in self._reconnecting:
+                    continue
+                try:
+                    alive = await connection.is_connected() and await connection.keep_alive()
+                except Exception:
+                    alive = False
+                if alive:
+                    self.counters[name]["heartbeats"] += 1
+                else:
+                    print(f"[Deepgram {name}] Connection lost, reconnecting")
+                    self._schedule_reconnect(name)
+
+    def stats(self):
+        return {name: dict(counters, connected=name not in self._reconnecting)
+                for name, counters in self.counters.items()}
+
+    def report(self):
+        for name, stats in self.stats().items():
+            print(f"[Deepgram {name}] {stats}")
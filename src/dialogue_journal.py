@@ -0,0 +1,188 @@
+# dialogue_journal.py
+import json
+import os
+import queue
+import threading
+import time
+
+# Sentinel pushed onto the queue to stop the writer thread.
+_STOP = object()
+
+
+class DialogueJournal:
+    """
+    Append-only persistence for DialogueAggregator.
+
+    Every entry is written as one JSON line to a journal file by a background
+    writer thread, so appending costs O(1) regardless of history length. The
+    journal is folded back into the JSON snapshot file on shutdown.
+
+    A new journal starts with a header recording how many entries the
+    snapshot held, so journal record i is entry header + i. If a crash lands
+    between replacing the snapshot and removing the journal, records the new
+    snapshot already contains are skipped instead of loaded twice. A record
+    torn by a crash is cut off the journal before the next session appends.
+    """
+
+    def __init__(self, snapshot_filename, journal_filename=None, max_queue=1024,
+                 batch_size=64, fsync_interval=0.5):
+        self.snapshot_filename = snapshot_filename
+        if journal_filename is None:
+            journal_filename = os.path.splitext(snapshot_filename)[0] + ".jsonl"
+        self.journal_filename = journal_filename
+        self.batch_size = batch_size
+        self.fsync_interval = fsync_interval
+        # Bounded so a stalled disk applies backpressure instead of growing memory.
+        self.queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._file = None
+        self._snapshot_entries = 0  # Entries in the snapshot as last loaded or compacted.
+        self._valid_length = None   # End of the last intact record, if load() found a torn or unterminated tail.
+
+    def load(self):
+        """Return the snapshot entries followed by any entries replayed from the journal."""
+        entries = []
+        if os.path.exists(self.snapshot_filename):
+            with open(self.snapshot_filename, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        self._snapshot_entries = len(entries)
+        self._valid_length = None
+        if os.path.exists(self.journal_filename):
+            # Journals written before the header existed always follow the current snapshot.
+            position = len(entries)
+            first = True
+            offset = 0
+            with open(self.journal_filename, "rb") as f:
+                for raw in f:
+                    line = raw.strip()
+                    if not line:
+                        offset += len(raw)
+                        continue
+                    try:
+                        record = json.loads(line.decode("utf-8"))
+                    except ValueError:
+                        # A torn final line from a crash; everything before it is intact.
+                        print(f"Skipping truncated journal record in {self.journal_filename}")
+                        self._valid_length = offset
+                        break
+                    offset += len(raw)
+                    if not raw.endswith(b"\n"):
+                        # Intact but unterminated: the newline is restored before appending.
+                        self._valid_length = offset
+                    if first and isinstance(record, dict) and "snapshot_entries" in record:
+                        position = record["snapshot_entries"]
+                        first = False
+                        continue
+                    first = False
+                    # Already in the snapshot when a compaction was interrupted before removing the journal.
+                    if position >= len(entries):
+                        entries.append(record)
+                    position += 1
+        return entries
+
+    def start(self):
+        """Open the journal for appending and start the writer thread."""
+        if self._thread is not None:
+            return
+        if self._valid_length is not None:
+            # Appending after a torn record would glue the next one onto it and lose both.
+            with open(self.journal_filename, "r+b") as f:
+                f.truncate(self._valid_length)
+                if self._valid_length:
+                    f.seek(self._valid_length - 1)
+                    if f.read(1) != b"\n":
+                        f.write(b"\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._valid_length = None
+        self._file = open(self.journal_filename, "a", encoding="utf-8")
+        if self._file.tell() == 0:
+            self._file.write(json.dumps({"snapshot_entries": self._snapshot_entries}) + "\n")
+            self._file.flush()
+        self._thread = threading.Thread(target=self._writer_loop, name="dialogue-journal", daemon=True)
+        self._thread.start()
+
+    def append(self, entry):
+        """Queue an entry for writing. Blocks only if the writer has fallen max_queue entries behind."""
+        self.queue.put(entry)
+
+    def _writer_loop(self):
+        last_fsync = time.monotonic()
+        dirty = False
+        while True:
+            try:
+                item = self.queue.get(timeout=self.fsync_interval)
+            except queue.Empty:
+                item = None
+
+            stop = item is _STOP
+            batch = [] if item is None or stop else [item]
+            # Drain whatever else is already waiting so one write covers the burst.
+            while not stop and len(batch) < self.batch_size:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+
+            if batch:
+                try:
+                    self._file.write("".join(json.dumps(e, ensure_ascii=False) + "\n" for e in batch))
+                    self._file.flush()
+                    dirty = True
+                except Exception as e:
+                    print(f"Error writing dialogue journal: {e}")
+
+            now = time.monotonic()
+            if dirty and (stop or now - last_fsync >= self.fsync_interval):
+                try:
+                    os.fsync(self._file.fileno())
+                except Exception as e:
+                    print(f"Error syncing dialogue journal: {e}")
+                last_fsync = now
+                dirty = False
+
+            if stop:
+                return
+
+    def close(self, entries):
+        """Stop the writer, then compact the full entry list into the snapshot file."""
+        if self._thread is not None:
+            self.queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+            self._file.close()
+            self._file = None
+        self.compact(entries)
+
+    def compact(self, entries):
+        """Atomically rewrite the snapshot with all entries and truncate the journal."""
+        tmp_filename = self.snapshot_filename + ".tmp"
+        with open(tmp_filename, "w", encoding="utf-8") as f:
+            json.dump(entries, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_filename, self.snapshot_filename)
+        # The new snapshot must be durable before the journal it replaces goes away.
+        _fsync_directory(self.snapshot_filename)
+        self._snapshot_entries = len(entries)
+        if os.path.exists(self.journal_filename):
+            os.remove(self.journal_filename)
+            _fsync_directory(self.journal_filename)
+
+
+def _fsync_directory(filename):
+    """Persist a rename or removal in filename's directory (a no-op where directories cannot be opened)."""
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(filename)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
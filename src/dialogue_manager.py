@@ -1,56 +1,431 @@
 # dialogue_manager.py
-import threading
-import os
 import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from dialogue_journal import DialogueJournal
+from dialogue_store import DialogueEntry, DialogueStore
+from prompt_window import PromptWindow, SYSTEM_PROMPT
 
 class DialogueAggregator:
-    def __init__(self, expected_languages, filename="dialogue_entries.json"):
+    """
+    Collects the dialogue from every language connection.
+
+    Finals from the different language connections describe the same audio, so
+    they are first held as pending utterances keyed by utterance_id and aligned
+    by their audio time windows. An utterance is committed, using the
+    transcription with the highest confidence, once every expected language has
+    reported it (only the active ones, when a LanguageGate idles some
+    connections) or its merge window expires.
+
+    The windows of recently committed utterances are kept, so a final that
+    arrives after its utterance was committed (a slow secondary connection,
+    or one that split the speech differently) is absorbed into it instead of
+    becoming a second entry. Likewise a second final of one language that
+    covers the same audio as a pending utterance is added to it.
+
+    Committed lines and GPT responses are kept as DialogueEntry objects in a
+    DialogueStore, indexed by utterance id, speaker and time.
+
+    With background_load, the saved history is read on a worker thread so
+    startup does not wait for it; entries added meanwhile are kept after the
+    history, and `loaded` is set once it is in place.
+
+    With a memory_index (see memory_index.py), every entry is also embedded,
+    and each prompt gets up to recall_k older entries that have left the
+    prompt window but are similar to the latest lines.
+    """
+
+    def __init__(self, expected_languages, filename="dialogue_entries.json",
+                 system_prompt=SYSTEM_PROMPT, prompt_token_budget=4000,
+                 merge_window=0.5, merge_tolerance=0.25, background_load=False, memory_index=None, recall_k=4):
         self.expected_languages = expected_languages
+        # Languages whose connections are currently receiving audio; see set_active_languages.
+        self.active_languages = list(expected_languages)
         self.filename = filename
         self.lock = threading.Lock()
-        self.entries = []
+        self.entries = DialogueStore()
+        self.merge_window = merge_window          # Seconds to wait for the other languages.
+        self.merge_tolerance = merge_tolerance    # Audio-time slack when aligning finals.
+        self.pending_utterances = {}              # utterance_id -> pending utterance dict
+        self.committed_windows = deque(maxlen=64)  # {"utterance_id", "start", "end", "trace_id"} of recent commits
+        self.late_finals = 0                      # Finals absorbed into an already committed utterance.
+        # Audio time restarts every run; entries are told apart by the wall-clock time their session began.
+        self.session = round(time.time(), 3)
+        self.journal = DialogueJournal(filename)
+        self.prompt_window = PromptWindow(system_prompt, token_budget=prompt_token_budget)
+        # Rolling summary of entries[:summary_upto], stored next to the raw log.
+        self.summary_filename = os.path.splitext(filename)[0] + ".summary.json"
+        self.summary = None
+        self.summary_upto = 0
+        self.last_activity = time.monotonic()
+        self.memory_index = memory_index
+        self.recall_k = recall_k
+        self._memory_ready = False
+        self.loaded = threading.Event()
+        self.load_seconds = None
+        self._loader = None
+        if background_load:
+            self._loader = threading.Thread(target=self._load, name="dialogue-load", daemon=True)
+            self._loader.start()
+        else:
+            self._load()
+
+    def _load(self):
+        started = time.perf_counter()
         self._load_entries()
+        self._load_summary()
+        # Only now: the journal must not be appended to while it is being read.
+        self.journal.start()
+        self.load_seconds = time.perf_counter() - started
+        self.loaded.set()
+        # Embedding a long unindexed history can take a while; until then recall sees the rows done so far.
+        if self.memory_index is not None:
+            self._open_memory()
 
     def _load_entries(self):
-        """Load dialogue entries from file if it exists."""
-        if os.path.exists(self.filename):
-            try:
-                with open(self.filename, "r", encoding="utf-8") as f:
-                    self.entries = json.load(f)
-                print(f"Loaded {len(self.entries)} entries from {self.filename}")
-            except Exception as e:
-                print(f"Error loading dialogue entries: {e}")
+        """Load dialogue entries from the snapshot file and replay the journal."""
+        try:
+            # Logs written before entries were structured hold plain formatted lines.
+            history = [DialogueEntry.from_json(data) for data in self.journal.load()]
+        except Exception as e:
+            print(f"Error loading dialogue entries: {e}")
+            return
+        if not history:
+            return
+        # Index and tokenize the history without the lock, so live entries are not held up meanwhile.
+        window = self.prompt_window
+        store = DialogueStore(history)
+        prompt_window = PromptWindow(window.system_prompt, window.token_budget, window.trim_slack)
+        for entry in history:
+            prompt_window.append_entry(entry)
+        with self.lock:
+            # Entries added while loading follow the history.
+            for entry in self.entries:
+                store.append(entry)
+                prompt_window.append_entry(entry)
+            if self.prompt_window.token_budget != prompt_window.token_budget:
+                prompt_window.set_token_budget(self.prompt_window.token_budget)
+            self.entries = store
+            self.prompt_window = prompt_window
+        print(f"Loaded {len(history)} entries from {self.filename}")
 
-    def _save_entries(self):
-        """Persist dialogue entries to file."""
+    def _open_memory(self):
+        with self.lock:
+            texts = [entry.render() for entry in self.entries]
+            # Entries added from here on are queued for the index, after the ones it is opened with.
+            self._memory_ready = True
+        try:
+            self.memory_index.open(texts)
+            self.memory_index.start()
+        except Exception as e:
+            print(f"Error opening memory index: {e}")
+            self._memory_ready = False
+
+    def _load_summary(self):
+        """Load the rolling summary if one was saved."""
+        if not os.path.exists(self.summary_filename):
+            return
         try:
-            with open(self.filename, "w", encoding="utf-8") as f:
-                json.dump(self.entries, f, ensure_ascii=False, indent=2)
+            with open(self.summary_filename, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            with self.lock:
+                self.summary = data.get("summary")
+                self.summary_upto = min(data.get("upto", 0), len(self.entries))
+                self.prompt_window.set_summary(self.summary, self.summary_upto)
         except Exception as e:
-            print(f"Error saving dialogue entries: {e}")
+            print(f"Error loading dialogue summary: {e}")
+
+    def _save_summary(self):
+        try:
+            tmp_filename = self.summary_filename + ".tmp"
+            with open(tmp_filename, "w", encoding="utf-8") as f:
+                json.dump({"summary": self.summary, "upto": self.summary_upto}, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_filename, self.summary_filename)
+        except Exception as e:
+            print(f"Error saving dialogue summary: {e}")
+
+    def _add_entry(self, entry):
+        # Caller holds the lock.
+        self.entries.append(entry)
+        self.prompt_window.append_entry(entry)
+        self._save_entry(entry)
+        if self._memory_ready:
+            self.memory_index.add(entry.render())
+
+    def _save_entry(self, entry):
+        """Hand a single entry to the background journal writer."""
+        self.journal.append(entry.to_json())
 
     def append_speaker_entry(self, entry):
+        """Add a speaker line, either a DialogueEntry or a formatted "[Speaker: N, Language: L]: text" string."""
+        if isinstance(entry, str):
+            entry = DialogueEntry.parse(entry)
+        with self.lock:
+            self._add_entry(entry)
+            self.last_activity = time.monotonic()
+
+    def add_gpt_response(self, response_text, partial=False):
+        # Responses cut off by a newer request stay in the dialogue, marked as partial.
+        entry = DialogueEntry.gpt(response_text, partial=partial)
+        with self.lock:
+            self._add_entry(entry)
+            self.last_activity = time.monotonic()
+
+    def close(self):
+        """Flush the journal and compact it into the snapshot file."""
+        if self._loader is not None:
+            self._loader.join()
+        with self.lock:
+            try:
+                self.journal.close(self.entries.to_json())
+            except Exception as e:
+                print(f"Error saving dialogue entries: {e}")
+        if self.memory_index is not None:
+            self.memory_index.close()
+
+    def submit_transcription(self, language, speaker_lines, start, end, confidence, trace_id=None, runs=None):
+        """
+        Add one final transcript and return the utterances it completed, each as
+        {"utterance_id", "language", "lines", "trace_id", "created"}. The
+        committed lines are already in entries when this returns. An utterance
+        keeps the trace ID of the first final that reported it. With runs (one
+        per line, see transcription.SpeakerRun) each entry gets its own line's
+        time span and confidence instead of the whole final's.
+
+        A final covering the audio of an utterance that was already committed
+        adds no entry; it is returned as that utterance again, with "late":
+        True, so the caller can tell it needs no new response.
+        """
+        now = time.monotonic()
+        with self.lock:
+            window = self._committed_window(start, end)
+            if window is not None:
+                self.late_finals += 1
+                return [{"utterance_id": window["utterance_id"], "language": language, "lines": list(speaker_lines),
+                         "trace_id": window["trace_id"], "created": now, "late": True}]
+            matches = [
+                u for u in self.pending_utterances.values()
+                if (language not in u["transcriptions"] or _covers(u["start"], u["end"], start, end))
+                and start < u["end"] + self.merge_tolerance and u["start"] < end + self.merge_tolerance
+            ]
+            if matches:
+                utterance = matches[0]
+                # A final spanning several pending utterances means the other
+                # language segmented the speech differently; fold them together.
+                for other in matches[1:]:
+                    for other_language, other_transcription in other["transcriptions"].items():
+                        _merge_transcription(utterance["transcriptions"], other_language, other_transcription)
+                    utterance["start"] = min(utterance["start"], other["start"])
+                    utterance["end"] = max(utterance["end"], other["end"])
+                    del self.pending_utterances[other["utterance_id"]]
+                utterance["start"] = min(utterance["start"], start)
+                utterance["end"] = max(utterance["end"], end)
+                if utterance["trace_id"] is None:
+                    utterance["trace_id"] = trace_id
+            else:
+                utterance = {
+                    "utterance_id": str(uuid.uuid4()),
+                    "start": start,
+                    "end": end,
+                    "deadline": now + self.merge_window,
+                    "created": now,
+                    "trace_id": trace_id,
+                    "transcriptions": {},
+                }
+                self.pending_utterances[utterance["utterance_id"]] = utterance
+            # A second final of the same language here is the rest of that language's transcription.
+            _merge_transcription(utterance["transcriptions"], language,
+                                 {"lines": list(speaker_lines), "confidence": confidence or 0.0,
+                                  "runs": list(runs) if runs else None, "end": end})
+
+            if self._is_complete(utterance):
+                return [self._commit_utterance(utterance["utterance_id"])]
+            return []
+
+    def _committed_window(self, start, end):
+        # Caller holds the lock.
+        for window in reversed(self.committed_windows):
+            if _covers(window["start"], window["end"], start, end):
+                return window
+        return None
+
+    def flush_expired(self, now=None, force=False):
+        """Commit pending utterances whose merge window has passed (or all of them with force)."""
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            expired = [
+                u["utterance_id"] for u in sorted(self.pending_utterances.values(), key=lambda u: u["start"])
+                if force or u["deadline"] <= now
+            ]
+            return [self._commit_utterance(utterance_id) for utterance_id in expired]
+
+    def next_merge_deadline(self):
+        """Monotonic time at which the oldest pending utterance must be committed, or None."""
         with self.lock:
-            self.entries.append(entry)
-            self._save_entries()
+            if not self.pending_utterances:
+                return None
+            return min(u["deadline"] for u in self.pending_utterances.values())
 
-    def add_gpt_response(self, response_text):
+    def set_active_languages(self, languages):
+        """Only wait for languages whose connections are live (see LanguageGate)."""
         with self.lock:
-            self.entries.append(f"[Speaker: GPT] {response_text}")
-            self._save_entries()
+            self.active_languages = list(languages)
+
+    def _is_complete(self, utterance):
+        transcriptions = utterance["transcriptions"]
+        return all(language in transcriptions and self._reaches_end(utterance, transcriptions[language])
+                   for language in self.active_languages)
+
+    def _reaches_end(self, utterance, transcription):
+        # A language that has only reported the start of the utterance may still send the rest.
+        return transcription["end"] >= utterance["end"] - self.merge_tolerance
+
+    def _commit_utterance(self, utterance_id):
+        # Caller holds the lock.
+        utterance = self.pending_utterances.pop(utterance_id)
+
+        def rank(item):
+            language, transcription = item
+            # Ties go to the language listed first (the primary one). A transcription
+            # missing the end of the utterance only wins if no other covers it.
+            order = self.expected_languages.index(language) if language in self.expected_languages else len(self.expected_languages)
+            return (not self._reaches_end(utterance, transcription), -transcription["confidence"], order)
+
+        language, transcription = min(utterance["transcriptions"].items(), key=rank)
+        runs = transcription["runs"]
+        if runs is None or len(runs) != len(transcription["lines"]):
+            entries = [DialogueEntry.parse(line, start=utterance["start"], end=utterance["end"],
+                                           confidence=transcription["confidence"], utterance_id=utterance_id,
+                                           session=self.session)
+                       for line in transcription["lines"]]
+        else:
+            entries = [DialogueEntry("user", run.speaker, run.text, language=language, start=run.start, end=run.end,
+                                     confidence=run.confidence, utterance_id=utterance_id, session=self.session)
+                       for run in runs]
+        for entry in entries:
+            self._add_entry(entry)
+        self.committed_windows.append({"utterance_id": utterance_id, "start": utterance["start"],
+                                       "end": utterance["end"], "trace_id": utterance["trace_id"]})
+        self.last_activity = time.monotonic()
+        return {"utterance_id": utterance_id, "language": language, "lines": transcription["lines"],
+                "trace_id": utterance["trace_id"], "created": utterance["created"]}
 
     def is_entry_complete(self, utterance_id):
+        """True once every active language has reported the utterance (or it was already committed)."""
+        with self.lock:
+            utterance = self.pending_utterances.get(utterance_id)
+            if utterance is None:
+                return True
+            return self._is_complete(utterance)
+
+    def get_prompt_window(self):
+        """Return the pinned system prompt (with any summary) and the newest dialogue that fits the token budget."""
+        with self.lock:
+            return self.prompt_window.pinned_prompt, self.prompt_window.render()
+
+    def get_prompt_messages(self, extra_lines=None):
+        """
+        Like get_prompt_window, plus the window laid out as chat messages with
+        a stable, append-only prefix (see PromptWindow.render_messages).
+        """
+        with self.lock:
+            messages = self.prompt_window.render_messages(extra_lines)
+            system_prompt, conversation_text = self.prompt_window.pinned_prompt, self.prompt_window.render()
+            start = self.prompt_window.start
+            query = self._recall_query(extra_lines, start) if self._memory_ready and self.recall_k and start else None
+        if query:
+            recalled = self.recall(query, limit=start)
+            if recalled:
+                memory = {"role": "system", "content": "Earlier in this conversation:\n" + "\n".join(
+                    entry.render() for entry in recalled)}
+                # Just before the newest user turn, so the cached prefix in front of it is untouched.
+                at = len(messages) - 1 if messages[-1]["role"] == "user" else len(messages)
+                messages = messages[:at] + [memory] + messages[at:]
+        return system_prompt, conversation_text, messages
+
+    def _recall_query(self, extra_lines, start, lines=2):
+        # Caller holds the lock. The newest speaker lines are what the next response is about.
+        if extra_lines:
+            return "\n".join(extra_lines)
+        texts = []
+        for position in range(len(self.entries) - 1, start - 1, -1):
+            entry = self.entries[position]
+            if entry.role == "user":
+                texts.append(entry.text)
+                if len(texts) == lines:
+                    break
+        return "\n".join(reversed(texts))
+
+    def recall(self, query, limit=None, k=None):
+        """Entries before limit most similar to query, oldest first (needs a memory_index)."""
+        hits = self.memory_index.search(query, k or self.recall_k, limit=limit)
+        with self.lock:
+            return [self.entries[row] for row in sorted(row for row, _ in hits)]
+
+    def get_unsummarized_entries(self):
+        """Return the current summary, plus the entries that have left the prompt window but are not summarized yet."""
+        with self.lock:
+            end = self.prompt_window.start
+            return self.summary, self.entries[self.summary_upto:end], end
+
+    def set_summary(self, summary, upto):
+        """Replace the rolling summary, which now covers entries[:upto]."""
         with self.lock:
-            if not self.entries or not isinstance(self.entries[-1], dict) or self.entries[-1].get("utterance_id") != utterance_id:
-                return False
-            entry = self.entries[-1]
-            for lang in self.expected_languages:
-                if lang not in entry.get("transcriptions", {}):
-                    return False
-            return True
+            self.summary = summary
+            self.summary_upto = upto
+            self.prompt_window.set_summary(summary, upto)
+            self._save_summary()
+
+    def set_prompt_token_budget(self, token_budget):
+        with self.lock:
+            self.prompt_window.set_token_budget(token_budget)
+
+    def get_entries(self, utterance_id=None, speaker=None, language=None, start=None, end=None, session=None):
+        """
+        Look up committed entries by utterance id, by speaker ("GPT" for
+        responses), by language or by a [start, end) window of audio time in
+        one session (this one by default).
+        """
+        with self.lock:
+            if utterance_id is not None:
+                return self.entries.by_utterance(utterance_id)
+            if speaker is not None:
+                return self.entries.by_speaker(speaker)
+            if language is not None:
+                return self.entries.by_language(language)
+            if start is not None or end is not None:
+                return self.entries.between(start if start is not None else float("-inf"),
+                                            end if end is not None else float("inf"),
+                                            session if session is not None else self.session)
+            return list(self.entries)
 
     def get_aggregated_dialogue(self):
         with self.lock:
-            # If entries are stored as dicts then you'll need to format them;
-            # here we assume entries are simple strings.
-            return "\n".join(self.entries)
+            return self.entries.render()
+
+
+def _covers(window_start, window_end, start, end):
+    """True if at least half of [start, end] lies inside the window (the final is about the same audio)."""
+    if end <= start:
+        return window_start <= start <= window_end
+    overlap = min(end, window_end) - max(start, window_start)
+    return overlap >= 0.5 * (end - start)
+
+
+def _merge_transcription(transcriptions, language, transcription):
+    """Add a transcription to an utterance's, appending to one the language already has."""
+    existing = transcriptions.get(language)
+    if existing is None:
+        transcriptions[language] = transcription
+        return
+    existing["lines"] = existing["lines"] + transcription["lines"]
+    if existing["runs"] is not None and transcription["runs"] is not None:
+        existing["runs"] = existing["runs"] + transcription["runs"]
+    else:
+        existing["runs"] = None
+    existing["confidence"] = (existing["confidence"] + transcription["confidence"]) / 2
+    existing["end"] = max(existing["end"], transcription["end"])
@@ -0,0 +1,175 @@
+# dialogue_store.py
+import bisect
+import re
+import sys
+
+# "[Speaker: 0, Language: en-US]: text", "[Speaker: GPT] text" or "[Speaker: GPT, partial] text".
+_LINE = re.compile(r"^\[Speaker: (?P<speaker>[^,\]]+)(?:, Language: (?P<language>[^\]]+))?(?P<partial>, partial)?\]:? ?")
+
+
+class DialogueEntry:
+    """
+    One line of the dialogue: a speaker's transcribed line or a GPT response.
+
+    role is "user" for speakers and "assistant" for GPT. start and end are
+    audio time, which restarts at 0 every session, so timed entries also carry
+    session: the wall-clock time the session began. The prompt text of an
+    entry is rendered once and cached; the JSON form written to the dialogue
+    log only carries the fields that are set.
+    """
+
+    __slots__ = ("role", "speaker", "language", "text", "start", "end", "confidence", "utterance_id",
+                 "session", "partial", "_rendered")
+
+    def __init__(self, role, speaker, text, language=None, start=None, end=None, confidence=None,
+                 utterance_id=None, session=None, partial=False):
+        self.role = role
+        # Speakers and languages repeat on every line; share one string object for each.
+        self.speaker = sys.intern(str(speaker))
+        self.language = sys.intern(language) if language else None
+        self.text = text
+        self.start = start
+        self.end = end
+        self.confidence = confidence
+        self.utterance_id = utterance_id
+        self.session = session
+        self.partial = partial
+        self._rendered = None
+
+    @classmethod
+    def gpt(cls, text, partial=False):
+        return cls("assistant", "GPT", text, partial=partial)
+
+    @classmethod
+    def parse(cls, line, **fields):
+        """Build an entry from a formatted line such as a transcription handler's speaker line."""
+        match = _LINE.match(line)
+        if match is None:
+            return cls("user", "?", line, **fields)
+        speaker = match.group("speaker").strip()
+        if speaker == "GPT":
+            return cls("assistant", speaker, line[match.end():], partial=match.group("partial") is not None)
+        fields.setdefault("language", match.group("language"))
+        entry = cls("user", speaker, line[match.end():], **fields)
+        entry._rendered = line
+        return entry
+
+    @classmethod
+    def from_json(cls, data):
+        """Load an entry from the dialogue log; older logs store plain formatted lines."""
+        if isinstance(data, str):
+            return cls.parse(data)
+        return cls(data["role"], data["speaker"], data["text"], language=data.get("language"),
+                   start=data.get("start"), end=data.get("end"), confidence=data.get("confidence"),
+                   utterance_id=data.get("utterance_id"), session=data.get("session"),
+                   partial=data.get("partial", False))
+
+    def to_json(self):
+        data = {"role": self.role, "speaker": self.speaker, "text": self.text}
+        for name in ("language", "start", "end", "confidence", "utterance_id", "session"):
+            value = getattr(self, name)
+            if value is not None:
+                data[name] = value
+        if self.partial:
+            data["partial"] = True
+        return data
+
+    def render(self):
+        """The entry as a prompt line."""
+        if self._rendered is None:
+            if self.role == "assistant":
+                label = "GPT, partial" if self.partial else "GPT"
+                self._rendered = f"[Speaker: {label}] {self.text}"
+            else:
+                self._rendered = f"[Speaker: {self.speaker}, Language: {self.language}]: {self.text}"
+        return self._rendered
+
+    __str__ = render
+
+    def __repr__(self):
+        return f"DialogueEntry({self.render()!r})"
+
+
+class DialogueStore:
+    """
+    Append-only list of DialogueEntry objects with lookup indexes: by
+    utterance id, speaker and language (lists of positions, O(1) to reach)
+    and by (session, start time) (sorted, searched with bisect). Supports
+    len(), iteration, indexing and slicing like the plain list it replaces.
+    """
+
+    def __init__(self, entries=()):
+        self._entries = []
+        self._by_utterance = {}
+        self._by_speaker = {}
+        self._by_language = {}
+        # Parallel sorted lists of (session, start) keys and positions of timed entries.
+        self._keys = []
+        self._positions = []
+        for entry in entries:
+            self.append(entry)
+
+    def append(self, entry):
+        position = len(self._entries)
+        self._entries.append(entry)
+        if entry.utterance_id is not None:
+            self._by_utterance.setdefault(entry.utterance_id, []).append(position)
+        self._by_speaker.setdefault(entry.speaker, []).append(position)
+        if entry.language is not None:
+            self._by_language.setdefault(entry.language, []).append(position)
+        if entry.start is not None:
+            # Sessions start later than the ones before them and entries arrive in time order,
+            # so this is almost always an append.
+            key = (_session_key(entry.session), entry.start)
+            index = bisect.bisect_right(self._keys, key)
+            self._keys.insert(index, key)
+            self._positions.insert(index, position)
+        return position
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __getitem__(self, index):
+        return self._entries[index]
+
+    def has_utterance(self, utterance_id):
+        return utterance_id in self._by_utterance
+
+    def by_utterance(self, utterance_id):
+        return [self._entries[i] for i in self._by_utterance.get(utterance_id, ())]
+
+    def by_speaker(self, speaker):
+        return [self._entries[i] for i in self._by_speaker.get(str(speaker), ())]
+
+    def by_language(self, language):
+        return [self._entries[i] for i in self._by_language.get(language, ())]
+
+    def latest_session(self):
+        """The session of the newest timed entry (None for logs written before sessions were recorded)."""
+        return self._entries[self._positions[-1]].session if self._positions else None
+
+    def between(self, start, end, session=None):
+        """
+        Entries of one session whose start time lies in [start, end), in time
+        order. Audio time restarts every session; by default the latest one.
+        """
+        if session is None:
+            session = self.latest_session()
+        session = _session_key(session)
+        lo = bisect.bisect_left(self._keys, (session, start))
+        hi = bisect.bisect_left(self._keys, (session, end))
+        return [self._entries[i] for i in self._positions[lo:hi]]
+
+    def to_json(self):
+        return [entry.to_json() for entry in self._entries]
+
+    def render(self):
+        return "\n".join(entry.render() for entry in self._entries)
+
+
+def _session_key(session):
+    # Entries from logs without sessions sort before every recorded session.
+    return session if session is not None else 0.0
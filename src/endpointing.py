@@ -0,0 +1,110 @@
+# endpointing.py
+import bisect
+from collections import deque
+
+
+class PauseDistribution:
+    """Sliding window of pause lengths (seconds), kept sorted for quantile lookups."""
+
+    def __init__(self, history=200):
+        self.history = history
+        self._recent = deque()
+        self._sorted = []
+
+    def __len__(self):
+        return len(self._recent)
+
+    def add(self, pause):
+        if len(self._recent) == self.history:
+            old = self._recent.popleft()
+            del self._sorted[bisect.bisect_left(self._sorted, old)]
+        self._recent.append(pause)
+        bisect.insort(self._sorted, pause)
+
+    def quantile(self, q):
+        if not self._sorted:
+            return None
+        index = min(len(self._sorted) - 1, int(q * len(self._sorted)))
+        return self._sorted[index]
+
+
+class AdaptiveEndpointer:
+    """
+    Learns how long each speaker pauses mid-thought and decides how long to wait
+    after a final transcript before calling GPT.
+
+    Pauses between words inside finals, and gaps between consecutive finals of
+    the same speaker that were not separated by an UtteranceEnd event, count as
+    mid-thought pauses. The wait is a high quantile of that distribution, so a
+    speaker who habitually pauses longer gets more time before GPT fires. Time
+    Deepgram already spent detecting silence (endpointing) is subtracted.
+
+    Distributions are kept per (language, speaker): each language connection
+    numbers its speakers on its own and hears the same audio, so pooling them
+    would mix different people and count every pause once per connection.
+    """
+
+    def __init__(self, default_delay=0.2, min_delay=0.1, max_delay=1.5, quantile=0.9,
+                 min_samples=8, min_word_gap=0.15, endpointing=0.3, history=200):
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.min_word_gap = min_word_gap
+        self.endpointing = endpointing
+        self.history = history
+        self.pauses = {}            # (language, speaker) -> PauseDistribution
+        self._last_word_end = {}    # (language, speaker) -> audio time of the last final word
+        self.last_language = None
+        self.last_speaker = None
+        self.last_speech_final = False
+
+    def _distribution(self, key):
+        distribution = self.pauses.get(key)
+        if distribution is None:
+            distribution = self.pauses[key] = PauseDistribution(self.history)
+        return distribution
+
+    def observe_final(self, language, words, speech_final=False):
+        """Record the word timings of one final result."""
+        if not words:
+            return
+        previous_end = None
+        for word in words:
+            speaker = getattr(word, "speaker", "Unknown")
+            start = getattr(word, "start", None)
+            end = getattr(word, "end", None)
+            if start is None or end is None:
+                continue
+            if previous_end is None:
+                previous_end = self._last_word_end.get((language, speaker))
+            if previous_end is not None and start - previous_end >= self.min_word_gap:
+                self._distribution((language, speaker)).add(start - previous_end)
+            previous_end = end
+            self._last_word_end[(language, speaker)] = end
+            self.last_language = language
+            self.last_speaker = speaker
+        self.last_speech_final = speech_final
+
+    def observe_utterance_end(self, language):
+        """Deepgram ended the utterance; the next final starts a new turn, not a pause."""
+        for key in [key for key in self._last_word_end if key[0] == language]:
+            del self._last_word_end[key]
+
+    def delay_for(self, language=None, speaker=None, speech_final=None):
+        """Seconds to wait after the latest final before calling GPT."""
+        if language is None:
+            language = self.last_language
+        if speaker is None:
+            speaker = self.last_speaker
+        if speech_final is None:
+            speech_final = self.last_speech_final
+        distribution = self.pauses.get((language, speaker))
+        if distribution is None or len(distribution) < self.min_samples:
+            return self.default_delay
+        delay = distribution.quantile(self.quantile)
+        if speech_final:
+            # Deepgram already waited `endpointing` seconds of silence before finalizing.
+            delay -= self.endpointing
+        return max(self.min_delay, min(self.max_delay, delay))
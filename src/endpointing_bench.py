@@ -0,0 +1,140 @@
+# endpointing_bench.py
+"""
+Replay benchmark for the GPT trigger delay.
+
+Replays final transcripts (a session recorded by replay.EventRecorder, or a
+synthetic conversation) and compares a fixed debounce against AdaptiveEndpointer:
+
+- wasted: requests fired while the speaker was only pausing mid-thought
+- latency: silence between the end of a turn and the GPT request
+
+Usage:
+    python endpointing_bench.py [--events session_events.jsonl [--language en-US]] [--fixed 0.2] [--quantiles 0.5 0.9]
+"""
+import argparse
+import random
+from types import SimpleNamespace
+from endpointing import AdaptiveEndpointer
+from replay import load_events, percentile
+
+
+def synthetic_finals(turns=400, endpointing=0.3, seed=7):
+    """
+    Generate (words, speech_final, turn_end) finals for two speakers with
+    different mid-thought pause habits, split the way Deepgram endpointing would.
+    """
+    rng = random.Random(seed)
+    # Median mid-thought pause per speaker (seconds).
+    habits = {0: 0.45, 1: 0.9}
+    now = 0.0
+    finals = []
+    for _ in range(turns):
+        speaker = rng.choice(list(habits))
+        words = []
+        for _ in range(rng.randint(1, 4)):
+            for _ in range(rng.randint(2, 8)):
+                length = rng.uniform(0.15, 0.4)
+                words.append(SimpleNamespace(word="w", speaker=speaker, start=now, end=now + length))
+                now += length + rng.uniform(0.02, 0.08)
+            now += rng.lognormvariate(0, 0.4) * habits[speaker]
+        # The turn ends with a long pause before the next speaker.
+        now += rng.uniform(1.5, 3.0)
+        # Split the turn into finals wherever the silence exceeds endpointing.
+        segment = [words[0]]
+        for previous, word in zip(words, words[1:]):
+            if word.start - previous.end >= endpointing:
+                finals.append((segment, True, False))
+                segment = []
+            segment.append(word)
+        finals.append((segment, True, True))
+    return finals
+
+
+def recorded_finals(path, language=None, turn_gap=1.5):
+    """
+    Read the finals of one language (the first recorded one by default) from
+    a session recorded by replay.EventRecorder.
+    """
+    finals = []
+    for event in load_events(path):
+        if language is None:
+            language = event["language"]
+        if event["language"] != language:
+            continue
+        message = event["message"]
+        if message.get("type") == "UtteranceEnd" and finals:
+            words, speech_final, _ = finals[-1]
+            finals[-1] = (words, speech_final, True)
+        if message.get("type") != "Results" or not message.get("is_final"):
+            continue
+        words = [SimpleNamespace(word=w.get("word"), speaker=w.get("speaker"), start=w["start"], end=w["end"])
+                 for w in message["channel"]["alternatives"][0].get("words", [])]
+        if words:
+            finals.append((words, message.get("speech_final", False), False))
+    # Without UtteranceEnd markers, treat a long gap or a speaker change as the end of a turn.
+    for i, (words, speech_final, turn_end) in enumerate(finals[:-1]):
+        following = finals[i + 1][0]
+        if following[0].start - words[-1].end >= turn_gap or following[0].speaker != words[-1].speaker:
+            finals[i] = (words, speech_final, True)
+    if finals:
+        finals[-1] = (finals[-1][0], finals[-1][1], True)
+    return finals
+
+
+def replay(finals, endpointer=None, fixed_delay=0.2, endpointing=0.3):
+    """Simulate when the debouncer fires after each final and score the outcome."""
+    wasted = 0
+    fired = 0
+    latencies = []
+    for i, (words, speech_final, turn_end) in enumerate(finals):
+        if endpointer is not None:
+            endpointer.observe_final("replay", words, speech_final)
+            delay = endpointer.delay_for("replay", words[-1].speaker, speech_final)
+        else:
+            delay = fixed_delay
+        last_end = words[-1].end
+        fire_at = last_end + (endpointing if speech_final else 0.0) + delay
+        next_start = finals[i + 1][0][0].start if i + 1 < len(finals) else float("inf")
+        if endpointer is not None and turn_end:
+            # The turn's UtteranceEnd reaches the endpointer before the next turn's final.
+            endpointer.observe_utterance_end("replay")
+        if next_start <= fire_at:
+            # SpeechStarted or the next final arrives first and restarts the wait.
+            continue
+        fired += 1
+        if turn_end:
+            latencies.append(fire_at - last_end)
+        else:
+            wasted += 1
+    return fired, wasted, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", help="JSONL session recorded by EventRecorder")
+    parser.add_argument("--language", help="language of the recorded finals to use (default: the first recorded)")
+    parser.add_argument("--fixed", type=float, default=0.2, help="fixed debounce delay to compare against")
+    parser.add_argument("--endpointing", type=float, default=0.3, help="Deepgram endpointing, in seconds")
+    parser.add_argument("--quantiles", type=float, nargs="+", default=[0.5, 0.75, 0.9],
+                        help="pause quantiles to try for the adaptive endpointer")
+    args = parser.parse_args()
+
+    finals = recorded_finals(args.events, args.language) if args.events else synthetic_finals(endpointing=args.endpointing)
+    turns = sum(1 for _, _, turn_end in finals if turn_end)
+
+    strategies = [(f"fixed {args.fixed:.2f}s", None)]
+    for quantile in args.quantiles:
+        endpointer = AdaptiveEndpointer(default_delay=args.fixed, endpointing=args.endpointing, quantile=quantile)
+        strategies.append((f"adaptive q{quantile:.2f}", endpointer))
+
+    print(f"{len(finals)} finals, {turns} turns")
+    print(f"{'strategy':<18}{'requests':>10}{'wasted':>10}{'wasted %':>10}{'p50 ms':>10}{'p90 ms':>10}")
+    for name, endpointer in strategies:
+        fired, wasted, latencies = replay(finals, endpointer, args.fixed, args.endpointing)
+        share = wasted / fired if fired else 0.0
+        print(f"{name:<18}{fired:>10}{wasted:>10}{share:>10.0%}"
+              f"{percentile(latencies, 0.5) * 1000:>10.0f}{percentile(latencies, 0.9) * 1000:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+# fake_servers.py
+"""
+Local stand-ins for the OpenAI chat completions endpoint and the Deepgram
+live websocket, for replaying sessions and benchmarking without network access.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import deque
+from urllib.parse import parse_qs, urlparse
+from websockets.asyncio.server import serve
+
+DEFAULT_RESPONSE = "/say English Sure, that makes sense. What happened next?"
+
+
+class FakeChatCompletionsServer:
+    """
+    Streams chat completions over SSE with configurable token timing.
+
+    Point an OpenAI client at `base_url`. Every request is recorded in
+    `requests` as {"received": monotonic time, "body": request JSON}.
+    connect_delay stands in for TCP/TLS setup on each new connection, and
+    connections idle for idle_timeout seconds are closed, like a real
+    endpoint's load balancer would. `connections` counts accepted connections.
+
+    With stream_options.include_usage, a final usage chunk reports prompt
+    tokens (~4 characters each) and, like OpenAI's prompt caching, counts as
+    cached the prefix shared with a recent request, in 128-token blocks once
+    it reaches 1024 tokens.
+    """
+
+    def __init__(self, response_text=DEFAULT_RESPONSE, first_token_delay=0.3, token_interval=0.02,
+                 host="127.0.0.1", port=0, connect_delay=0.0, idle_timeout=None):
+        self.response_text = response_text
+        self.first_token_delay = first_token_delay
+        self.token_interval = token_interval
+        self.connect_delay = connect_delay
+        self.idle_timeout = idle_timeout
+        self.connections = 0
+        self.requests = []
+        self._recent_prompts = deque(maxlen=64)
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-openai", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def tokens(self, body):
+        """Split the canned response into word-sized deltas; override for other behaviour."""
+        words = self.response_text.split(" ")
+        return [word if i == 0 else " " + word for i, word in enumerate(words)]
+
+    def usage(self, body):
+        """Simulated prompt/cached token counts for a request."""
+        prompt = "".join(json.dumps(message, ensure_ascii=False) for message in body.get("messages", []))
+        shared = max((len(os.path.commonprefix([prompt, previous])) for previous in self._recent_prompts), default=0)
+        self._recent_prompts.append(prompt)
+        prompt_tokens = max(1, len(prompt) // 4)
+        cached_tokens = shared // 4 // 128 * 128
+        if cached_tokens < 1024:
+            cached_tokens = 0
+        completion_tokens = len(self.tokens(body))
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached_tokens},
+        }
+
+    def _make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            timeout = fake.idle_timeout
+
+            def setup(self):
+                fake.connections += 1
+                if fake.connect_delay:
+                    time.sleep(fake.connect_delay)
+                super().setup()
+
+            def do_GET(self):
+                # models.list(), used to warm connections.
+                self._send_payload({"object": "list", "data": [{"id": "fake", "object": "model", "owned_by": "fake"}]})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                fake.requests.append({"received": time.monotonic(), "body": body})
+                if not body.get("stream"):
+                    self._send_json(body)
+                    return
+                # Computed on arrival, so a stream the client closes early still warms the cache.
+                usage = fake.usage(body)
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                try:
+                    time.sleep(fake.first_token_delay)
+                    for i, token in enumerate(fake.tokens(body)):
+                        if i:
+                            time.sleep(fake.token_interval)
+                        self._send_event(_chunk(body, {"content": token}))
+                    self._send_event(_chunk(body, {}, finish_reason="stop"))
+                    if (body.get("stream_options") or {}).get("include_usage"):
+                        self._send_event(dict(_chunk(body, {}), choices=[], usage=usage))
+                    self._send_chunk(b"data: [DONE]\n\n")
+                    self._send_chunk(b"")
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client cancelled the stream.
+                    pass
+
+            def _send_json(self, body):
+                self._send_payload({
+                    "id": "chatcmpl-fake",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body.get("model", "fake"),
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": fake.response_text}}],
+                })
+
+            def _send_payload(self, data):
+                payload = json.dumps(data).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _send_event(self, payload):
+                self._send_chunk(b"data: " + json.dumps(payload).encode() + b"\n\n")
+
+            def _send_chunk(self, data):
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.flush()
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def _chunk(body, delta, finish_reason=None):
+    return {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": body.get("model", "fake"),
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+
+
+class FakeDeepgramServer:
+    """
+    Websocket server that speaks the Deepgram live protocol from a script.
+
+    It accepts linear16 audio and emits each scripted message once the audio
+    it has received reaches that message's audio time (the end of a Results
+    window, an UtteranceEnd's last_word_end, a SpeechStarted timestamp). The
+    script is a list of replay events (see replay.py); each connection gets
+    the events for the `language` in its query string.
+    """
+
+    def __init__(self, events, bytes_per_second=32000, host="127.0.0.1", port=0):
+        self.events = events
+        self.bytes_per_second = bytes_per_second
+        self.host = host
+        self.port = port
+        self.audio_bytes = {}
+        self._server = None
+
+    @property
+    def url(self):
+        """Value for DeepgramClientOptions(url=...)."""
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        self._server = await serve(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _handle(self, websocket):
+        query = parse_qs(urlparse(websocket.request.path).query)
+        language = query.get("language", [""])[0]
+        script = sorted(
+            ((_audio_time(event), event["message"]) for event in self.events
+             if event.get("language") == language and _audio_time(event) is not None),
+            key=lambda item: item[0],
+        )
+        received = 0
+        sent = 0
+        async for message in websocket:
+            if isinstance(message, (bytes, bytearray, memoryview)):
+                received += len(message)
+                self.audio_bytes[language] = received
+                seconds = received / self.bytes_per_second
+                while sent < len(script) and script[sent][0] <= seconds:
+                    await websocket.send(json.dumps(script[sent][1]))
+                    sent += 1
+                continue
+            control = json.loads(message).get("type")
+            if control in ("Finalize", "CloseStream"):
+                for _, scripted in script[sent:]:
+                    await websocket.send(json.dumps(scripted))
+                sent = len(script)
+            if control == "CloseStream":
+                await asyncio.sleep(0)
+                await websocket.close()
+                return
+
+
+def _audio_time(event):
+    message = event["message"]
+    kind = message.get("type")
+    if kind == "Results":
+        return message.get("start", 0.0) + message.get("duration", 0.0)
+    if kind == "UtteranceEnd":
+        return message.get("last_word_end", 0.0)
+    if kind == "SpeechStarted":
+        return message.get("timestamp", 0.0)
+    return None
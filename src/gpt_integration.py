@@ -1,77 +1,252 @@
 # gpt_integration.py
+import asyncio
 import os
-import openai
-from dotenv import load_dotenv
+import time
+from collections import deque
+from output_sink import OutputSink, default_sink
+from prompt_window import SYSTEM_PROMPT, count_tokens
+from say_parser import SayParser
+from tracing import tracer
 
-load_dotenv()
-openai.api_key = os.getenv("OPENAI_API_KEY")
+# Shared client for callers that do not pass their own (see clients.ClientManager); created on first use.
+client = None
 
-def stream_gpt4_response(conversation_text: str, handler, request_id: int):
+
+def default_client():
+    global client
+    if client is None:
+        # The openai package takes most of a second to import; only pay for it when a client is needed.
+        import openai
+        client = openai.AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    return client
+
+
+class StreamMetrics:
+    """
+    Counters for GPT requests, including tokens spent on streams that were
+    cancelled, plus recent latency samples in seconds.
+    """
+
+    def __init__(self, max_samples=4096):
+        self.requests_started = 0
+        self.requests_completed = 0
+        self.requests_cancelled = 0
+        # Streams closed early because the response was /say Nothing or /pausing.
+        self.requests_aborted = 0
+        # Speculative responses dropped because no final confirmed them within commit_timeout.
+        self.requests_unconfirmed = 0
+        self.completion_tokens = 0
+        # Prompt and completion tokens of cancelled requests whose output was cut short.
+        self.wasted_prompt_tokens = 0
+        self.wasted_completion_tokens = 0
+        # Prompt tokens reported by the provider, and how many were served from its prefix cache.
+        self.prompt_tokens = 0
+        self.cached_prompt_tokens = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # Prompt tokens that repeated the previous request's messages exactly (PromptWindow's estimate).
+        self.stable_prefix_tokens = 0
+        # Last transcript final -> GPT request started.
+        self.trigger_latencies = deque(maxlen=max_samples)
+        # GPT request started -> first / last streamed token.
+        self.first_token_latencies = deque(maxlen=max_samples)
+        self.last_token_latencies = deque(maxlen=max_samples)
+
+    def as_dict(self):
+        return {key: list(value) if isinstance(value, deque) else value for key, value in self.__dict__.items()}
+
+    def report(self):
+        print(
+            f"[GPT metrics] started={self.requests_started} completed={self.requests_completed} "
+            f"cancelled={self.requests_cancelled} aborted={self.requests_aborted} "
+            f"unconfirmed={self.requests_unconfirmed} completion_tokens={self.completion_tokens} "
+            f"wasted_prompt_tokens={self.wasted_prompt_tokens} "
+            f"wasted_completion_tokens={self.wasted_completion_tokens} "
+            f"prompt_tokens={self.prompt_tokens} cached_prompt_tokens={self.cached_prompt_tokens} "
+            f"cache_hits={self.cache_hits} cache_misses={self.cache_misses} "
+            f"stable_prefix_tokens={self.stable_prefix_tokens}"
+        )
+
+    def record_usage(self, usage):
+        """Account the usage block of a finished stream."""
+        self.prompt_tokens += usage.prompt_tokens or 0
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = (getattr(details, "cached_tokens", None) or 0) if details is not None else 0
+        self.cached_prompt_tokens += cached
+        if cached:
+            self.cache_hits += 1
+        else:
+            self.cache_misses += 1
+
+
+async def stream_gpt4_response(conversation_text: str, aggregator, request_id: int, system_prompt: str = SYSTEM_PROMPT,
+                               metrics: StreamMetrics = None, commit_gate: asyncio.Event = None, trace_id=None,
+                               sink: OutputSink = None, on_segment=None, on_complete=None, openai_client=None,
+                               limiter: asyncio.Semaphore = None, messages=None, commit_timeout=5.0):
     """
-    Streams a GPT‑4 response based on the aggregated dialogue.
+    Streams a GPT‑4 response based on the prompt window of the aggregated dialogue.
     The system prompt instructs GPT‑4 to choose which language to respond in,
     and if it wants to speak, to begin its message with "/say <Language> <text>".
+    Cancelling the task running this coroutine closes the stream immediately;
+    whatever was received so far is kept in the dialogue, marked as partial.
+    A speculative request passes a commit_gate: its response is only stored
+    once the gate is set, and is discarded if it is cancelled before that, or
+    if the gate is still unset commit_timeout seconds after the stream ended
+    (the interim text it was built from never became a final).
+    The request is traced under trace_id (see tracing.py).
+    Output goes to sink (the shared ConsoleSink by default); the full prompt
+    is only written when the sink is in debug mode.
+
+    The response is parsed as it streams (see say_parser.py): /say Nothing and
+    /pausing close the stream as soon as they are recognised, and each complete
+    sentence of a /say response is passed to on_segment(request_id, language,
+    text). Segments of a speculative request are held back until its commit
+    gate is set. With on_complete, a /say response is handed to
+    on_complete(request_id, response_text, partial) instead of the aggregator,
+    so a TTS stage can store only the part that was actually spoken.
+
+    openai_client overrides the module-level client, and a limiter shared
+    between sessions caps how many streams are open at once.
+
+    messages (see PromptWindow.render_messages) replaces the default system +
+    single user message layout with an append-only one whose prefix the
+    provider can cache; the usage block requested at the end of the stream
+    feeds the cache hit/miss counters in metrics.
     """
-    # Print the full dialogue (including previous Person 1 and GPT responses).
-    print("\n[New GPT Call Initiated]")
-    print("Full GPT Dialogue:")
-    print(conversation_text)
-    
-    print("\nStreaming GPT‑4 Response:")
-    response_text = ""
-    partial_word = ""
-    
+    if metrics is None:
+        metrics = StreamMetrics()
+    if sink is None:
+        sink = default_sink()
+    if messages is None:
+        messages = [
+            {
+                "role": "system",
+                "content": system_prompt
+            },
+            {"role": "user", "content": conversation_text}
+        ]
+    metrics.requests_started += 1
+    sink.line("\n[New GPT Call Initiated]")
+    if sink.debug:
+        # The full dialogue (including previous speaker and GPT turns).
+        sink.line("Full GPT Dialogue:")
+        sink.line(conversation_text)
+
+    sink.line("\nStreaming GPT‑4 Response:")
+    # Deltas are collected and joined once, instead of growing a string per chunk.
+    parts = []
+    held_segments = []
+
+    def deliver(language, text):
+        if on_segment is None:
+            return
+        if commit_gate is not None and not commit_gate.is_set():
+            held_segments.append((language, text))
+            return
+        while held_segments:
+            on_segment(request_id, *held_segments.pop(0))
+        on_segment(request_id, language, text)
+
+    parser = SayParser(deliver)
+
+    response = None
+    request_started = time.monotonic()
+    first_token_at = None
+    span = tracer.begin("gpt.request", trace_id, request_id=request_id, speculative=commit_gate is not None)
+    status = "error"
+    acquired = False
+
+    def count_wasted(response_text):
+        wasted = count_tokens(response_text) if response_text else 0
+        metrics.completion_tokens += wasted
+        metrics.wasted_completion_tokens += wasted
+        metrics.wasted_prompt_tokens += count_tokens(system_prompt) + count_tokens(conversation_text)
+
     try:
-        response = openai.chat.completions.create(
+        if limiter is not None:
+            await limiter.acquire()
+            acquired = True
+            tracer.record("gpt.limiter_wait", trace_id, request_started, time.monotonic())
+        response = await (openai_client or default_client()).chat.completions.create(
             model="gpt-4o",
-            messages=[
-                {
-                    "role": "system",
-                    "content": (
-                        "You are a conversational partner who is responding to messages in real time."
-                        "You are getting a live audio feed of transcribed messages. Some messages may be segmented in multiple lines."
-                        "Do not interrupt if someone is speaking; wait until they have fully expressed their idea before responding. "
-                        "Chill with the long responses, act like a human."
-                        "There are multiple transcriber bots which will provide transcriptions for each speaker in the following format:\n"
-                        "[Speaker: N, Language: language1]: ...\n"
-                        "[Speaker: N, Language: language2]: ...\n"
-                        "If you don't want to say anything, respond with /say Nothing\n"
-                        "When you respond, choose one appropriate language to use. Begin your message with /say <Language> followed by your response.\n"
-                        "You can think internally before speaking, and if it makes sense to let someone else speak, respond with /pausing\n"
-                    )
-                },
-                {"role": "user", "content": conversation_text}
-            ],
-            stream=True  # Enable streaming mode.
+            messages=messages,
+            stream=True,  # Enable streaming mode.
+            stream_options={"include_usage": True},
         )
-        for chunk in response:
-            if handler.current_gpt_request_id != request_id:
-                print("\n[GPT response cancelled due to a new request]\n")
-                break
-            
+        async for chunk in response:
+            if chunk.usage is not None:
+                # Sent as a final chunk without choices.
+                metrics.record_usage(chunk.usage)
+            if not chunk.choices:
+                continue
             content = chunk.choices[0].delta.content
             if content:
-                text = partial_word + content
-                if text.endswith(" "):
-                    print(text, end="", flush=True)
-                    response_text += text
-                    partial_word = ""
-                else:
-                    words = text.split(" ")
-                    if len(words) > 1:
-                        complete_words = " ".join(words[:-1]) + " "
-                        print(complete_words, end="", flush=True)
-                        response_text += complete_words
-                        partial_word = words[-1]
-                    else:
-                        partial_word = text
-        if partial_word:
-            print(partial_word, end="", flush=True)
-            response_text += partial_word
-        
-        print("\n\n--- End of GPT‑4 Response ---\n")
-        # If the response wasn't cancelled, add it to the aggregator.
-        if handler.current_gpt_request_id == request_id:
-            handler.aggregator.add_gpt_response(response_text)
+                if first_token_at is None:
+                    first_token_at = time.monotonic()
+                    metrics.first_token_latencies.append(first_token_at - request_started)
+                    tracer.record("gpt.first_token", trace_id, request_started, first_token_at)
+                parts.append(content)
+                sink.write(content)
+                if parser.feed(content):
+                    # /say Nothing or /pausing: nothing more worth paying for.
+                    break
+        parser.finish()
+        metrics.last_token_latencies.append(time.monotonic() - request_started)
+        response_text = "".join(parts)
+
+        sink.line("\n\n--- End of GPT‑4 Response ---\n")
+        if commit_gate is not None and not commit_gate.is_set():
+            # The stream is done: give back the connection and the limiter slot while waiting for the final.
+            await response.close()
+            response = None
+            if acquired:
+                limiter.release()
+                acquired = False
+            try:
+                await asyncio.wait_for(commit_gate.wait(), commit_timeout)
+            except asyncio.TimeoutError:
+                sink.line(f"[GPT response {request_id} dropped: no final confirmed it]\n")
+                status = "unconfirmed"
+                metrics.requests_unconfirmed += 1
+                count_wasted(response_text)
+                held_segments.clear()
+                return
+        if commit_gate is not None:
+            for language, text in held_segments:
+                on_segment(request_id, language, text)
+            held_segments.clear()
+        if parser.should_abort:
+            # Store just the command, not whatever followed it in the last chunk.
+            response_text = "/pausing" if parser.command == "pausing" else "/say Nothing"
+            metrics.requests_aborted += 1
+            status = "aborted"
+        else:
+            metrics.requests_completed += 1
+            status = "completed"
+        metrics.completion_tokens += count_tokens(response_text) if response_text else 0
+        if on_complete is not None and parser.command == "say":
+            on_complete(request_id, response_text, False)
+        else:
+            aggregator.add_gpt_response(response_text)
+    except asyncio.CancelledError:
+        sink.line(f"\n[GPT response {request_id} cancelled due to a new request]\n")
+        status = "cancelled"
+        response_text = "".join(parts)
+        metrics.requests_cancelled += 1
+        count_wasted(response_text)
+        if response_text and (commit_gate is None or commit_gate.is_set()):
+            if on_complete is not None and parser.command == "say":
+                on_complete(request_id, response_text, True)
+            else:
+                aggregator.add_gpt_response(response_text, partial=True)
+        raise
     except Exception as e:
-        print(f"Error in GPT‑4 integration: {e}")
+        sink.line(f"Error in GPT‑4 integration: {e}")
+    finally:
+        span.end(status=status)
+        try:
+            if response is not None:
+                await response.close()
+        finally:
+            if acquired:
+                limiter.release()
@@ -0,0 +1,114 @@
+# language_gate.py
+import threading
+import time
+
+
+class LanguageGate:
+    """
+    Decides which language connections receive microphone audio.
+
+    The primary language always streams. Secondary connections stay idle until
+    the primary's finals look like another language is being spoken (low
+    confidence, or Deepgram reporting a different detected language). On
+    activation the last replay_seconds of audio are replayed to the secondary
+    from the shared audio ring so it hears the start of the switch. A
+    secondary with no confident finals for idle_timeout seconds goes idle again.
+
+    Every decision is printed and kept in `decisions`; `stats()` returns counters.
+    """
+
+    def __init__(self, primary, secondaries, replay_seconds=3.0, low_confidence=0.6,
+                 low_confidence_count=2, idle_timeout=15.0, on_change=None):
+        self.primary = primary
+        self.secondaries = list(secondaries)
+        self.replay_seconds = replay_seconds
+        self.low_confidence = low_confidence
+        self.low_confidence_count = low_confidence_count
+        self.idle_timeout = idle_timeout
+        self.on_change = on_change
+        self.lock = threading.Lock()
+        self.active = {language: False for language in self.secondaries}
+        self.decisions = []
+        self._pending_replay = set()
+        self._last_useful = {}
+        self._low_streak = 0
+
+    def active_languages(self):
+        with self.lock:
+            return [self.primary] + [language for language in self.secondaries if self.active[language]]
+
+    def is_active(self, language):
+        """Whether audio should be sent to this language's connection right now."""
+        if language == self.primary:
+            return True
+        with self.lock:
+            if self.active.get(language) and time.monotonic() - self._last_useful[language] > self.idle_timeout:
+                self._set_active(language, False, f"no confident finals for {self.idle_timeout:g}s")
+            return self.active.get(language, False)
+
+    def take_replay(self, language):
+        """Seconds of buffered audio to replay before live audio, once per activation."""
+        with self.lock:
+            if language in self._pending_replay:
+                self._pending_replay.discard(language)
+                return self.replay_seconds
+            return 0.0
+
+    def observe_final(self, language, confidence, detected_language=None):
+        """Feed the confidence (and detected language, if any) of a final from any connection."""
+        with self.lock:
+            if language != self.primary:
+                if self.active.get(language) and confidence >= self.low_confidence:
+                    self._last_useful[language] = time.monotonic()
+                return
+
+            if detected_language and detected_language != self.primary:
+                for secondary in self.secondaries:
+                    if not self.active[secondary] and _same_language(secondary, detected_language):
+                        self._set_active(secondary, True, f"primary detected language {detected_language}")
+                return
+
+            if confidence < self.low_confidence:
+                self._low_streak += 1
+                if self._low_streak >= self.low_confidence_count:
+                    for secondary in self.secondaries:
+                        if not self.active[secondary]:
+                            self._set_active(secondary, True, f"{self._low_streak} low-confidence primary finals ({confidence:.2f})")
+                    self._low_streak = 0
+            else:
+                self._low_streak = 0
+
+    def _set_active(self, language, active, reason):
+        # Caller holds the lock.
+        self.active[language] = active
+        if active:
+            self._pending_replay.add(language)
+            self._last_useful[language] = time.monotonic()
+        else:
+            self._pending_replay.discard(language)
+        decision = {
+            "time": time.time(),
+            "language": language,
+            "action": "activate" if active else "idle",
+            "reason": reason,
+        }
+        self.decisions.append(decision)
+        print(f"[LanguageGate] {decision['action']} {language}: {reason}")
+        if self.on_change is not None:
+            self.on_change([self.primary] + [l for l in self.secondaries if self.active[l]])
+
+    def stats(self):
+        with self.lock:
+            return {
+                "active": dict(self.active),
+                "activations": sum(1 for d in self.decisions if d["action"] == "activate"),
+                "deactivations": sum(1 for d in self.decisions if d["action"] == "idle"),
+            }
+
+    def report(self):
+        print(f"[LanguageGate] {self.stats()}")
+
+
+def _same_language(code, detected):
+    """Compare language codes by their primary subtag ("ru" matches "ru-RU")."""
+    return code.split("-")[0].lower() == detected.split("-")[0].lower()
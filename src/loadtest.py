@@ -0,0 +1,180 @@
+# loadtest.py
+"""
+Load test for server.py: how many concurrent sessions one core sustains.
+
+For each session count, starts server.py as a subprocess pointed at local
+stand-ins for Deepgram and OpenAI (fake_servers.py, running in this process),
+streams `--seconds` of audio into every session in real time, and reports the
+server's CPU time per second of session audio (from the child's rusage) and
+the response latency seen by the clients: audio time of the end of an
+utterance -> first /say sentence received.
+
+The CPU of an idle server run (startup and imports) is measured first and
+subtracted. Sessions per core = 1 / (CPU seconds per session-second).
+
+Usage:
+    python loadtest.py [--sessions 1 4 16] [--seconds 20] [--first-token-ms 300]
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from websockets.asyncio.client import connect
+from audio_ring import BYTES_PER_SECOND
+from fake_servers import FakeChatCompletionsServer, FakeDeepgramServer
+from replay import DEFAULT_DIALOGUE, percentile, synthesize_events
+
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py")
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _children_cpu():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+async def _wait_for_port(port, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError("server did not start")
+
+
+async def run_client(url, seconds, utterance_ends, frame_seconds=0.02):
+    """Stream silence in real time; return the latency of each response's first sentence."""
+    latencies = []
+    seen_requests = set()
+    frame = bytes(int(frame_seconds * BYTES_PER_SECOND))
+    async with connect(url, max_size=2 ** 20) as websocket:
+        ready = json.loads(await websocket.recv())
+        if ready.get("type") != "ready":
+            raise RuntimeError(f"unexpected first message: {ready}")
+        started = time.monotonic()
+
+        async def receive():
+            async for message in websocket:
+                data = json.loads(message)
+                if data.get("type") != "say" or data["request_id"] in seen_requests:
+                    continue
+                seen_requests.add(data["request_id"])
+                now = time.monotonic() - started
+                ended = [end for end in utterance_ends if end <= now]
+                if ended:
+                    latencies.append(now - ended[-1])
+
+        receiver = asyncio.create_task(receive())
+        for i in range(int(seconds / frame_seconds)):
+            await websocket.send(frame)
+            delay = started + (i + 1) * frame_seconds - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        # Let the last responses arrive before closing.
+        await asyncio.sleep(2.0)
+        await websocket.send(json.dumps({"type": "close"}))
+        receiver.cancel()
+        await asyncio.gather(receiver, return_exceptions=True)
+    return latencies
+
+
+async def run_step(sessions, args, deepgram_url, openai_url, utterance_ends):
+    port = _free_port()
+    with tempfile.TemporaryDirectory() as directory:
+        env = dict(os.environ, DEEPGRAM_API_KEY="loadtest", OPENAI_API_KEY="loadtest")
+        cpu_before = _children_cpu()
+        process = subprocess.Popen(
+            [sys.executable, SERVER, "--host", "127.0.0.1", "--port", str(port), "--directory", directory,
+             "--languages", *args.languages, "--deepgram-url", deepgram_url, "--openai-base-url", openai_url,
+             "--max-gpt-streams", str(args.max_gpt_streams)],
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            await _wait_for_port(port)
+            results = await asyncio.gather(*(
+                run_client(f"ws://127.0.0.1:{port}/sessions/load{i}", args.seconds, utterance_ends)
+                for i in range(sessions)
+            ), return_exceptions=True)
+        finally:
+            process.send_signal(signal.SIGINT)
+            await asyncio.to_thread(process.wait)
+        cpu = _children_cpu() - cpu_before
+    errors = [r for r in results if isinstance(r, Exception)]
+    latencies = [latency for r in results if not isinstance(r, Exception) for latency in r]
+    return cpu, latencies, errors
+
+
+async def run(args):
+    events = synthesize_events(args.dialogue, args.languages, max_utterances=args.utterances)
+    events = [e for e in events if e["t"] < args.seconds]
+    utterance_ends = sorted({e["message"]["last_word_end"] + 0.0 for e in events
+                             if e["message"]["type"] == "UtteranceEnd"})
+    chat = FakeChatCompletionsServer(first_token_delay=args.first_token_ms / 1000).start()
+    deepgram = await FakeDeepgramServer(events).start()
+    openai_url = chat.base_url
+    try:
+        idle_cpu, _, _ = await run_step(0, args, deepgram.url, openai_url, utterance_ends)
+        print(f"idle server CPU: {idle_cpu:.2f}s (subtracted)")
+        print(f"{'sessions':>8}{'cpu s':>9}{'cpu/sess-s':>12}{'sess/core':>11}{'replies':>9}"
+              f"{'p50 ms':>9}{'p99 ms':>9}{'errors':>8}")
+        rows = []
+        for sessions in args.sessions:
+            cpu, latencies, errors = await run_step(sessions, args, deepgram.url, openai_url, utterance_ends)
+            per_session_second = max(cpu - idle_cpu, 1e-6) / (sessions * args.seconds)
+            row = {
+                "sessions": sessions,
+                "cpu_seconds": round(cpu - idle_cpu, 3),
+                "cpu_per_session_second": round(per_session_second, 5),
+                "sessions_per_core": round(1 / per_session_second, 1),
+                "replies": len(latencies),
+                "p50_ms": round(percentile(latencies, 0.5) * 1000, 1),
+                "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+                "errors": len(errors),
+            }
+            rows.append(row)
+            print(f"{sessions:>8}{row['cpu_seconds']:>9.2f}{per_session_second:>12.4f}"
+                  f"{row['sessions_per_core']:>11.1f}{row['replies']:>9}{row['p50_ms']:>9.0f}"
+                  f"{row['p99_ms']:>9.0f}{row['errors']:>8}")
+            for error in errors[:3]:
+                print(f"  error: {error!r}")
+        return rows
+    finally:
+        await deepgram.stop()
+        chat.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--seconds", type=float, default=20.0, help="audio streamed per session")
+    parser.add_argument("--languages", nargs="+", default=["en-US", "ru"])
+    parser.add_argument("--dialogue", default=DEFAULT_DIALOGUE,
+                        help="dialogue log the scripted transcripts are synthesized from")
+    parser.add_argument("--utterances", type=int, default=50)
+    parser.add_argument("--first-token-ms", type=float, default=300.0)
+    parser.add_argument("--max-gpt-streams", type=int, default=32)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+    rows = asyncio.run(run(args))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
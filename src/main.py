@@ -1,96 +1,191 @@
 # main.py
+import time
+_launched = time.monotonic()
+import asyncio
 from dotenv import load_dotenv
-from deepgram import DeepgramClient, LiveTranscriptionEvents, LiveOptions, Microphone
-from transcription import TranscriptionHandler
+from deepgram import DeepgramClient, Microphone
+from transcription import TranscriptionHandler, live_options, LIVE_ADDONS
 from dialogue_manager import DialogueAggregator
+from pipeline import GPTPipeline
+from language_gate import LanguageGate
+from audio_ring import AudioFanout
+from tracing import StartupTimer, tracer
+from output_sink import ConsoleSink
+from clients import ClientManager, DeepgramSupervisor
+# Optional features (summarizer, TTS, adaptive endpointing, event recording) and the openai package
+# are imported only when they are used.
+_imported = time.monotonic()
 
 load_dotenv()
 
-def main():
+
+async def start_clients():
+    # Building the manager imports openai, which takes most of a second; do it
+    # on a worker thread while the Deepgram connections are being opened.
+    clients = await asyncio.to_thread(ClientManager)
+    return await clients.start()
+
+
+async def main():
     try:
+        startup = StartupTimer(started=_launched)
+        startup.record("imports", _launched, _imported)
         # List of languages to process – English is primary.
         languages = ["en-US", "ru"]
         primary_language = "en-US"
-        aggregator = DialogueAggregator(expected_languages=languages)
+        # Per-utterance spans and latency histograms (see tracing.py); off by default.
+        enable_tracing = False
+        trace_chrome_path = None  # e.g. "trace.json", to open in chrome://tracing or Perfetto.
+        if enable_tracing:
+            tracer.enabled = True
+            tracer.start_periodic_export(json_path="trace_metrics.json", prometheus_path="trace_metrics.prom")
+        # Upper bound on system prompt + dialogue tokens sent with each GPT call.
+        prompt_token_budget = 4000
+        # Embed every entry into an on-disk index and send the most relevant older turns
+        # (that no longer fit the prompt window) with each GPT call.
+        enable_memory = False
+        memory_recall_k = 4
+        memory_index = None
+        if enable_memory:
+            from memory_index import MemoryIndex
+            memory_index = MemoryIndex("dialogue_entries", mmap=True)
+        # Saved history is read on a background thread; the first GPT call waits for it.
+        aggregator = DialogueAggregator(expected_languages=languages, prompt_token_budget=prompt_token_budget,
+                                        background_load=True, memory_index=memory_index, recall_k=memory_recall_k)
+        # Fold history that no longer fits the prompt window into a rolling summary while idle.
+        enable_summarizer = False
+        summarizer = None
+        if enable_summarizer:
+            from summarizer import ConversationSummarizer
+            summarizer = ConversationSummarizer(aggregator)
+            summarizer.start()
+        # Start GPT requests from stable interim transcripts at likely endpoints.
+        enable_speculation = False
+        # Deepgram endpointing (ms of silence before a final); the endpointer accounts for it.
+        endpointing_ms = 300
+        # Learn each speaker's pauses instead of always firing 0.2 s after a final. Off by
+        # default: it sends fewer requests during mid-thought pauses but answers later
+        # (endpointing_bench.py: trigger p50 875-1449 ms against 500 ms fixed).
+        enable_adaptive_endpointing = False
+        endpointer = None
+        if enable_adaptive_endpointing:
+            from endpointing import AdaptiveEndpointer
+            endpointer = AdaptiveEndpointer(default_delay=0.2, endpointing=endpointing_ms / 1000)
+        # GPT output is written by a background thread; debug also prints the full prompt of every call.
+        log_full_dialogue = False
+        sink = ConsoleSink(debug=log_full_dialogue)
+        # Speak /say responses sentence by sentence; talking over it stops playback.
+        # Use headphones, or the microphone will hear the voice and barge in on it.
+        enable_tts = False
+        tts = None
+        if enable_tts:
+            from tts import TTSStage, Pyttsx3Backend
+            tts = TTSStage(Pyttsx3Backend(), aggregator)
+            await tts.start()
+        # One OpenAI client whose connection is opened at startup and kept warm between turns.
+        # It starts alongside the Deepgram connections, and listening does not wait for it.
+        clients_task = asyncio.create_task(startup.timed("openai", start_clients()))
+        # Single debouncer and GPT task shared by every language connection. Its
+        # OpenAI client is set once ClientManager has started (below).
+        pipeline = GPTPipeline(aggregator, debounce_delay=0.2, speculative=enable_speculation, endpointer=endpointer,
+                               sink=sink, tts=tts)
+        await pipeline.start()
+        # Stream only the primary language full-time; wake the others when the
+        # primary's finals suggest a language switch.
+        enable_language_gate = False
+        language_gate = None
+        if enable_language_gate:
+            language_gate = LanguageGate(
+                primary_language,
+                [lang for lang in languages if lang != primary_language],
+                on_change=aggregator.set_active_languages,
+            )
+            aggregator.set_active_languages(language_gate.active_languages())
+        # The microphone writes into one ring; a sender task per connection reads from it.
+        audio_fanout = AudioFanout(language_gate=language_gate)
         
         deepgram = DeepgramClient()
-        connections = []
+        # Heartbeats keep the connections (including idle gated ones) open; dropped ones reconnect
+        # and replay the last seconds of audio from the ring.
+        supervisor = DeepgramSupervisor(deepgram, audio_fanout)
         handlers = {}
-        
-        # Base transcription options for shared settings.
-        base_options = {
-            "smart_format": True,
-            "encoding": "linear16",
-            "diarize": True,
-            "channels": 1,
-            "sample_rate": 16000,
-            "interim_results": True,
-            "utterance_end_ms": "1000",
-            "vad_events": True,
-            "endpointing": 300,
-            "filler_words": True,
-            "intents": True,
-        }
-        
-        addons = {"no_delay": "true"}
-        
-        # Create a connection and handler for each language.
+        # Save every Deepgram event so the session can be replayed with replay.py.
+        record_events_path = None  # e.g. "session_events.jsonl"
+        recorder = None
+        if record_events_path:
+            from replay import EventRecorder
+            recorder = EventRecorder(record_events_path)
+
+        # Create a handler for each language, then open every Deepgram connection concurrently.
+        connections = []
         for lang in languages:
-            # Use nova-3 for English and nova-2 for other languages.
-            model = "nova-3" if lang == "en-US" else "nova-2"
-            
-            options = LiveOptions(
-                model=model,
-                language=lang,
-                smart_format=base_options["smart_format"],
-                encoding=base_options["encoding"],
-                diarize=base_options["diarize"],
-                channels=base_options["channels"],
-                sample_rate=base_options["sample_rate"],
-                interim_results=base_options["interim_results"],
-                utterance_end_ms=base_options["utterance_end_ms"],
-                vad_events=base_options["vad_events"],
-                endpointing=base_options["endpointing"],
-                filler_words=base_options["filler_words"],
-                # If Deepgram supports intents as an option:
-                # intents=base_options["intents"],
-            )
-            connection = deepgram.listen.websocket.v("1")
-            handler = TranscriptionHandler(language=lang, aggregator=aggregator)
-            connection.on(LiveTranscriptionEvents.Open, handler.on_open)
-            connection.on(LiveTranscriptionEvents.Transcript, handler.on_message)
-            connection.on(LiveTranscriptionEvents.Metadata, handler.on_metadata)
-            connection.on(LiveTranscriptionEvents.SpeechStarted, handler.on_speech_started)
-            connection.on(LiveTranscriptionEvents.UtteranceEnd, handler.on_utterance_end)
-            connection.on(LiveTranscriptionEvents.Close, handler.on_close)
-            connection.on(LiveTranscriptionEvents.Error, handler.on_error)
-            connection.on(LiveTranscriptionEvents.Unhandled, handler.on_unhandled)
-            
-            if not connection.start(options, addons=addons):
+            handler = TranscriptionHandler(language=lang, pipeline=pipeline, language_gate=language_gate,
+                                           audio_fanout=audio_fanout)
+
+            def setup(connection, handler=handler, lang=lang):
+                handler.attach(connection)
+                if recorder:
+                    recorder.attach(connection, lang)
+
+            connections.append((lang, handler, startup.timed(
+                f"deepgram {lang}", supervisor.add(lang, live_options(lang, endpointing_ms), LIVE_ADDONS, setup))))
+        connected = await asyncio.gather(*(connect for _, _, connect in connections))
+        for (lang, handler, _), ok in zip(connections, connected):
+            if not ok:
                 print(f"Failed to connect to Deepgram for language {lang}")
                 continue
-            
-            connections.append(connection)
             handlers[lang] = handler
-        
-        if not connections:
+
+        if not handlers:
             print("No connections established.")
+            clients_task.cancel()
             return
         
-        # Broadcast audio to every connection.
-        def broadcast_audio(data):
-            for conn in connections:
-                conn.send(data)
+        await audio_fanout.start()
+        await supervisor.start()
         
         print("\nPress Enter to stop recording...\n")
-        microphone = Microphone(broadcast_audio)
+        microphone = Microphone(audio_fanout.write)
         microphone.start()
+        startup.ready()
+        # Until this returns, a GPT request would fall back to gpt_integration's default client.
+        clients = await clients_task
+        pipeline.openai_client = clients.openai
+        if aggregator.loaded.is_set():
+            startup.add("history (background)", aggregator.load_seconds)
+        startup.report()
         
-        input("Press Enter to stop recording...\n")
+        await asyncio.to_thread(input, "Press Enter to stop recording...\n")
         
         microphone.finish()
-        for conn in connections:
-            conn.finish()
+        await audio_fanout.stop()
+        audio_fanout.report()
+        await supervisor.stop()
+        supervisor.report()
+        if recorder:
+            recorder.close()
+        await pipeline.stop()
+        if tts:
+            await tts.stop()
+            tts.report()
+        pipeline.metrics.report()
+        # Late finals absorbed into an utterance, and repeated triggers dropped, instead of sent to GPT again.
+        print(f"[Dedupe] late_finals={aggregator.late_finals} duplicate_triggers={pipeline.duplicate_triggers}")
+        await clients.stop()
+        clients.report()
+        if enable_speculation:
+            pipeline.speculation_stats.report()
+        if language_gate:
+            language_gate.report()
+        if summarizer:
+            summarizer.stop()
+        if enable_tracing:
+            tracer.stop_periodic_export()
+            tracer.export(json_path="trace_metrics.json", prometheus_path="trace_metrics.prom",
+                          chrome_trace_path=trace_chrome_path)
+            tracer.report()
+        aggregator.close()
+        sink.close()
 
         # Optionally, print the aggregated dialogue.
         # print(aggregator.get_aggregated_dialogue())
@@ -100,4 +195,4 @@ def main():
         print(f"Error in main: {e}")
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
@@ -0,0 +1,220 @@
+# memory_index.py
+"""
+Semantic memory over the whole dialogue history.
+
+Every dialogue entry is embedded and stored as one float32 row of an on-disk
+matrix (row i = entry i), so old turns that have slid out of the prompt window
+can be found again by similarity and sent with the next GPT request. Search is
+a NumPy brute-force dot product over normalized rows, which stays in the
+low milliseconds for tens of thousands of entries.
+
+Embeddings come from a local sentence-transformers model when the package is
+installed, and from hashed word and character n-grams otherwise.
+"""
+import hashlib
+import json
+import os
+import queue
+import re
+import threading
+import numpy as np
+
+# Sentinel pushed onto the queue to stop the worker thread.
+_STOP = object()
+_WORD = re.compile(r"\w+")
+# Speaker labels and /say commands are in every line and carry no meaning to match on.
+_LABEL = re.compile(r"^\[Speaker: [^\]]*\]:? ?(?:/say \w+ )?")
+
+
+def _clean(text):
+    return _LABEL.sub("", text)
+
+
+class HashedNgramEmbedder:
+    """
+    Dependency-free embedding: word unigrams and bigrams plus character
+    trigrams, hashed into `dim` signed buckets and L2-normalized.
+    """
+
+    def __init__(self, dim=512):
+        self.dim = dim
+        self.name = f"hashed-ngram-{dim}"
+
+    def _bucket(self, feature):
+        digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+        value = int.from_bytes(digest, "little")
+        return value % self.dim, 1.0 if value >> 63 else -1.0
+
+    def embed(self, texts):
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            words = _WORD.findall(text.lower())
+            features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+            for word in words:
+                padded = f" {word} "
+                features.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+            for feature in features:
+                index, sign = self._bucket(feature)
+                matrix[row, index] += sign
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-12)
+
+
+class SentenceTransformerEmbedder:
+    """A local CPU sentence-transformers model (downloaded on first use)."""
+
+    def __init__(self, model_name="all-MiniLM-L6-v2"):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.dim = self.model.get_sentence_embedding_dimension()
+        self.name = f"sentence-transformers/{model_name}"
+
+    def embed(self, texts):
+        return self.model.encode(list(texts), normalize_embeddings=True, convert_to_numpy=True).astype(np.float32)
+
+
+def default_embedder():
+    """The local model if sentence-transformers is installed, hashed n-grams otherwise."""
+    try:
+        return SentenceTransformerEmbedder()
+    except Exception:
+        return HashedNgramEmbedder()
+
+
+class MemoryIndex:
+    """
+    On-disk vector index of dialogue entries.
+
+    Rows are appended to `<base>.memory.f32` (raw float32) by a background
+    thread as entries arrive, and `<base>.memory.json` records the embedder
+    so a change of model rebuilds the index. With mmap, the rows present at
+    startup are memory-mapped instead of read into RAM.
+    """
+
+    def __init__(self, base_filename, embedder=None, mmap=False, batch_size=32):
+        self.embedder = embedder if embedder is not None else default_embedder()
+        self.dim = self.embedder.dim
+        self.matrix_filename = base_filename + ".memory.f32"
+        self.meta_filename = base_filename + ".memory.json"
+        self.mmap = mmap
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        # Rows from disk (possibly memory-mapped), then rows added since, in a growable array.
+        self._base = np.zeros((0, self.dim), dtype=np.float32)
+        self._recent = np.zeros((256, self.dim), dtype=np.float32)
+        self._recent_count = 0
+        self._file = None
+        self._thread = None
+
+    def __len__(self):
+        return len(self._base) + self._recent_count
+
+    def open(self, entries):
+        """
+        Load the saved rows and embed whatever entries they do not cover yet
+        (all of them if the index is missing or was built by another embedder).
+        Call before start(); entries are the texts of the stored dialogue.
+        """
+        rows = 0
+        if os.path.exists(self.meta_filename) and os.path.exists(self.matrix_filename):
+            try:
+                with open(self.meta_filename, "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+                if meta.get("embedder") == self.embedder.name and meta.get("dim") == self.dim:
+                    rows = min(os.path.getsize(self.matrix_filename) // (4 * self.dim), len(entries))
+            except Exception as e:
+                print(f"Error reading memory index: {e}")
+        if rows:
+            if self.mmap:
+                base = np.memmap(self.matrix_filename, dtype=np.float32, mode="r", shape=(rows, self.dim))
+            else:
+                base = np.fromfile(self.matrix_filename, dtype=np.float32, count=rows * self.dim).reshape(rows, self.dim)
+            with self.lock:
+                self._base = base
+        # Drop rows past the stored entries (e.g. a crash between the two writes) and start appending.
+        with open(self.matrix_filename, "ab") as f:
+            f.truncate(rows * 4 * self.dim)
+        with open(self.meta_filename, "w", encoding="utf-8") as f:
+            json.dump({"embedder": self.embedder.name, "dim": self.dim}, f)
+        self._file = open(self.matrix_filename, "ab")
+        missing = [_clean(text) for text in entries[rows:]]
+        for start in range(0, len(missing), self.batch_size * 8):
+            self._append(self.embedder.embed(missing[start:start + self.batch_size * 8]))
+        if rows or missing:
+            print(f"Memory index: {rows} rows loaded, {len(missing)} embedded ({self.embedder.name})")
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._worker_loop, name="memory-index", daemon=True)
+            self._thread.start()
+
+    def close(self):
+        if self._thread is not None:
+            self.queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def add(self, text):
+        """Queue the next entry's text; it becomes searchable once the worker has embedded it."""
+        self.queue.put(text)
+
+    def _append(self, vectors):
+        with self.lock:
+            needed = self._recent_count + len(vectors)
+            if needed > len(self._recent):
+                grown = np.zeros((max(needed, 2 * len(self._recent)), self.dim), dtype=np.float32)
+                grown[:self._recent_count] = self._recent[:self._recent_count]
+                self._recent = grown
+            self._recent[self._recent_count:needed] = vectors
+            self._recent_count = needed
+        self._file.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        self._file.flush()
+
+    def _worker_loop(self):
+        while True:
+            texts = [self.queue.get()]
+            # Embed whatever else is already waiting in the same batch.
+            while len(texts) < self.batch_size:
+                try:
+                    texts.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = any(text is _STOP for text in texts)
+            texts = [text for text in texts if text is not _STOP]
+            if texts:
+                try:
+                    vectors = self.embedder.embed([_clean(text) for text in texts])
+                except Exception as e:
+                    print(f"Error updating memory index: {e}")
+                    # Row i must stay entry i: store zero rows, which never score above min_score.
+                    vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+                try:
+                    self._append(vectors)
+                except Exception as e:
+                    print(f"Error writing memory index: {e}")
+            if stop:
+                return
+
+    def search(self, query, k=4, limit=None, min_score=0.2):
+        """
+        Return up to k (row, score) pairs most similar to query, best first,
+        among rows below limit (e.g. the entries older than the prompt window).
+        """
+        vector = self.embedder.embed([_clean(query)])[0]
+        with self.lock:
+            recent = self._recent[:self._recent_count]
+            base = self._base
+        if limit is not None:
+            recent = recent[:max(0, limit - len(base))]
+            base = base[:limit]
+        scores = np.concatenate([base @ vector, recent @ vector])
+        if not len(scores):
+            return []
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(row), float(scores[row])) for row in top if scores[row] >= min_score]
@@ -0,0 +1,108 @@
+# output_sink.py
+import queue
+import sys
+import threading
+
+
+class OutputSink:
+    """
+    Where streamed GPT output goes. write() must never block the event loop.
+    With debug=True the full prompt of every GPT call is written as well.
+    """
+
+    def __init__(self, debug=False):
+        self.debug = debug
+
+    def write(self, text):
+        raise NotImplementedError
+
+    def line(self, text=""):
+        self.write(text + "\n")
+
+    def close(self):
+        pass
+
+
+class NullSink(OutputSink):
+    """Discards everything, e.g. for benchmarks and replays."""
+
+    def write(self, text):
+        pass
+
+
+class ListSink(OutputSink):
+    """Keeps every write in memory."""
+
+    def __init__(self, debug=False):
+        super().__init__(debug)
+        self.parts = []
+
+    def write(self, text):
+        self.parts.append(text)
+
+    def getvalue(self):
+        return "".join(self.parts)
+
+
+class ConsoleSink(OutputSink):
+    """
+    Buffered console writer. write() only queues the text; a background thread
+    joins whatever has accumulated and writes and flushes it in one call, so a
+    slow terminal or log collector never stalls the GPT stream. When more than
+    max_pending writes are waiting, new ones are dropped and counted.
+    """
+
+    def __init__(self, stream=None, max_pending=10000, debug=False):
+        super().__init__(debug)
+        self.stream = stream
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._run, name="console-sink", daemon=True)
+        self._thread.start()
+
+    def write(self, text):
+        try:
+            self.queue.put_nowait(text)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            closing = None in batch
+            text = "".join(part for part in batch if part is not None)
+            if text:
+                # Resolved per batch so redirect_stdout still applies.
+                stream = self.stream or sys.stdout
+                try:
+                    stream.write(text)
+                    stream.flush()
+                except Exception:
+                    pass
+            if closing:
+                return
+
+    def close(self):
+        """Write out everything queued so far and stop the writer thread."""
+        if not self._thread.is_alive():
+            return
+        self.queue.put(None)
+        self._thread.join()
+        if self.dropped:
+            print(f"[ConsoleSink] dropped {self.dropped} writes")
+
+
+_default_sink = None
+
+
+def default_sink():
+    """The shared ConsoleSink, created on first use."""
+    global _default_sink
+    if _default_sink is None:
+        _default_sink = ConsoleSink()
+    return _default_sink
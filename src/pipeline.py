@@ -0,0 +1,369 @@
+# pipeline.py
+import asyncio
+import re
+import time
+from collections import deque
+from gpt_integration import StreamMetrics, stream_gpt4_response
+from tracing import tracer
+
+
+class RequestGeneration:
+    """
+    Generation counter shared by every language handler. Starting a request
+    from any handler bumps it, which supersedes whatever request was running.
+    """
+
+    def __init__(self):
+        self.value = 0
+
+    def next(self):
+        self.value += 1
+        return self.value
+
+    def is_current(self, generation):
+        return generation == self.value
+
+
+def normalize_transcript(text):
+    """Lowercase and strip punctuation so interim and final wording can be compared."""
+    return " ".join(re.sub(r"[^\w\s']", " ", text.lower()).split())
+
+
+def _spoken_text(speaker_lines):
+    """Normalized words of "[Speaker: N, Language: L]: ..." lines without their prefixes."""
+    return normalize_transcript(" ".join(line.split("]: ", 1)[-1] for line in speaker_lines))
+
+
+class SpeculationStats:
+    """Hit-rate counters for speculative GPT requests started from interim transcripts."""
+
+    def __init__(self):
+        self.attempts = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def hit_rate(self):
+        decided = self.hits + self.misses
+        return self.hits / decided if decided else 0.0
+
+    def report(self):
+        print(f"[Speculation] attempts={self.attempts} hits={self.hits} misses={self.misses} "
+              f"hit_rate={self.hit_rate:.0%}")
+
+
+class _Speculation:
+    def __init__(self, language, speaker_lines, text):
+        self.language = language
+        self.speaker_lines = speaker_lines
+        self.text = text
+        # Set once the final transcript confirms the interim text the request was built from.
+        self.confirmed = asyncio.Event()
+
+
+class GPTPipeline:
+    """
+    Asyncio pipeline from transcription handlers to the aggregator and GPT.
+
+    Final transcripts from every handler go through one bounded queue into the
+    aggregator, which merges the per-language finals of one utterance; only a
+    committed utterance counts as new dialogue. A single debouncer task waits for the dialogue to go quiet and
+    then starts a GPT request; a newer request cancels the one still streaming.
+
+    With speculative=True a handler can also start a request from stable
+    interim text at a likely endpoint. If the final transcript matches, that
+    response is kept and no new request is made; otherwise it is cancelled.
+
+    When an AdaptiveEndpointer is given, the quiet period comes from the last
+    speaker's learned pause distribution instead of the fixed debounce_delay,
+    and a SpeechStarted event holds the request back until the next final.
+
+    GPT output is written to sink (see output_sink.py). Each complete
+    sentence of a /say response is passed to on_segment(request_id, language,
+    text) while the response is still streaming. With a TTSStage (tts.py) the
+    sentences are spoken, SpeechStarted stops playback (barge-in), and the
+    stage stores the spoken part of each /say response in the aggregator.
+
+    openai_client and limiter are passed through to stream_gpt4_response, so
+    sessions in one process can share a client and a request limit.
+
+    Each utterance triggers at most one request: an utterance id the
+    aggregator reports again (a late final it absorbed into an utterance that
+    was already committed) is dropped and counted in duplicate_triggers.
+    """
+
+    def __init__(self, aggregator, debounce_delay=0.2, queue_size=256, speculative=False, endpointer=None,
+                 sink=None, on_segment=None, tts=None, openai_client=None, limiter=None):
+        self.aggregator = aggregator
+        self.openai_client = openai_client
+        self.limiter = limiter
+        self.sink = sink
+        self.tts = tts
+        self.on_segment = on_segment or (tts.submit if tts is not None else None)
+        self.on_complete = tts.complete if tts is not None else None
+        self.debounce_delay = debounce_delay
+        self.endpointer = endpointer
+        # Bounded so a stalled aggregator pushes back on the Deepgram receive loops.
+        self.transcripts = asyncio.Queue(maxsize=queue_size)
+        self.generation = RequestGeneration()
+        self.metrics = StreamMetrics()
+        self.speculative = speculative
+        self.speculation_stats = SpeculationStats()
+        self._speculation = None
+        self._pending_final = False     # A final has arrived since the last request started.
+        self._last_final_at = None      # When the newest final was handed to the pipeline.
+        self._speech_active = False     # SpeechStarted seen with no final after it yet.
+        self._pending_traces = []       # (trace_id, committed_at) of utterances awaiting a request.
+        self._dialogue_changed = asyncio.Event()
+        self._merge_pending = asyncio.Event()
+        self._gpt_task = None
+        self._triggered = deque(maxlen=256)  # Ids of the utterances that most recently triggered a request.
+        self.duplicate_triggers = 0
+        self._tasks = []
+
+    async def start(self):
+        self._tasks = [
+            asyncio.create_task(self._aggregate_loop(), name="aggregate"),
+            asyncio.create_task(self._merge_loop(), name="merge"),
+            asyncio.create_task(self._debounce_loop(), name="debounce"),
+        ]
+
+    async def stop(self):
+        """Drain queued transcripts, then cancel the worker tasks and any GPT request."""
+        await self.transcripts.join()
+        self._handle_committed(self.aggregator.flush_expired(force=True))
+        for task in self._tasks:
+            task.cancel()
+        if self._gpt_task is not None:
+            self._gpt_task.cancel()
+        await asyncio.gather(*self._tasks, *(t for t in [self._gpt_task] if t), return_exceptions=True)
+        self._tasks = []
+        self._gpt_task = None
+
+    async def wait_idle(self, timeout=30.0):
+        """Wait until queued finals are merged, the debouncer has fired and the GPT request has finished."""
+        deadline = time.monotonic() + timeout
+        await self.transcripts.join()
+        while time.monotonic() < deadline:
+            busy = (
+                self.aggregator.next_merge_deadline() is not None
+                or self._pending_final
+                or (self._gpt_task is not None and not self._gpt_task.done())
+            )
+            if not busy:
+                return True
+            await asyncio.sleep(0.05)
+        return False
+
+    async def submit_final(self, language, speaker_lines, start=0.0, end=0.0, confidence=0.0, trace_id=None,
+                           runs=None):
+        """
+        Queue the diarized lines of one final transcript, with its audio time
+        window and confidence for the cross-language merge, and the trace ID of
+        its utterance. runs (transcription.SpeakerRun, one per line) carry the
+        timing and confidence of each line. Waits while the queue is full.
+        """
+        # Cleared here rather than in the aggregate loop so a SpeechStarted that
+        # follows this final is not lost while the final waits in the queue.
+        self._speech_active = False
+        self._last_final_at = time.monotonic()
+        await self.transcripts.put((language, speaker_lines, start, end, confidence, trace_id, runs,
+                                    self._last_final_at))
+
+    async def _aggregate_loop(self):
+        while True:
+            language, speaker_lines, start, end, confidence, trace_id, runs, queued_at = await self.transcripts.get()
+            try:
+                tracer.record("pipeline.queue", trace_id, queued_at, time.monotonic())
+                span = tracer.begin("aggregator.submit", trace_id, language=language)
+                committed = self.aggregator.submit_transcription(language, speaker_lines, start, end, confidence,
+                                                                 trace_id, runs)
+                span.end(committed=len(committed))
+                if committed:
+                    self._handle_committed(committed)
+                else:
+                    self._merge_pending.set()
+            finally:
+                self.transcripts.task_done()
+
+    async def _merge_loop(self):
+        """Commit utterances that the other languages did not report within the merge window."""
+        while True:
+            deadline = self.aggregator.next_merge_deadline()
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                await asyncio.wait_for(self._merge_pending.wait(), timeout)
+                self._merge_pending.clear()
+            except asyncio.TimeoutError:
+                self._handle_committed(self.aggregator.flush_expired())
+
+    def _handle_committed(self, committed):
+        """One GPT trigger per committed utterance, unless a speculative request already covers it."""
+        for utterance in committed:
+            trace_id = utterance.get("trace_id")
+            if utterance["utterance_id"] in self._triggered:
+                self.duplicate_triggers += 1
+                tracer.instant("pipeline.duplicate", trace_id)
+                continue
+            self._triggered.append(utterance["utterance_id"])
+            if tracer.enabled:
+                now = time.monotonic()
+                tracer.record("aggregator.merge", trace_id, utterance["created"], now, language=utterance["language"])
+            if not self._resolve_speculation(utterance["lines"]):
+                self._pending_final = True
+                if tracer.enabled:
+                    self._pending_traces.append((trace_id, now))
+                self._dialogue_changed.set()
+            else:
+                tracer.instant("speculation.hit", trace_id)
+
+    def speech_started(self):
+        """Someone started talking again; stop speaking and hold any pending request until their final arrives."""
+        if self.tts is not None:
+            self.tts.barge_in()
+        if self.endpointer is None:
+            return
+        self._speech_active = True
+        self._dialogue_changed.set()
+
+    def _quiet_period(self):
+        if self.endpointer is None:
+            return self.debounce_delay
+        if self._speech_active:
+            # Bounded, so a SpeechStarted with no transcript (noise) cannot hold forever.
+            return self.endpointer.max_delay
+        return self.endpointer.delay_for()
+
+    async def _debounce_loop(self):
+        while True:
+            await self._dialogue_changed.wait()
+            self._dialogue_changed.clear()
+            # Restart the quiet period whenever another final arrives.
+            while True:
+                try:
+                    await asyncio.wait_for(self._dialogue_changed.wait(), self._quiet_period())
+                    self._dialogue_changed.clear()
+                except asyncio.TimeoutError:
+                    break
+            self._speech_active = False
+            if self._pending_final:
+                await self._start_gpt_request()
+
+    async def speculate(self, language, speaker_lines, trace_id=None):
+        """Start a GPT request from interim lines before their final transcript arrives."""
+        if not self.speculative or not speaker_lines:
+            return
+        text = _spoken_text(speaker_lines)
+        current = self._speculation
+        if current is not None and current.text == text and not current.confirmed.is_set():
+            return
+        request_id = self.generation.next()
+        await self.cancel_current_request()
+        await self._wait_for_history()
+        if not self.generation.is_current(request_id):
+            return
+        self._pending_final = False
+        self._pending_traces = []
+        speculation = _Speculation(language, speaker_lines, text)
+        self._speculation = speculation
+        self.speculation_stats.attempts += 1
+        # The interim lines are only part of this prompt; the aggregator gets the final ones.
+        system_prompt, conversation_text, messages = await self._prompt_messages(speaker_lines)
+        if not self.generation.is_current(request_id):
+            return
+        conversation_text = "\n".join(filter(None, [conversation_text, *speaker_lines]))
+        self._gpt_task = asyncio.create_task(
+            stream_gpt4_response(conversation_text, self.aggregator, request_id, system_prompt, self.metrics,
+                                 commit_gate=speculation.confirmed, trace_id=trace_id, sink=self.sink,
+                                 on_segment=self.on_segment, on_complete=self.on_complete,
+                                 openai_client=self.openai_client, limiter=self.limiter, messages=messages),
+            name=f"gpt-speculative-{request_id}",
+        )
+
+    def _resolve_speculation(self, speaker_lines):
+        """Match a final against the pending speculation. Returns True if the speculative response is kept."""
+        speculation = self._speculation
+        if speculation is None:
+            return False
+        text = _spoken_text(speaker_lines)
+        running = self._gpt_task is not None and not self._gpt_task.done()
+        if speculation.confirmed.is_set():
+            # Another language connection finalizing the utterance that was already confirmed.
+            if text == speculation.text and running:
+                return True
+            self._speculation = None
+            return False
+        self._speculation = None
+        if text == speculation.text and running:
+            self.speculation_stats.hits += 1
+            speculation.confirmed.set()
+            self._speculation = speculation
+            return True
+        # The final differs, so the speculative stream is dropped by the request this final triggers.
+        self.speculation_stats.misses += 1
+        return False
+
+    async def _wait_for_history(self):
+        """The first prompt waits for dialogue history that is still loading in the background."""
+        if not self.aggregator.loaded.is_set():
+            await asyncio.to_thread(self.aggregator.loaded.wait)
+
+    async def cancel_current_request(self):
+        """Abort the running GPT stream now and wait until its partial text is in the aggregator."""
+        task = self._gpt_task
+        if task is None or task.done():
+            return
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    async def _prompt_messages(self, extra_lines=None):
+        if self.aggregator.memory_index is not None:
+            # Recall embeds the query and scans every stored row; keep that off the event loop.
+            prompt = await asyncio.to_thread(self.aggregator.get_prompt_messages, extra_lines)
+        else:
+            prompt = self.aggregator.get_prompt_messages(extra_lines)
+        # How much of this prompt repeats the previous one exactly, i.e. could be served from the provider's cache.
+        self.metrics.stable_prefix_tokens += self.aggregator.prompt_window.stable_prefix_tokens
+        return prompt
+
+    async def _start_gpt_request(self):
+        request_id = self.generation.next()
+        self._pending_final = False
+        if self._speculation is not None and not self._speculation.confirmed.is_set():
+            self.speculation_stats.misses += 1
+        self._speculation = None
+        # Superseded by newer dialogue; its partial text must land before the new prompt is built.
+        await self.cancel_current_request()
+        await self._wait_for_history()
+        if not self.generation.is_current(request_id):
+            return
+        system_prompt, conversation_text, messages = await self._prompt_messages()
+        if not self.generation.is_current(request_id):
+            return
+        if self._last_final_at is not None:
+            self.metrics.trigger_latencies.append(time.monotonic() - self._last_final_at)
+        trace_id = self._trace_debounce()
+        self._gpt_task = asyncio.create_task(
+            stream_gpt4_response(conversation_text, self.aggregator, request_id, system_prompt, self.metrics,
+                                 trace_id=trace_id, sink=self.sink,
+                                 on_segment=self.on_segment, on_complete=self.on_complete,
+                                 openai_client=self.openai_client, limiter=self.limiter, messages=messages),
+            name=f"gpt-{request_id}",
+        )
+
+    def _trace_debounce(self):
+        """
+        Close the debounce span of every utterance this request answers. The
+        request itself is traced under the newest one; the others are marked
+        as coalesced into it.
+        """
+        pending, self._pending_traces = self._pending_traces, []
+        if not pending:
+            return None
+        now = time.monotonic()
+        newest = pending[-1][0]
+        for trace_id, committed_at in pending:
+            tracer.record("pipeline.debounce", trace_id, committed_at, now)
+            if trace_id != newest:
+                tracer.instant("pipeline.coalesced", trace_id, into=newest)
+        return newest
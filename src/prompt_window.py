@@ -0,0 +1,230 @@
+# prompt_window.py
+# Loaded on first use: tiktoken is optional, and reading its vocabulary is slow enough to matter at startup.
+_encoding = None
+_encoding_loaded = False
+
+SYSTEM_PROMPT = (
+    "You are a conversational partner who is responding to messages in real time."
+    "You are getting a live audio feed of transcribed messages. Some messages may be segmented in multiple lines."
+    "Do not interrupt if someone is speaking; wait until they have fully expressed their idea before responding. "
+    "Chill with the long responses, act like a human."
+    "There are multiple transcriber bots which will provide transcriptions for each speaker in the following format:\n"
+    "[Speaker: N, Language: language1]: ...\n"
+    "[Speaker: N, Language: language2]: ...\n"
+    "If you don't want to say anything, respond with /say Nothing\n"
+    "When you respond, choose one appropriate language to use. Begin your message with /say <Language> followed by your response.\n"
+    "You can think internally before speaking, and if it makes sense to let someone else speak, respond with /pausing\n"
+    "Lines starting with [Speaker: GPT, partial], and your earlier responses ending in [cut off], were cut off by new speech.\n"
+)
+
+# Marks an assistant message that was cut off by new speech.
+CUT_OFF_MARKER = " [cut off]"
+
+
+def _load_encoding():
+    global _encoding, _encoding_loaded
+    try:
+        import tiktoken
+        _encoding = tiktoken.get_encoding("o200k_base")
+    except Exception:
+        # Without tiktoken, fall back to the ~4 characters per token rule of thumb.
+        _encoding = None
+    _encoding_loaded = True
+
+
+def count_tokens(text):
+    """Return the number of prompt tokens in text."""
+    if not _encoding_loaded:
+        _load_encoding()
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return max(1, (len(text) + 3) // 4)
+
+
+class PromptWindow:
+    """
+    Keeps the newest dialogue entries that fit in a token budget.
+
+    Each entry is tokenized once when it is appended. The window start slides
+    forward as new entries push the total over budget, and the rendered text is
+    cached so a call only has to join the entries added since the previous one.
+
+    render_messages() lays the window out as chat messages for provider-side
+    prefix caching: the pinned prompt as the system message, speaker lines
+    grouped into user messages and GPT entries as assistant messages. Turns
+    are only ever appended, and when the window is over budget its start jumps
+    forward by trim_slack of the budget at once, so the message prefix stays
+    byte-identical across many turns instead of shifting on every one.
+    """
+
+    def __init__(self, system_prompt=SYSTEM_PROMPT, token_budget=4000, trim_slack=0.2):
+        self.system_prompt = system_prompt
+        self.summary = None
+        self.pinned_prompt = system_prompt
+        self.system_tokens = count_tokens(system_prompt)
+        self.token_budget = token_budget
+        self.trim_slack = trim_slack
+        self._texts = []
+        self._tokens = []
+        # Assistant message content of each GPT entry (None for speaker lines).
+        self._replies = []
+        self._start = 0             # Index of the oldest entry inside the window.
+        self._floor = 0             # Entries before this are covered by the summary and never re-enter.
+        self._window_tokens = 0     # Tokens of entries[_start:].
+        # Cached render of entries[_rendered_start:_rendered_end].
+        self._rendered = ""
+        self._rendered_start = 0
+        self._rendered_end = 0
+        self._rendered_offsets = []  # Character offset of each rendered entry.
+        # Cached messages for entries[_messages_start:_messages_end]; a changed message is replaced, never mutated.
+        self._messages = []
+        self._message_tokens = []
+        self._messages_start = 0
+        self._messages_end = 0
+        self._system_message = {"role": "system", "content": self.pinned_prompt}
+        self._last_messages = []
+        self.stable_prefix_tokens = 0  # Prompt tokens in messages unchanged since the previous render.
+
+    @property
+    def available_tokens(self):
+        """Tokens left for dialogue once the pinned system prompt is accounted for."""
+        return max(0, self.token_budget - self.system_tokens)
+
+    @property
+    def window_tokens(self):
+        return self._window_tokens
+
+    @property
+    def start(self):
+        """Index of the oldest entry still inside the window."""
+        return self._start
+
+    def set_summary(self, summary, upto=None):
+        """
+        Pin a summary of the entries that have slid out of the window after the
+        system prompt. upto is the number of entries it covers; the window never
+        reaches back before them, even when a shorter summary frees budget.
+        """
+        self.summary = summary
+        if upto is not None:
+            self._floor = upto
+            while self._start < min(upto, len(self._texts)):
+                self._window_tokens -= self._tokens[self._start]
+                self._start += 1
+        if summary:
+            self.pinned_prompt = f"{self.system_prompt}\nSummary of the earlier conversation:\n{summary}\n"
+        else:
+            self.pinned_prompt = self.system_prompt
+        self.system_tokens = count_tokens(self.pinned_prompt)
+        self._system_message = {"role": "system", "content": self.pinned_prompt}
+        self.set_token_budget(self.token_budget)
+
+    def set_token_budget(self, token_budget):
+        self.token_budget = token_budget
+        # Growing the budget can pull older, unsummarized entries back into the window.
+        while self._start > self._floor and self._window_tokens + self._tokens[self._start - 1] <= self.available_tokens:
+            self._start -= 1
+            self._window_tokens += self._tokens[self._start]
+        self._trim()
+
+    def append(self, text, reply=None):
+        """Add an entry's prompt line; reply is the assistant message content if it is a GPT entry."""
+        self._texts.append(text)
+        self._replies.append(reply)
+        tokens = count_tokens(text) + 1  # +1 for the joining newline.
+        self._tokens.append(tokens)
+        self._window_tokens += tokens
+        self._trim()
+
+    def extend(self, texts):
+        for text in texts:
+            self.append(text)
+
+    def append_entry(self, entry):
+        """Add a DialogueEntry, using its role to lay it out as a user or assistant message."""
+        reply = None
+        if entry.role == "assistant":
+            reply = entry.text + CUT_OFF_MARKER if entry.partial else entry.text
+        self.append(entry.render(), reply)
+
+    def _trim(self):
+        if self._window_tokens <= self.available_tokens:
+            return
+        # Once over budget, trim below it by the slack so the start (and the
+        # cached message prefix) does not move again on the next few entries.
+        target = self.available_tokens * (1 - self.trim_slack)
+        # Always keep the newest entry, even if it alone exceeds the budget.
+        while self._window_tokens > target and self._start < len(self._texts) - 1:
+            self._window_tokens -= self._tokens[self._start]
+            self._start += 1
+
+    def render(self):
+        """Return the dialogue text currently inside the window."""
+        end = len(self._texts)
+        if self._start < self._rendered_start or self._start >= self._rendered_end:
+            # Nothing reusable in the cache; render from scratch.
+            self._rendered = ""
+            self._rendered_offsets = []
+            self._rendered_start = self._rendered_end = self._start
+        elif self._start > self._rendered_start:
+            # Drop entries that slid out of the window from the front of the cache.
+            cut = self._start - self._rendered_start
+            offset = self._rendered_offsets[cut]
+            self._rendered = self._rendered[offset:]
+            self._rendered_offsets = [o - offset for o in self._rendered_offsets[cut:]]
+            self._rendered_start = self._start
+
+        if end > self._rendered_end:
+            parts = []
+            position = len(self._rendered)
+            for text in self._texts[self._rendered_end:end]:
+                if self._rendered_offsets:
+                    parts.append("\n")
+                    position += 1
+                self._rendered_offsets.append(position)
+                parts.append(text)
+                position += len(text)
+            self._rendered += "".join(parts)
+            self._rendered_end = end
+        return self._rendered
+
+    def render_messages(self, extra_lines=None):
+        """
+        Return the window as chat messages. extra_lines (e.g. interim speaker
+        lines for a speculative request) are appended as one more user message.
+        """
+        end = len(self._texts)
+        if self._start != self._messages_start or end < self._messages_end:
+            self._messages = []
+            self._message_tokens = []
+            self._messages_start = self._messages_end = self._start
+        for index in range(self._messages_end, end):
+            text = self._texts[index]
+            tokens = self._tokens[index]
+            reply = self._replies[index]
+            if reply is not None:
+                self._messages.append({"role": "assistant", "content": reply})
+                self._message_tokens.append(tokens)
+            elif self._messages and self._messages[-1]["role"] == "user":
+                # Lines of the same turn share one user message.
+                self._messages[-1] = {"role": "user", "content": self._messages[-1]["content"] + "\n" + text}
+                self._message_tokens[-1] += tokens
+            else:
+                self._messages.append({"role": "user", "content": text})
+                self._message_tokens.append(tokens)
+        self._messages_end = end
+
+        messages = [self._system_message] + self._messages
+        if extra_lines:
+            messages.append({"role": "user", "content": "\n".join(extra_lines)})
+
+        # Leading messages identical (the same objects) to last time form the cacheable prefix.
+        stable = 0
+        tokens = [self.system_tokens] + self._message_tokens
+        for i, (message, previous) in enumerate(zip(messages, self._last_messages)):
+            if message is not previous:
+                break
+            stable += tokens[i]
+        self.stable_prefix_tokens = stable
+        self._last_messages = messages
+        return messages
@@ -0,0 +1,371 @@
+# replay.py
+"""
+Offline replay harness and latency benchmark.
+
+Replays a recorded session into TranscriptionHandler with local stand-ins for
+Deepgram and OpenAI (fake_servers.py), then reports p50/p99 for:
+
+  trigger  transcript final handed to the pipeline -> GPT request started
+  ttft     GPT request started -> first streamed token
+  ttlt     GPT request started -> last streamed token
+  lock     DialogueAggregator lock hold time
+
+Sessions are JSONL files of {"t", "language", "message"} lines, where message
+is the raw Deepgram websocket message, as written by EventRecorder. Without
+--events a session is synthesized from dialogue_entries.json. With --audio
+the events are not dispatched directly: linear16 audio (a file, or silence)
+is streamed through the real Deepgram client to a fake websocket server that
+answers with the scripted messages.
+
+Usage:
+    python replay.py [--events session.jsonl] [--audio [--audio-file a.raw]] [--speed 2]
+                     [--first-token-ms 300] [--token-ms 20] [--max-trigger-p99-ms 800]
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from deepgram import (DeepgramClient, DeepgramClientOptions, LiveOptions, LiveResultResponse,
+                      LiveTranscriptionEvents, SpeechStartedResponse, UtteranceEndResponse)
+import openai
+import gpt_integration
+from audio_ring import AudioFanout, BYTES_PER_SECOND
+from dialogue_manager import DialogueAggregator
+from dialogue_store import DialogueEntry
+from endpointing import AdaptiveEndpointer
+from fake_servers import FakeChatCompletionsServer, FakeDeepgramServer
+from output_sink import ConsoleSink, NullSink
+from pipeline import GPTPipeline
+from tracing import tracer
+from transcription import TranscriptionHandler
+from tts import FakeTTSBackend, TTSStage
+
+# The dialogue log main.py writes at the repo root, wherever the script is run from.
+DEFAULT_DIALOGUE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "dialogue_entries.json")
+
+
+class EventRecorder:
+    """Appends the Deepgram events of live connections to a JSONL session file for later replay."""
+
+    def __init__(self, path):
+        self.path = path
+        self.started = time.monotonic()
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def attach(self, connection, language):
+        connection.on(LiveTranscriptionEvents.Transcript, self._recorder(language, "result"))
+        connection.on(LiveTranscriptionEvents.UtteranceEnd, self._recorder(language, "utterance_end"))
+        connection.on(LiveTranscriptionEvents.SpeechStarted, self._recorder(language, "speech_started"))
+
+    def _recorder(self, language, key):
+        async def record(*args, **kwargs):
+            response = kwargs.get(key)
+            if response is None:
+                return
+            line = json.dumps({
+                "t": round(time.monotonic() - self.started, 4),
+                "language": language,
+                "message": json.loads(response.to_json()),
+            }, ensure_ascii=False)
+            with self._lock:
+                self._file.write(line + "\n")
+        return record
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def load_events(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def synthesize_events(dialogue_path, languages, max_utterances=20, word_seconds=0.3, pause=1.5,
+                      endpointing=0.3, utterance_end=1.0, secondary_delay=0.0):
+    """
+    Build a session from the speaker lines of a dialogue log: each line becomes
+    a SpeechStarted as its first word begins, then one final per language
+    (secondary languages slightly less confident, and secondary_delay seconds
+    later), followed by an UtteranceEnd.
+    """
+    with open(dialogue_path, "r", encoding="utf-8") as f:
+        entries = [DialogueEntry.from_json(data) for data in json.load(f)]
+    lines = [e.render() for e in entries if e.role == "user"][:max_utterances]
+    events = []
+    now = 0.5
+    for line in lines:
+        header, _, text = line.partition("]: ")
+        speaker = header.split("Speaker:")[1].split(",")[0].strip() if "Speaker:" in header else "0"
+        speaker = int(speaker) if speaker.isdigit() else 0
+        words = text.split() or ["..."]
+        start = now
+        word_dicts = []
+        for word in words:
+            word_dicts.append({"word": word.lower(), "punctuated_word": word, "start": round(now, 3),
+                               "end": round(now + word_seconds * 0.8, 3), "confidence": 0.95, "speaker": speaker})
+            now += word_seconds
+        end = word_dicts[-1]["end"]
+        for rank, language in enumerate(languages):
+            events.append({"t": round(start + 0.1, 3), "language": language, "message": {
+                "type": "SpeechStarted", "channel": [0, 1], "timestamp": round(start, 3),
+            }})
+            confidence = 0.95 - 0.2 * rank
+            delay = secondary_delay if rank else 0.0
+            events.append({"t": round(end + endpointing + delay, 3), "language": language, "message": {
+                "type": "Results", "channel_index": [0, 1], "duration": round(end - start, 3),
+                "start": round(start, 3), "is_final": True, "speech_final": True, "from_finalize": False,
+                "channel": {"alternatives": [{"transcript": text, "confidence": confidence,
+                                              "words": [dict(w, confidence=confidence) for w in word_dicts]}]},
+                "metadata": {"request_id": "replay", "model_info": {"name": "replay", "version": "0", "arch": "replay"},
+                             "model_uuid": "replay"},
+            }})
+            events.append({"t": round(end + utterance_end + delay, 3), "language": language, "message": {
+                "type": "UtteranceEnd", "channel": [0, 1], "last_word_end": end,
+            }})
+        now = end + pause
+    events.sort(key=lambda e: e["t"])
+    return events
+
+
+class TimedLock:
+    """Drop-in replacement for DialogueAggregator.lock that records how long it is held."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hold_times = []
+        self._acquired_at = None
+
+    def acquire(self, *args, **kwargs):
+        acquired = self._lock.acquire(*args, **kwargs)
+        if acquired:
+            self._acquired_at = time.perf_counter()
+        return acquired
+
+    def release(self):
+        self.hold_times.append(time.perf_counter() - self._acquired_at)
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def dispatch_event(handler, message):
+    """Deliver one raw Deepgram message to a handler the way the async client would."""
+    kind = message.get("type")
+    payload = json.dumps(message)
+    if kind == "Results":
+        await handler.on_message(None, result=LiveResultResponse.from_json(payload))
+    elif kind == "UtteranceEnd":
+        await handler.on_utterance_end(None, utterance_end=UtteranceEndResponse.from_json(payload))
+    elif kind == "SpeechStarted":
+        await handler.on_speech_started(None, speech_started=SpeechStartedResponse.from_json(payload))
+
+
+async def replay_events(events, handlers, speed=1.0):
+    """Dispatch events at their recorded times (divided by speed)."""
+    started = time.monotonic()
+    for event in sorted(events, key=lambda e: e["t"]):
+        delay = started + event["t"] / speed - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        handler = handlers.get(event["language"])
+        if handler is not None:
+            await dispatch_event(handler, event["message"])
+
+
+async def replay_audio(events, handlers, audio_path=None, speed=1.0, frame_seconds=0.02):
+    """Stream audio through the real Deepgram client to a FakeDeepgramServer scripted with the events."""
+    fake_deepgram = await FakeDeepgramServer(events).start()
+    deepgram = DeepgramClient("replay", DeepgramClientOptions(url=fake_deepgram.url))
+    fanout = AudioFanout()
+    connections = []
+    for language, handler in handlers.items():
+        connection = deepgram.listen.asyncwebsocket.v("1")
+        connection.on(LiveTranscriptionEvents.Transcript, handler.on_message)
+        connection.on(LiveTranscriptionEvents.UtteranceEnd, handler.on_utterance_end)
+        connection.on(LiveTranscriptionEvents.SpeechStarted, handler.on_speech_started)
+        connection.on(LiveTranscriptionEvents.Error, handler.on_error)
+        options = LiveOptions(model="replay", language=language, encoding="linear16", sample_rate=16000, channels=1)
+        if not await connection.start(options):
+            raise RuntimeError(f"Could not connect to the fake Deepgram server for {language}")
+        handler.audio_fanout = fanout
+        fanout.add_connection(language, connection.send)
+        connections.append(connection)
+    await fanout.start()
+
+    if audio_path:
+        with open(audio_path, "rb") as f:
+            audio = f.read()
+    else:
+        last = max((e["t"] for e in events), default=0.0) + 1.0
+        audio = bytes(int(last * BYTES_PER_SECOND))
+    frame_bytes = int(frame_seconds * BYTES_PER_SECOND)
+    started = time.monotonic()
+    for i, offset in enumerate(range(0, len(audio), frame_bytes)):
+        fanout.write(audio[offset:offset + frame_bytes])
+        delay = started + (i + 1) * frame_seconds / speed - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    await asyncio.sleep(0.2)
+    await fanout.stop()
+    for connection in connections:
+        await connection.finish()
+    await fake_deepgram.stop()
+
+
+async def run_replay(events, languages, speed=1.0, audio=False, audio_path=None, first_token_delay=0.3,
+                     token_interval=0.02, adaptive=False, verbose=False, tts=False):
+    """Replay a session against the fake servers and return the latency report."""
+    chat = FakeChatCompletionsServer(first_token_delay=first_token_delay, token_interval=token_interval).start()
+    previous_client = gpt_integration.client
+    gpt_integration.client = openai.AsyncOpenAI(base_url=chat.base_url, api_key="replay")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        aggregator = DialogueAggregator(languages, filename=os.path.join(tmpdir, "dialogue_entries.json"))
+        lock = aggregator.lock = TimedLock()
+        endpointer = AdaptiveEndpointer() if adaptive else None
+        sink = ConsoleSink() if verbose else NullSink()
+        tts_stage = None
+        if tts:
+            # Playback only takes time, so barge-in and recording the spoken part run as they would live.
+            tts_stage = TTSStage(FakeTTSBackend(synth_seconds=0.05 / speed, words_per_second=3.0 * speed), aggregator)
+            await tts_stage.start()
+        pipeline = GPTPipeline(aggregator, endpointer=endpointer, sink=sink, tts=tts_stage)
+        await pipeline.start()
+        handlers = {language: TranscriptionHandler(language, pipeline) for language in languages}
+        try:
+            if audio:
+                await replay_audio(events, handlers, audio_path, speed)
+            else:
+                await replay_events(events, handlers, speed)
+            await pipeline.wait_idle()
+        finally:
+            await pipeline.stop()
+            if tts_stage is not None:
+                await tts_stage.stop()
+            aggregator.close()
+            gpt_integration.client = previous_client
+            chat.stop()
+            sink.close()
+
+    metrics = pipeline.metrics
+    samples = {
+        "trigger": list(metrics.trigger_latencies),
+        "ttft": list(metrics.first_token_latencies),
+        "ttlt": list(metrics.last_token_latencies),
+        "lock": lock.hold_times,
+    }
+    return {
+        "requests": len(chat.requests),
+        "cancelled": metrics.requests_cancelled,
+        "duplicate_triggers": pipeline.duplicate_triggers,
+        "late_finals": aggregator.late_finals,
+        "entries": len(aggregator.entries),
+        "tts": tts_stage.stats() if tts_stage is not None else None,
+        "prompt_cache": {"prompt_tokens": metrics.prompt_tokens, "cached_tokens": metrics.cached_prompt_tokens,
+                         "stable_prefix_tokens": metrics.stable_prefix_tokens,
+                         "hits": metrics.cache_hits, "misses": metrics.cache_misses},
+        "latency_ms": {
+            name: {"count": len(values),
+                   "p50": round(percentile(values, 0.5) * 1000, 3),
+                   "p99": round(percentile(values, 0.99) * 1000, 3)}
+            for name, values in samples.items()
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", help="JSONL session recorded by EventRecorder")
+    parser.add_argument("--dialogue", default=DEFAULT_DIALOGUE,
+                        help="dialogue log to synthesize a session from when --events is not given")
+    parser.add_argument("--languages", nargs="+", default=["en-US", "ru"])
+    parser.add_argument("--utterances", type=int, default=20, help="utterances to synthesize")
+    parser.add_argument("--secondary-delay-ms", type=float, default=0.0,
+                        help="deliver synthesized secondary-language finals this much later")
+    parser.add_argument("--audio", action="store_true", help="stream audio through a fake Deepgram websocket")
+    parser.add_argument("--audio-file", help="raw linear16 16 kHz mono audio for --audio (default: silence)")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed multiplier")
+    parser.add_argument("--first-token-ms", type=float, default=300.0)
+    parser.add_argument("--token-ms", type=float, default=20.0)
+    parser.add_argument("--adaptive", action="store_true", help="use AdaptiveEndpointer instead of the fixed debounce")
+    parser.add_argument("--tts", action="store_true",
+                        help="speak responses through TTSStage with FakeTTSBackend (barge-in on SpeechStarted)")
+    parser.add_argument("--verbose", action="store_true", help="show the pipeline's console output")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--trace-dir", help="enable tracing and write trace_metrics.json/.prom and trace.json here")
+    parser.add_argument("--max-trigger-p99-ms", type=float, help="fail if trigger p99 exceeds this")
+    parser.add_argument("--max-ttft-p99-ms", type=float, help="fail if ttft p99 exceeds this")
+    parser.add_argument("--max-lock-p99-ms", type=float, help="fail if lock hold p99 exceeds this")
+    args = parser.parse_args()
+
+    if args.events:
+        events = load_events(args.events)
+    else:
+        events = synthesize_events(args.dialogue, args.languages, max_utterances=args.utterances,
+                                   secondary_delay=args.secondary_delay_ms / 1000)
+
+    if args.trace_dir:
+        tracer.enabled = True
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    with output:
+        report = asyncio.run(run_replay(
+            events, args.languages, speed=args.speed, audio=args.audio, audio_path=args.audio_file,
+            first_token_delay=args.first_token_ms / 1000, token_interval=args.token_ms / 1000,
+            adaptive=args.adaptive, verbose=args.verbose, tts=args.tts,
+        ))
+
+    if args.trace_dir:
+        os.makedirs(args.trace_dir, exist_ok=True)
+        tracer.export(json_path=os.path.join(args.trace_dir, "trace_metrics.json"),
+                      prometheus_path=os.path.join(args.trace_dir, "trace_metrics.prom"),
+                      chrome_trace_path=os.path.join(args.trace_dir, "trace.json"))
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"requests={report['requests']} cancelled={report['cancelled']} "
+              f"duplicate_triggers={report['duplicate_triggers']} late_finals={report['late_finals']} "
+              f"entries={report['entries']}")
+        cache = report["prompt_cache"]
+        print(f"prompt_tokens={cache['prompt_tokens']} cached_tokens={cache['cached_tokens']} "
+              f"stable_prefix_tokens={cache['stable_prefix_tokens']} "
+              f"cache hits={cache['hits']} misses={cache['misses']}")
+        if report["tts"] is not None:
+            print(f"tts: {report['tts']}")
+        print(f"{'metric':<10}{'count':>8}{'p50 ms':>12}{'p99 ms':>12}")
+        for name, row in report["latency_ms"].items():
+            print(f"{name:<10}{row['count']:>8}{row['p50']:>12.3f}{row['p99']:>12.3f}")
+
+    failures = [
+        f"{name} p99 {report['latency_ms'][name]['p99']:.1f} ms > {limit:.1f} ms"
+        for name, limit in (("trigger", args.max_trigger_p99_ms), ("ttft", args.max_ttft_p99_ms),
+                            ("lock", args.max_lock_p99_ms))
+        if limit is not None and report["latency_ms"][name]["p99"] > limit
+    ]
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
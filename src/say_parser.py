@@ -0,0 +1,124 @@
+# say_parser.py
+import re
+
+SAY = "/say"
+PAUSING = "/pausing"
+
+# Sentence end: terminal punctuation (plus closing quotes/brackets) followed by whitespace.
+_SENTENCE_END = re.compile(r"[.!?…。！？]+[\"'”’)\]]*\s+")
+# Words whose trailing period does not end a sentence.
+_ABBREVIATIONS = {"mr", "mrs", "ms", "dr", "st", "vs", "e.g", "i.e", "etc"}
+
+
+class SayParser:
+    """
+    Incremental parser for the response protocol in SYSTEM_PROMPT.
+
+    Fed the streamed deltas of one response, it works out the command from the
+    first few tokens: "say" with a language, "nothing" (/say Nothing), "pausing"
+    (/pausing), or "text" for a response that does not start with a command.
+    feed() returns True once the rest of the stream is not needed (nothing and
+    pausing), so the caller can close it. The text after /say <Language> is
+    handed to on_segment(language, sentence) one sentence at a time, as soon as
+    each sentence is complete; finish() flushes the last one.
+    """
+
+    def __init__(self, on_segment=None, max_segment_chars=300):
+        self.on_segment = on_segment
+        self.max_segment_chars = max_segment_chars
+        self.command = None
+        self.language = None
+        self.segments = []
+        self._head = ""      # Text received before the command was known.
+        self._pending = ""   # Spoken text not yet emitted as a segment.
+
+    @property
+    def should_abort(self):
+        return self.command in ("nothing", "pausing")
+
+    def feed(self, delta):
+        if self.command is None:
+            self._head += delta
+            if not self._parse_command(final=False):
+                return False
+        elif self.command == "say":
+            self._pending += delta
+        if self.command == "say":
+            self._emit_complete()
+        return self.should_abort
+
+    def finish(self):
+        """Call when the stream ends; resolves a command cut short and emits the remaining text."""
+        if self.command is None:
+            self._parse_command(final=True)
+        if self.command == "say":
+            self._emit(self._pending)
+            self._pending = ""
+        return self.should_abort
+
+    def _parse_command(self, final):
+        """Decide the command from the buffered head. Returns False while more text is needed."""
+        head = self._head.lstrip()
+        if not head:
+            if final:
+                self.command = "text"
+            return final
+        if not head.startswith("/"):
+            self.command = "text"
+            return True
+        if PAUSING.startswith(head) or head.startswith(PAUSING):
+            if head.startswith(PAUSING):
+                self.command = "pausing"
+                return True
+            if final:
+                self.command = "text"
+            return final
+        if SAY.startswith(head):
+            if final:
+                self.command = "text"
+            return final
+        if not head.startswith(SAY) or (len(head) > len(SAY) and not head[len(SAY)].isspace()):
+            self.command = "text"
+            return True
+        # "/say <Language> ..." – wait until the language word is complete.
+        match = re.match(r"/say\s+(\S+)(\s|$)", head)
+        if match is None or (not match.group(2) and not final):
+            if final:
+                self.command = "text"
+            return final
+        language = match.group(1).strip(".,:;!")
+        if language.lower() == "nothing":
+            self.command = "nothing"
+            return True
+        self.command = "say"
+        self.language = language
+        self._pending = head[match.end():]
+        return True
+
+    def _emit_complete(self):
+        position = 0
+        while True:
+            match = _SENTENCE_END.search(self._pending, position)
+            if match is None:
+                break
+            words = self._pending[:match.start()].split()
+            if words and words[-1].lower() in _ABBREVIATIONS:
+                position = match.end()
+                continue
+            self._emit(self._pending[:match.end()])
+            self._pending = self._pending[match.end():]
+            position = 0
+        if len(self._pending) > self.max_segment_chars:
+            # A long run without sentence punctuation; break at the last clause or word boundary.
+            cut = max(self._pending.rfind(", ", 0, self.max_segment_chars), self._pending.rfind(" ", 0, self.max_segment_chars))
+            if cut > 0:
+                self._emit(self._pending[:cut + 1])
+                self._pending = self._pending[cut + 1:]
+
+    def _emit(self, text):
+        text = text.strip()
+        if not text:
+            return
+        self.segments.append(text)
+        if self.on_segment is not None:
+            self.on_segment(self.language, text)
@@ -0,0 +1,231 @@
+# server.py
+"""
+Multi-conversation server mode.
+
+Each websocket connection to ws://host:port/sessions/<session_id> is one
+conversation: the client streams linear16 16 kHz mono audio as binary
+messages and receives JSON messages back:
+
+  {"type": "ready", "session_id": ...}
+  {"type": "say", "request_id": ..., "language": ..., "text": ...}   one sentence of a /say response
+
+A text message {"type": "close"} (or closing the websocket) ends the session.
+Every session has its own DialogueAggregator (under sessions/<session_id>/),
+handlers, GPTPipeline, audio fan-out and supervised Deepgram connections.
+Sessions share one Deepgram client, one warm OpenAI client (ClientManager and
+its HTTP connection pool) and a limit on concurrent GPT streams.
+
+Usage:
+    python server.py [--host 0.0.0.0] [--port 8765] [--max-gpt-streams 32] [--max-sessions 100]
+                     [--deepgram-url URL] [--openai-base-url URL]
+
+loadtest.py measures how many sessions one core sustains.
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import time
+from collections import deque
+from dotenv import load_dotenv
+from deepgram import DeepgramClient, DeepgramClientOptions
+from websockets.asyncio.server import serve
+from clients import ClientManager, DeepgramSupervisor
+from audio_ring import AudioFanout
+from dialogue_manager import DialogueAggregator
+from endpointing import AdaptiveEndpointer
+from output_sink import NullSink
+from pipeline import GPTPipeline
+from transcription import LIVE_ADDONS, TranscriptionHandler, live_options
+
+_SESSION_PATH = re.compile(r"^/sessions/([A-Za-z0-9][A-Za-z0-9_.-]{0,63})/?$")
+
+
+class Session:
+    """One conversation: its own aggregator, pipeline, handlers and Deepgram connections."""
+
+    def __init__(self, session_id, languages, directory, deepgram, openai_client, limiter, send,
+                 endpointing_ms=300, live_options=live_options, adaptive_endpointing=False):
+        self.session_id = session_id
+        self.languages = languages
+        self.directory = directory
+        self.deepgram = deepgram
+        self.openai_client = openai_client
+        self.limiter = limiter
+        self.send = send
+        self.endpointing_ms = endpointing_ms
+        self.live_options = live_options
+        self.adaptive_endpointing = adaptive_endpointing
+        self.started = time.monotonic()
+        self.audio_bytes = 0
+        self.aggregator = None
+        self.pipeline = None
+        self.fanout = None
+        self.supervisor = None
+
+    async def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        # The event loop is shared by every session: read the history on a worker thread.
+        self.aggregator = DialogueAggregator(self.languages,
+                                             filename=os.path.join(self.directory, "dialogue_entries.json"),
+                                             background_load=True)
+        endpointer = None
+        if self.adaptive_endpointing:
+            endpointer = AdaptiveEndpointer(default_delay=0.2, endpointing=self.endpointing_ms / 1000)
+        self.pipeline = GPTPipeline(self.aggregator, endpointer=endpointer, sink=NullSink(),
+                                    on_segment=self._on_segment, openai_client=self.openai_client,
+                                    limiter=self.limiter)
+        await self.pipeline.start()
+        self.fanout = AudioFanout()
+        self.supervisor = DeepgramSupervisor(self.deepgram, self.fanout)
+        for language in self.languages:
+            handler = TranscriptionHandler(language, self.pipeline, audio_fanout=self.fanout)
+            if not await self.supervisor.add(language, self.live_options(language, self.endpointing_ms),
+                                             LIVE_ADDONS, handler.attach):
+                print(f"[Session {self.session_id}] Failed to connect to Deepgram for {language}")
+        if not self.supervisor.connections:
+            await self.close()
+            raise RuntimeError("no Deepgram connections")
+        await self.fanout.start()
+        await self.supervisor.start()
+
+    def feed(self, audio):
+        self.audio_bytes += len(audio)
+        self.fanout.write(audio)
+
+    def _on_segment(self, request_id, language, text):
+        message = json.dumps({"type": "say", "request_id": request_id, "language": language, "text": text},
+                             ensure_ascii=False)
+        task = asyncio.ensure_future(self.send(message))
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    async def close(self):
+        if self.fanout is not None:
+            await self.fanout.stop()
+        if self.supervisor is not None:
+            await self.supervisor.stop()
+        if self.pipeline is not None:
+            await self.pipeline.wait_idle(timeout=5.0)
+            await self.pipeline.stop()
+        if self.aggregator is not None:
+            # Joins the journal writer and rewrites the snapshot; keep that off the shared loop.
+            await asyncio.to_thread(self.aggregator.close)
+
+    def stats(self):
+        metrics = self.pipeline.metrics if self.pipeline else None
+        return {
+            "session_id": self.session_id,
+            "seconds": round(time.monotonic() - self.started, 3),
+            "audio_seconds": round(self.audio_bytes / (16000 * 2), 3),
+            "gpt": metrics.as_dict() if metrics else {},
+            "deepgram": self.supervisor.stats() if self.supervisor else {},
+        }
+
+
+class SessionServer:
+    """
+    Websocket front end that runs one Session per connection. Shared between
+    sessions: the Deepgram client, the OpenAI client and max_gpt_streams.
+    """
+
+    def __init__(self, languages, host="0.0.0.0", port=8765, directory="sessions", deepgram=None,
+                 openai_client=None, max_gpt_streams=32, max_sessions=None, endpointing_ms=300,
+                 live_options=live_options, adaptive_endpointing=False):
+        self.languages = languages
+        self.host = host
+        self.port = port
+        self.directory = directory
+        self.deepgram = deepgram if deepgram is not None else DeepgramClient()
+        # Without a client, GPTPipeline falls back to gpt_integration's shared one.
+        self.openai_client = openai_client
+        self.limiter = asyncio.Semaphore(max_gpt_streams)
+        self.max_sessions = max_sessions
+        self.endpointing_ms = endpointing_ms
+        self.live_options = live_options
+        self.adaptive_endpointing = adaptive_endpointing
+        self.sessions = {}
+        self.finished = deque(maxlen=1000)  # stats() of closed sessions
+        self._server = None
+
+    async def start(self):
+        self._server = await serve(self._handle, self.host, self.port, max_size=2 ** 20)
+        self.port = self._server.sockets[0].getsockname()[1]
+        print(f"[Server] Listening on ws://{self.host}:{self.port}/sessions/<session_id>")
+        return self
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _handle(self, websocket):
+        match = _SESSION_PATH.match(websocket.request.path.split("?")[0])
+        if match is None:
+            await websocket.close(1008, "expected /sessions/<session_id>")
+            return
+        session_id = match.group(1)
+        if session_id in self.sessions:
+            await websocket.close(1008, "session already connected")
+            return
+        if self.max_sessions is not None and len(self.sessions) >= self.max_sessions:
+            await websocket.close(1013, "too many sessions")
+            return
+
+        session = Session(session_id, self.languages, os.path.join(self.directory, session_id), self.deepgram,
+                          self.openai_client, self.limiter, websocket.send, self.endpointing_ms,
+                          self.live_options, self.adaptive_endpointing)
+        self.sessions[session_id] = session
+        try:
+            await session.start()
+            await websocket.send(json.dumps({"type": "ready", "session_id": session_id}))
+            async for message in websocket:
+                if isinstance(message, bytes):
+                    session.feed(message)
+                elif json.loads(message).get("type") == "close":
+                    break
+        except Exception as e:
+            print(f"[Session {session_id}] Error: {e}")
+        finally:
+            await session.close()
+            del self.sessions[session_id]
+            self.finished.append(session.stats())
+
+
+async def serve_forever(args):
+    deepgram = None
+    if args.deepgram_url:
+        deepgram = DeepgramClient(os.getenv("DEEPGRAM_API_KEY", ""), DeepgramClientOptions(url=args.deepgram_url))
+    clients = await ClientManager(base_url=args.openai_base_url, max_connections=args.max_gpt_streams).start()
+    server = await SessionServer(args.languages, host=args.host, port=args.port, directory=args.directory,
+                                 deepgram=deepgram, openai_client=clients.openai,
+                                 max_gpt_streams=args.max_gpt_streams, max_sessions=args.max_sessions,
+                                 adaptive_endpointing=args.adaptive_endpointing).start()
+    try:
+        await asyncio.Future()
+    finally:
+        await server.stop()
+        await clients.stop()
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--languages", nargs="+", default=["en-US", "ru"])
+    parser.add_argument("--directory", default="sessions", help="where each session's dialogue is stored")
+    parser.add_argument("--max-gpt-streams", type=int, default=32, help="concurrent GPT streams across sessions")
+    parser.add_argument("--max-sessions", type=int)
+    parser.add_argument("--deepgram-url", help="alternative Deepgram endpoint, e.g. self-hosted")
+    parser.add_argument("--openai-base-url", help="alternative OpenAI-compatible endpoint")
+    parser.add_argument("--adaptive-endpointing", action="store_true",
+                        help="wait per speaker's learned pauses instead of the fixed debounce (slower to respond)")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve_forever(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# summarizer.py
+import threading
+import time
+import openai
+
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a live, transcribed conversation between people and an AI partner (GPT). "
+    "Fold the new transcript lines into the existing summary. Keep names, facts, open questions and anything "
+    "the speakers asked GPT to remember. Write plain prose, at most a few short paragraphs."
+)
+
+
+class ConversationSummarizer:
+    """
+    Background thread that folds entries which have slid out of the prompt
+    window into the aggregator's rolling summary.
+
+    It only runs once the dialogue has been idle for idle_seconds, so the
+    summary call never competes with a live GPT response. Pass a client
+    created with a custom base_url to run it against a local stub server.
+    """
+
+    def __init__(self, aggregator, client=None, model="gpt-4o-mini", idle_seconds=5.0,
+                 min_entries=10, poll_interval=1.0):
+        self.aggregator = aggregator
+        self.client = client if client is not None else openai
+        self.model = model
+        self.idle_seconds = idle_seconds
+        self.min_entries = min_entries
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="summarizer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.poll_interval):
+            if time.monotonic() - self.aggregator.last_activity < self.idle_seconds:
+                continue
+            try:
+                self.summarize_once()
+            except Exception as e:
+                print(f"Error summarizing dialogue: {e}")
+
+    def summarize_once(self, force=False):
+        """Summarize pending entries. Returns True if the summary was updated."""
+        summary, pending, upto = self.aggregator.get_unsummarized_entries()
+        if not pending or (len(pending) < self.min_entries and not force):
+            return False
+
+        new_lines = "\n".join(str(entry) for entry in pending)
+        user_content = (
+            f"Existing summary:\n{summary or '(none)'}\n\n"
+            f"New transcript lines:\n{new_lines}"
+        )
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": SUMMARY_PROMPT},
+                {"role": "user", "content": user_content},
+            ],
+        )
+        new_summary = (response.choices[0].message.content or "").strip()
+        if not new_summary:
+            return False
+        self.aggregator.set_summary(new_summary, upto)
+        print(f"[Summarizer] Folded {len(pending)} entries into the conversation summary.")
+        return True
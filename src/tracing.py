@@ -0,0 +1,275 @@
+# tracing.py
+"""
+Lightweight spans and latency histograms for the transcription -> GPT path.
+
+Every utterance gets a trace ID at its first Deepgram event; the handler,
+pipeline, aggregator and GPT stream record spans against it. Span durations
+feed one histogram per span name, exported as JSON or Prometheus text, and the
+spans themselves can be dumped as a Chrome trace (chrome://tracing, Perfetto).
+
+The module-level `tracer` starts disabled. While disabled, new_trace() returns
+None and begin()/record() do nothing beyond one attribute check, so the hot
+path can call them unconditionally.
+"""
+import contextlib
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# Histogram bucket upper bounds, in seconds.
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Cumulative-bucket histogram of durations in seconds."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot is +Inf.
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = 0
+        while index < len(self.buckets) and value > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th observation (an estimate)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def as_dict(self):
+        cumulative = list(itertools.accumulate(self.counts))
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+            "buckets": {str(bound): cumulative[i] for i, bound in enumerate(self.buckets)},
+        }
+
+
+class Span:
+    """An open span; call end() once, from any task or thread."""
+
+    __slots__ = ("tracer", "name", "trace_id", "start", "args")
+
+    def __init__(self, tracer, name, trace_id, args):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.start = time.monotonic()
+        self.args = args
+
+    def end(self, **args):
+        if args:
+            self.args.update(args)
+        self.tracer.record(self.name, self.trace_id, self.start, time.monotonic(), **self.args)
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def end(self, **args):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Tracer:
+    """
+    Collects spans and histograms. Spans are kept in a bounded deque for the
+    Chrome trace; histograms are unbounded counters and always complete.
+    """
+
+    def __init__(self, enabled=False, max_spans=100000):
+        self.enabled = enabled
+        self.histograms = {}
+        self.spans = deque(maxlen=max_spans)
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self._trace_ids = itertools.count(1)
+        self._exporter = None
+        self._stop_exporter = threading.Event()
+
+    def new_trace(self):
+        """A new trace ID, or None while disabled."""
+        if not self.enabled:
+            return None
+        return next(self._trace_ids)
+
+    def begin(self, name, trace_id=None, **args):
+        """Open a span; the returned object's end() records it."""
+        if not self.enabled:
+            return _NOOP_SPAN
+        return Span(self, name, trace_id, args)
+
+    def record(self, name, trace_id, start, end, **args):
+        """Record a finished span from monotonic start/end times."""
+        if not self.enabled:
+            return
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(max(0.0, end - start))
+            self.spans.append((name, trace_id, start, end, args))
+
+    def instant(self, name, trace_id=None, **args):
+        """Record a zero-length event, e.g. a cancellation."""
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        with self.lock:
+            self.spans.append((name, trace_id, now, None, args))
+
+    def observe(self, name, seconds):
+        """Add a sample to a histogram without recording a span."""
+        if not self.enabled:
+            return
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def snapshot(self):
+        with self.lock:
+            return {name: histogram.as_dict() for name, histogram in sorted(self.histograms.items())}
+
+    def write_json(self, path):
+        _write_atomic(path, json.dumps({"histograms": self.snapshot()}, indent=2))
+
+    def write_prometheus(self, path, prefix="livegpt_span_seconds"):
+        """Write histograms in the Prometheus text format (e.g. for node_exporter's textfile collector)."""
+        lines = [f"# HELP {prefix} Duration of pipeline spans in seconds.", f"# TYPE {prefix} histogram"]
+        for name, histogram in self.snapshot().items():
+            for bound, count in histogram["buckets"].items():
+                lines.append(f'{prefix}_bucket{{span="{name}",le="{bound}"}} {count}')
+            lines.append(f'{prefix}_bucket{{span="{name}",le="+Inf"}} {histogram["count"]}')
+            lines.append(f'{prefix}_sum{{span="{name}"}} {histogram["sum"]}')
+            lines.append(f'{prefix}_count{{span="{name}"}} {histogram["count"]}')
+        _write_atomic(path, "\n".join(lines) + "\n")
+
+    def write_chrome_trace(self, path):
+        """Write the recorded spans in the Chrome trace event format, one row per trace ID."""
+        with self.lock:
+            spans = list(self.spans)
+        events = []
+        for name, trace_id, start, end, args in spans:
+            event = {
+                "name": name,
+                "cat": name.split(".")[0],
+                "pid": 1,
+                "tid": trace_id or 0,
+                "ts": round((start - self.started) * 1e6, 1),
+                "args": dict(args, trace_id=trace_id),
+            }
+            if end is None:
+                event.update(ph="i", s="t")
+            else:
+                event.update(ph="X", dur=round((end - start) * 1e6, 1))
+            events.append(event)
+        _write_atomic(path, json.dumps({"traceEvents": events, "displayTimeUnit": "ms"}))
+
+    def export(self, json_path=None, prometheus_path=None, chrome_trace_path=None):
+        if json_path:
+            self.write_json(json_path)
+        if prometheus_path:
+            self.write_prometheus(prometheus_path)
+        if chrome_trace_path:
+            self.write_chrome_trace(chrome_trace_path)
+
+    def start_periodic_export(self, interval=10.0, json_path=None, prometheus_path=None):
+        """Rewrite the histogram files every interval seconds on a daemon thread."""
+        def run():
+            while not self._stop_exporter.wait(interval):
+                try:
+                    self.export(json_path=json_path, prometheus_path=prometheus_path)
+                except Exception as e:
+                    print(f"[Tracing] Error exporting metrics: {e}")
+
+        self._stop_exporter.clear()
+        self._exporter = threading.Thread(target=run, name="trace-exporter", daemon=True)
+        self._exporter.start()
+
+    def stop_periodic_export(self):
+        if self._exporter is not None:
+            self._stop_exporter.set()
+            self._exporter.join()
+            self._exporter = None
+
+    def report(self):
+        for name, histogram in self.snapshot().items():
+            print(f"[Trace] {name}: count={histogram['count']} "
+                  f"p50<={histogram['p50'] * 1000:g}ms p99<={histogram['p99'] * 1000:g}ms")
+
+
+class StartupTimer:
+    """
+    Startup timing breakdown: seconds spent in each phase, from `started`
+    (e.g. process launch) until ready(). Phases that run concurrently
+    overlap, so they can add up to more than the total. Timed phases are
+    also recorded as startup.* spans while tracing is enabled.
+    """
+
+    def __init__(self, started=None):
+        self.started = time.monotonic() if started is None else started
+        self.phases = {}
+        self.ready_at = None
+
+    def add(self, name, seconds):
+        self.phases[name] = seconds
+
+    def record(self, name, start, end=None):
+        end = time.monotonic() if end is None else end
+        self.add(name, end - start)
+        tracer.record(f"startup.{name}", None, start, end)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record(name, start)
+
+    async def timed(self, name, awaitable):
+        """Await awaitable as a phase; use with asyncio.gather to time concurrent phases."""
+        start = time.monotonic()
+        try:
+            return await awaitable
+        finally:
+            self.record(name, start)
+
+    def ready(self):
+        self.ready_at = time.monotonic()
+
+    def report(self):
+        phases = ", ".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in self.phases.items())
+        print(f"[Startup] Ready to listen after {(self.ready_at - self.started) * 1000:.0f}ms: {phases}")
+
+
+def _write_atomic(path, text):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+tracer = Tracer()
@@ -1,26 +1,114 @@
 # transcription.py
-import threading
-import time
-import uuid
-from deepgram import LiveTranscriptionEvents
-from gpt_integration import stream_gpt4_response
+from deepgram import LiveOptions, LiveTranscriptionEvents
+from tracing import tracer
+
+
+def live_options(language, endpointing_ms=300):
+    """Deepgram streaming options for one language connection."""
+    return LiveOptions(
+        # Use nova-3 for English and nova-2 for other languages.
+        model="nova-3" if language == "en-US" else "nova-2",
+        language=language,
+        smart_format=True,
+        encoding="linear16",
+        diarize=True,
+        channels=1,
+        sample_rate=16000,
+        interim_results=True,
+        utterance_end_ms="1000",
+        vad_events=True,
+        endpointing=endpointing_ms,
+        filler_words=True,
+        # If Deepgram supports intents as an option:
+        # intents=True,
+    )
+
+
+# Deepgram addons sent with every connection.
+LIVE_ADDONS = {"no_delay": "true"}
+
+
+class SpeakerRun:
+    """Consecutive words of one speaker in a result, with their audio time span and mean confidence."""
+
+    __slots__ = ("speaker", "text", "start", "end", "confidence", "line")
+
+    def __init__(self, speaker, language, words, start, end, confidence):
+        self.speaker = speaker
+        self.text = " ".join(words)
+        self.start = start
+        self.end = end
+        self.confidence = confidence
+        self.line = f"[Speaker: {speaker}, Language: {language}]: {self.text}"
+
+
+def build_speaker_runs(words, language):
+    """
+    Group a result's words into one SpeakerRun per speaker change, in a single
+    pass. Words without diarization or confidence count as speaker "Unknown"
+    and confidence 0.
+    """
+    try:
+        return _speaker_runs(words, language)
+    except AttributeError:
+        # Rare enough that the attribute lookups with defaults stay off the common path.
+        return _speaker_runs([_WordDefaults(word) for word in words], language)
+
+
+def _speaker_runs(words, language):
+    runs = []
+    texts = []
+    speaker = start = end = None
+    confidence = 0.0
+    for word in words:
+        if word.speaker != speaker or not texts:
+            if texts:
+                runs.append(SpeakerRun(speaker, language, texts, start, end, confidence / len(texts)))
+            texts = []
+            speaker = word.speaker
+            start = word.start
+            confidence = 0.0
+        texts.append(word.word)
+        end = word.end
+        confidence += word.confidence
+    if texts:
+        runs.append(SpeakerRun(speaker, language, texts, start, end, confidence / len(texts)))
+    return runs
+
+
+class _WordDefaults:
+    __slots__ = ("word", "start", "end", "speaker", "confidence")
+
+    def __init__(self, word):
+        self.word = word.word
+        self.start = word.start
+        self.end = word.end
+        self.speaker = getattr(word, "speaker", "Unknown")
+        self.confidence = getattr(word, "confidence", 0.0)
 
-# Global variables to coordinate GPT call initiation across threads.
-gpt_call_lock = threading.Lock()
-gpt_call_pending = False
 
 class TranscriptionHandler:
-    def __init__(self, language, aggregator):
-        self.language = language
-        self.aggregator = aggregator
-        self.final_chunks = []          # Buffer for final transcript pieces.
-        self.current_utterance_id = None  # Unique ID for the current utterance.
-        self.current_gpt_request_id = 0
+    """
+    Receives events from one Deepgram websocket connection. Handlers are
+    coroutines because the async Deepgram client awaits them on its receive loop.
+    """
 
-    def on_open(self, *args, **kwargs):
+    def __init__(self, language, pipeline, language_gate=None, audio_fanout=None):
+        self.language = language
+        self.pipeline = pipeline
+        self.language_gate = language_gate
+        self.audio_fanout = audio_fanout
+        self.aggregator = pipeline.aggregator
+        self.interim_lines = []         # Latest interim transcript, for speculative requests.
+        self.interim_repeats = 0
+        self.stable_interim_repeats = 1
+        self.trace_id = None            # Trace of the utterance being transcribed, while tracing.
+        self._stt_span = None
+
+    async def on_open(self, *args, **kwargs):
         print(f"[{self.language}] Connection opened.")
 
-    def on_message(self, *args, **kwargs):
+    async def on_message(self, *args, **kwargs):
         result = kwargs.get("result", args[0] if args else None)
         if not result:
             return
@@ -28,6 +116,8 @@ class TranscriptionHandler:
         transcript = result.channel.alternatives[0].transcript
         if not transcript:
             return
+        if self.trace_id is None:
+            self._begin_trace()
 
         # print(result)
 
@@ -38,76 +128,97 @@ class TranscriptionHandler:
             print(f"[{self.language}] {speaker}: {transcript}")
             return
 
-        if result.is_final:
-            # Build a readable, diarized transcript.
-            current_speaker = None
-            current_line = ""
-            speaker_lines = []
-            for word in words:
-                # Each word object is assumed to have a 'word' attribute and a 'speaker' attribute.
-                speaker = getattr(word, 'speaker', 'Unknown')
-                if current_speaker is None:
-                    current_speaker = speaker
-                if speaker != current_speaker:
-                    speaker_lines.append(f"[Speaker: {current_speaker}, Language: {self.language}]: {current_line.strip()}")
-                    current_line = word.word + " "
-                    current_speaker = speaker
-                else:
-                    current_line += word.word + " "
-            if current_line:
-                speaker_lines.append(f"[Speaker: {current_speaker}, Language: {self.language}]: {current_line.strip()}")
+        if not result.is_final and not self.pipeline.speculative:
+            return
 
+        runs = build_speaker_runs(words, self.language)
+        speaker_lines = [run.line for run in runs]
+        if result.is_final:
             # Update aggregator with the final transcript.
-            # self.final_chunks.(transcript)
-            for line in speaker_lines:
-                self.aggregator.append_speaker_entry(line)
-
-            # if not self.current_utterance_id:
-            #     self.current_utterance_id = str(uuid.uuid4())
-            # utterance_text = " ".join(self.final_chunks)
-            # self.aggregator.update_transcription(
-            #     self.current_utterance_id, 
-            #     self.language, 
-            #     utterance_text, 
-            #     finalize=True
-            # )
-            self.maybe_initiate_gpt_call()
-            # self.final_chunks = []
+            self.interim_lines = []
+            self.interim_repeats = 0
+            if self.pipeline.endpointer is not None:
+                self.pipeline.endpointer.observe_final(self.language, words, getattr(result, "speech_final", False))
+            start = getattr(result, "start", 0.0) or 0.0
+            end = start + (getattr(result, "duration", 0.0) or 0.0)
+            confidence = getattr(result.channel.alternatives[0], "confidence", 0.0)
+            if self.language_gate is not None:
+                self.language_gate.observe_final(self.language, confidence, self._detected_language(result, words))
+            if self.audio_fanout is not None:
+                # Connections that skipped or replayed audio have their own clock; use the microphone's.
+                start = self.audio_fanout.to_source_time(self.language, start)
+                end = self.audio_fanout.to_source_time(self.language, end)
+                for run in runs:
+                    run.start = self.audio_fanout.to_source_time(self.language, run.start)
+                    run.end = self.audio_fanout.to_source_time(self.language, run.end)
+                if tracer.enabled:
+                    # How far behind the microphone this final arrived.
+                    ring = self.audio_fanout.ring
+                    tracer.observe("stt.final_lag", ring.write_position / ring.bytes_per_second - end)
+            trace_id = self.trace_id
+            self._stt_span.end(confidence=confidence)
+            self.trace_id = self._stt_span = None
+            await self.pipeline.submit_final(self.language, speaker_lines, start, end, confidence, trace_id, runs)
         else:
-            # For interim results, you can choose to print or ignore.
-            pass
-
-    def maybe_initiate_gpt_call(self):
-        global gpt_call_pending
-        with gpt_call_lock:
-            if not gpt_call_pending:
-                gpt_call_pending = True
-                threading.Timer(0.2, self.trigger_gpt_call).start()
-
-    def trigger_gpt_call(self):
-        global gpt_call_pending
-        conversation_text = self.aggregator.get_aggregated_dialogue()
-        self.current_gpt_request_id += 1
-        current_request = self.current_gpt_request_id
-        stream_gpt4_response(conversation_text, self, current_request)
-        with gpt_call_lock:
-            gpt_call_pending = False
-
-    def on_close(self, *args, **kwargs):
+            # Interim results only matter for speculative GPT requests. The same
+            # interim text repeating means the speaker has stopped adding words.
+            if speaker_lines == self.interim_lines:
+                self.interim_repeats += 1
+            else:
+                self.interim_lines = speaker_lines
+                self.interim_repeats = 0
+            if self.interim_repeats >= self.stable_interim_repeats:
+                await self.pipeline.speculate(self.language, self.interim_lines, self.trace_id)
+
+    def _begin_trace(self):
+        """Start the trace of a new utterance at its first Deepgram event."""
+        self.trace_id = tracer.new_trace()
+        self._stt_span = tracer.begin("stt.utterance", self.trace_id, language=self.language)
+
+    def _detected_language(self, result, words):
+        """Language Deepgram reported for this result, if any (channel-level or per-word majority)."""
+        detected = getattr(result.channel, "detected_language", None)
+        if detected:
+            return detected
+        counts = {}
+        for word in words:
+            language = getattr(word, "language", None)
+            if language:
+                counts[language] = counts.get(language, 0) + 1
+        return max(counts, key=counts.get) if counts else None
+
+    async def on_close(self, *args, **kwargs):
         print(f"[{self.language}] Connection closed.")
 
-    def on_error(self, *args, **kwargs):
+    async def on_error(self, *args, **kwargs):
         error = kwargs.get("error", args[0] if args else None)
         print(f"[{self.language}] Error: {error}")
 
-    def on_unhandled(self, *args, **kwargs):
-        pass
-
-    def on_metadata(self, *args, **kwargs):
+    async def on_unhandled(self, *args, **kwargs):
         pass
 
-    def on_speech_started(self, *args, **kwargs):
+    async def on_metadata(self, *args, **kwargs):
         pass
 
-    def on_utterance_end(self, *args, **kwargs):
-        pass
+    async def on_speech_started(self, *args, **kwargs):
+        if self.trace_id is None:
+            self._begin_trace()
+        self.pipeline.speech_started()
+
+    async def on_utterance_end(self, *args, **kwargs):
+        if self.pipeline.endpointer is not None:
+            self.pipeline.endpointer.observe_utterance_end(self.language)
+        # Deepgram saw a gap after the last word; the interim text is likely complete.
+        if self.interim_lines:
+            await self.pipeline.speculate(self.language, self.interim_lines, self.trace_id)
+
+    def attach(self, connection):
+        """Register this handler's callbacks on a Deepgram websocket connection."""
+        connection.on(LiveTranscriptionEvents.Open, self.on_open)
+        connection.on(LiveTranscriptionEvents.Transcript, self.on_message)
+        connection.on(LiveTranscriptionEvents.Metadata, self.on_metadata)
+        connection.on(LiveTranscriptionEvents.SpeechStarted, self.on_speech_started)
+        connection.on(LiveTranscriptionEvents.UtteranceEnd, self.on_utterance_end)
+        connection.on(LiveTranscriptionEvents.Close, self.on_close)
+        connection.on(LiveTranscriptionEvents.Error, self.on_error)
+        connection.on(LiveTranscriptionEvents.Unhandled, self.on_unhandled)
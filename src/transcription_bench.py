@@ -0,0 +1,121 @@
+# transcription_bench.py
+"""
+CPU cost of turning one Deepgram final into dialogue entries.
+
+Takes the final Results messages of a recorded session (EventRecorder JSONL)
+or of a session synthesized from a dialogue log, and reports CPU time per
+result for:
+
+  lines (old)   the previous line builder: speaker and text only
+  runs          build_speaker_runs: also keeps each line's time span and confidence
+  commit        DialogueAggregator.submit_transcription of the runs (one call)
+
+The runs builder does more per word than the old one and costs somewhat more
+(about 10-20% on short results); both are small next to the commit.
+
+Usage:
+    python transcription_bench.py [--events session_events.jsonl] [--repeat 200]
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from deepgram import LiveResultResponse
+from dialogue_manager import DialogueAggregator
+from replay import DEFAULT_DIALOGUE, load_events, synthesize_events
+from transcription import build_speaker_runs
+
+
+def legacy_speaker_lines(words, language):
+    """The line builder TranscriptionHandler used before build_speaker_runs, for comparison."""
+    current_speaker = None
+    current_line = ""
+    speaker_lines = []
+    for word in words:
+        speaker = getattr(word, 'speaker', 'Unknown')
+        if current_speaker is None:
+            current_speaker = speaker
+        if speaker != current_speaker:
+            speaker_lines.append(f"[Speaker: {current_speaker}, Language: {language}]: {current_line.strip()}")
+            current_line = word.word + " "
+            current_speaker = speaker
+        else:
+            current_line += word.word + " "
+    if current_line:
+        speaker_lines.append(f"[Speaker: {current_speaker}, Language: {language}]: {current_line.strip()}")
+    return speaker_lines
+
+
+def load_results(events, language):
+    results = []
+    for event in events:
+        message = event["message"]
+        if event["language"] == language and message.get("type") == "Results" and message.get("is_final"):
+            result = LiveResultResponse.from_json(json.dumps(message))
+            if result.channel.alternatives[0].words:
+                results.append(result)
+    return results
+
+
+def cpu_per_result(results, repeat, fn):
+    started = time.process_time()
+    for _ in range(repeat):
+        for result in results:
+            fn(result)
+    return (time.process_time() - started) / (repeat * len(results))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", help="JSONL session recorded by EventRecorder")
+    parser.add_argument("--dialogue", default=DEFAULT_DIALOGUE,
+                        help="dialogue log to synthesize a session from when --events is not given")
+    parser.add_argument("--language", default="en-US")
+    parser.add_argument("--utterances", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    if args.events:
+        events = load_events(args.events)
+    else:
+        events = synthesize_events(args.dialogue, [args.language], max_utterances=args.utterances)
+    results = load_results(events, args.language)
+    if not results:
+        parser.error(f"no final results for {args.language}")
+    words = sum(len(r.channel.alternatives[0].words) for r in results)
+    print(f"{len(results)} final results, {words / len(results):.1f} words each")
+
+    language = args.language
+    # Both builders must produce the same lines.
+    for result in results:
+        result_words = result.channel.alternatives[0].words
+        assert legacy_speaker_lines(result_words, language) == [r.line for r in build_speaker_runs(result_words, language)]
+
+    rows = [
+        ("lines (old)", cpu_per_result(results, args.repeat,
+                                       lambda r: legacy_speaker_lines(r.channel.alternatives[0].words, language))),
+        ("runs", cpu_per_result(results, args.repeat,
+                                lambda r: build_speaker_runs(r.channel.alternatives[0].words, language))),
+    ]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        aggregator = DialogueAggregator([language], filename=os.path.join(tmpdir, "dialogue_entries.json"))
+
+        def commit(result):
+            runs = build_speaker_runs(result.channel.alternatives[0].words, language)
+            aggregator.submit_transcription(language, [run.line for run in runs], result.start,
+                                            result.start + result.duration, result.channel.alternatives[0].confidence,
+                                            runs=runs)
+
+        try:
+            rows.append(("commit", cpu_per_result(results, max(1, args.repeat // 10), commit)))
+        finally:
+            aggregator.close()
+
+    print(f"{'stage':<14}{'us/result':>12}")
+    for name, seconds in rows:
+        print(f"{name:<14}{seconds * 1e6:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,347 @@
+# tts.py
+import asyncio
+import queue
+import threading
+import time
+from tracing import tracer
+
+# Sentinel pushed onto a backend's command queue to stop its thread.
+_STOP = object()
+
+
+class TTSBackend:
+    """
+    Speech backend used by TTSStage. synthesize() turns one sentence into
+    something play() can output; play() must stop promptly when cancelled.
+    """
+
+    async def synthesize(self, text, language):
+        raise NotImplementedError
+
+    async def play(self, audio):
+        raise NotImplementedError
+
+    def duration(self, audio):
+        """Playback length in seconds if known, used to estimate how much of an interrupted sentence was heard."""
+        return None
+
+    def close(self):
+        pass
+
+
+class FakeTTSBackend(TTSBackend):
+    """
+    Test double: synthesis and playback only take time. Every playback is
+    recorded in `played` as (text, seconds played, completed).
+    """
+
+    def __init__(self, synth_seconds=0.05, words_per_second=3.0):
+        self.synth_seconds = synth_seconds
+        self.words_per_second = words_per_second
+        self.played = []
+
+    async def synthesize(self, text, language):
+        await asyncio.sleep(self.synth_seconds)
+        return {"text": text, "language": language, "duration": len(text.split()) / self.words_per_second}
+
+    async def play(self, audio):
+        started = time.monotonic()
+        try:
+            await asyncio.sleep(audio["duration"])
+        except asyncio.CancelledError:
+            self.played.append((audio["text"], time.monotonic() - started, False))
+            raise
+        self.played.append((audio["text"], audio["duration"], True))
+
+    def duration(self, audio):
+        return audio["duration"]
+
+
+class Pyttsx3Backend(TTSBackend):
+    """
+    Offline system voices through pyttsx3 (optional dependency). pyttsx3
+    speaks text directly, so synthesize() has nothing to prepare ahead.
+
+    pyttsx3 engines are not thread-safe, so the engine lives on its own
+    thread and runs its event loop there (startLoop(False) plus iterate());
+    play() and cancellation only send it commands. A cancelled play() sends a
+    stop that the engine thread handles before the next sentence.
+    """
+
+    def __init__(self, rate=None):
+        try:
+            import pyttsx3
+        except ImportError as e:
+            raise RuntimeError("Pyttsx3Backend needs pyttsx3: pip install pyttsx3") from e
+        self._pyttsx3 = pyttsx3
+        self.rate = rate
+        self.commands = queue.Queue()
+        self._current = None         # (name, loop, future) of the sentence being spoken; engine thread only
+        self._sentences = 0
+        self._ready = threading.Event()
+        self._error = None
+        self._thread = threading.Thread(target=self._engine_loop, name="pyttsx3", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self._error is not None:
+            raise RuntimeError(f"pyttsx3 failed to start: {self._error}") from self._error
+
+    async def synthesize(self, text, language):
+        return text
+
+    async def play(self, audio):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.commands.put(("say", audio, loop, future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            self.commands.put(("stop", None, None, None))
+            raise
+
+    def close(self):
+        if self._thread is not None:
+            self.commands.put(_STOP)
+            self._thread.join()
+            self._thread = None
+
+    def _engine_loop(self):
+        try:
+            engine = self._pyttsx3.init()
+            if self.rate is not None:
+                engine.setProperty("rate", self.rate)
+            engine.connect("finished-utterance", self._on_finished)
+            engine.startLoop(False)
+        except Exception as e:
+            self._error = e
+            self._ready.set()
+            return
+        self._ready.set()
+        while True:
+            try:
+                # Poll while speaking so the engine keeps iterating; block while idle.
+                command = self.commands.get(timeout=0.01) if self._current is not None else self.commands.get()
+            except queue.Empty:
+                command = None
+            if command is _STOP:
+                engine.stop()
+                self._finish()
+                engine.endLoop()
+                return
+            if command is not None:
+                kind, text, loop, future = command
+                if kind == "say":
+                    # Anything still speaking was superseded.
+                    if self._current is not None:
+                        engine.stop()
+                        self._finish()
+                    self._sentences += 1
+                    name = f"sentence-{self._sentences}"
+                    self._current = (name, loop, future)
+                    engine.say(text, name)
+                elif kind == "stop" and self._current is not None:
+                    engine.stop()
+                    self._finish()
+            engine.iterate()
+
+    def _on_finished(self, name, completed):
+        # Called by the engine on the engine thread; a sentence that was stopped may report late.
+        if self._current is not None and self._current[0] == name:
+            self._finish()
+
+    def _finish(self):
+        if self._current is not None:
+            _, loop, future = self._current
+            self._current = None
+            loop.call_soon_threadsafe(_resolve, future)
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class TTSStage:
+    """
+    Speaks GPT responses sentence by sentence while they stream.
+
+    submit() is the pipeline's on_segment callback. A synthesis task prepares
+    up to max_ahead sentences while the current one plays. barge_in() (someone
+    started talking) stops playback at once and drops everything queued. A
+    newer response interrupts an older one the same way.
+
+    complete() is the on_complete callback: once a response has finished
+    playing, or was interrupted, the part that was actually spoken is added to
+    the aggregator as the GPT entry, so the dialogue matches what was heard.
+    """
+
+    def __init__(self, backend, aggregator, max_ahead=1):
+        self.backend = backend
+        self.aggregator = aggregator
+        self.segments = asyncio.Queue()
+        self.ready = asyncio.Queue(maxsize=max_ahead)
+        self.responses = {}          # request_id -> response state, until it is recorded
+        self.latest_request = 0
+        self.interrupted_upto = 0    # Responses up to this request_id were cut off and recorded.
+        self.segments_played = 0
+        self.segments_interrupted = 0
+        self.barge_ins = 0
+        self._playing = None         # (request_id, audio, started, task) of the sentence being played
+        self._tasks = []
+
+    async def start(self):
+        self._tasks = [
+            asyncio.create_task(self._synthesize_loop(), name="tts-synthesize"),
+            asyncio.create_task(self._play_loop(), name="tts-play"),
+        ]
+
+    async def stop(self):
+        """Stop playback and record whatever was spoken of the responses still open."""
+        self._interrupt_all()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self.backend.close()
+
+    def submit(self, request_id, language, text):
+        if request_id < self.latest_request or request_id <= self.interrupted_upto:
+            return
+        if request_id > self.latest_request:
+            # A newer response supersedes whatever is still playing.
+            self._interrupt_all()
+            self.latest_request = request_id
+        response = self.responses.setdefault(request_id, _Response(language))
+        response.queued += 1
+        self.segments.put_nowait((request_id, language, text, time.monotonic()))
+
+    def complete(self, request_id, response_text, partial):
+        """The GPT stream for request_id has ended (partial if it was cancelled)."""
+        if request_id <= self.interrupted_upto:
+            # Already recorded with what was spoken before the interruption.
+            return
+        response = self.responses.get(request_id)
+        if response is None:
+            # Nothing was spoken; keep the response in the dialogue as it came.
+            self.aggregator.add_gpt_response(response_text, partial=partial)
+            return
+        response.stream_done = True
+        response.stream_partial = partial
+        response.text = response_text
+        self._record_if_done(request_id)
+
+    def barge_in(self):
+        """Someone started speaking: stop talking now."""
+        if self._playing is None and not self.responses:
+            return
+        self.barge_ins += 1
+        print("[TTS] Barge-in, stopping playback")
+        self._interrupt_all()
+
+    def _interrupt_all(self):
+        if self._playing is not None:
+            request_id, audio, started, task = self._playing
+            response = self.responses.get(request_id)
+            if response is not None:
+                response.spoken.append(self._heard_part(audio, time.monotonic() - started))
+            self.segments_interrupted += 1
+            self._playing = None
+            task.cancel()
+        for queue in (self.segments, self.ready):
+            while not queue.empty():
+                queue.get_nowait()
+        for request_id, response in list(self.responses.items()):
+            response.interrupted = True
+            self.interrupted_upto = max(self.interrupted_upto, request_id)
+            self._record(request_id)
+
+    def _heard_part(self, audio, elapsed):
+        """The words of an interrupted sentence that were (probably) heard."""
+        text = audio["text"] if isinstance(audio, dict) else str(audio)
+        duration = self.backend.duration(audio)
+        if not duration:
+            return text
+        words = text.split()
+        return " ".join(words[:int(len(words) * min(1.0, elapsed / duration))])
+
+    async def _synthesize_loop(self):
+        while True:
+            request_id, language, text, submitted = await self.segments.get()
+            response = self.responses.get(request_id)
+            if response is None or response.interrupted:
+                continue
+            try:
+                audio = await self.backend.synthesize(text, language)
+            except Exception as e:
+                print(f"[TTS] Error synthesizing: {e}")
+                response.queued -= 1
+                self._record_if_done(request_id)
+                continue
+            if isinstance(audio, dict):
+                audio.setdefault("text", text)
+            elif not isinstance(audio, str):
+                audio = {"text": text, "audio": audio}
+            if response.interrupted:
+                continue
+            await self.ready.put((request_id, audio, submitted))
+
+    async def _play_loop(self):
+        while True:
+            request_id, audio, submitted = await self.ready.get()
+            response = self.responses.get(request_id)
+            if response is None or response.interrupted:
+                continue
+            started = time.monotonic()
+            tracer.observe("tts.segment_wait", started - submitted)
+            task = asyncio.create_task(self.backend.play(audio))
+            self._playing = (request_id, audio, started, task)
+            # wait() rather than await, so interrupting playback does not cancel this loop.
+            await asyncio.wait([task])
+            if task.cancelled():
+                # Interrupted; _interrupt_all already recorded what was heard.
+                continue
+            self._playing = None
+            if task.exception() is not None:
+                # Not heard, so it is neither counted nor recorded as spoken.
+                print(f"[TTS] Error playing: {task.exception()}")
+            else:
+                self.segments_played += 1
+                response.spoken.append(audio["text"] if isinstance(audio, dict) else audio)
+            response.queued -= 1
+            self._record_if_done(request_id)
+
+    def _record_if_done(self, request_id):
+        response = self.responses.get(request_id)
+        if response is not None and response.stream_done and response.queued <= 0:
+            self._record(request_id)
+
+    def _record(self, request_id):
+        response = self.responses.pop(request_id)
+        spoken = " ".join(part for part in response.spoken if part)
+        partial = response.interrupted or response.stream_partial
+        if not spoken and not response.interrupted and response.text is not None:
+            # Nothing could be played (synthesis or playback failed); keep the response as it came.
+            self.aggregator.add_gpt_response(response.text, partial=partial)
+            return
+        self.aggregator.add_gpt_response(f"/say {response.language} {spoken}".rstrip(), partial=partial)
+
+    def stats(self):
+        return {
+            "segments_played": self.segments_played,
+            "segments_interrupted": self.segments_interrupted,
+            "barge_ins": self.barge_ins,
+        }
+
+    def report(self):
+        print(f"[TTS] {self.stats()}")
+
+
+class _Response:
+    def __init__(self, language):
+        self.language = language
+        self.spoken = []
+        self.queued = 0              # Sentences submitted but not played yet.
+        self.stream_done = False
+        self.text = None             # The full response text, once the stream has ended.
+        self.stream_partial = False
+        self.interrupted = False
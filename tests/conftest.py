@@ -0,0 +1,16 @@
+# conftest.py
+import os
+import sys
+import pytest
+
+# The modules live flat in src/ and import each other by name, as when run from there.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from dialogue_manager import DialogueAggregator
+
+
+@pytest.fixture
+def aggregator(tmp_path):
+    aggregator = DialogueAggregator(["en-US", "ru"], filename=str(tmp_path / "dialogue_entries.json"))
+    yield aggregator
+    aggregator.close()
@@ -0,0 +1,115 @@
+# test_audio_ring.py
+import pytest
+from audio_ring import AudioFanout, AudioRingBuffer, RingReader
+
+# 100 bytes per second keeps the byte arithmetic readable.
+BPS = 100
+
+
+def ring(seconds=1.0):
+    return AudioRingBuffer(seconds=seconds, bytes_per_second=BPS)
+
+
+def send_all(reader):
+    """Send every pending chunk, like a connection's sender task."""
+    sent = bytearray()
+    while True:
+        chunk = reader.next_chunk()
+        if chunk is None:
+            return bytes(sent)
+        sent += chunk
+        reader.advance(chunk)
+
+
+def test_stream_time_maps_onto_the_ring_clock():
+    audio = ring()
+    audio.write(bytes(20))
+    # A connection that joins later starts streaming at ring time 0.2 s.
+    reader = RingReader(audio, "en-US")
+    audio.write(bytes(range(50)))
+    assert send_all(reader) == bytes(range(50))
+    assert reader.to_ring_seconds(0.0) == pytest.approx(0.2)
+    assert reader.to_ring_seconds(0.3) == pytest.approx(0.5)
+
+
+def test_overrun_skips_lost_audio_and_shifts_later_timestamps():
+    audio = ring(seconds=1.0)
+    reader = RingReader(audio, "en-US")
+    # 2.5 s written while the reader sent nothing: the ring lapped it.
+    audio.write(bytes(250))
+    send_all(reader)
+    stats = reader.stats()
+    assert stats["overruns"] == 1
+    assert stats["dropped_seconds"] == pytest.approx(1.5)
+    assert stats["sent_seconds"] == pytest.approx(1.0)
+    # Deepgram's 0.3 s is 0.3 s after the oldest audio that was still there.
+    assert reader.to_ring_seconds(0.3) == pytest.approx(1.8)
+
+
+def test_drop_policy_skips_to_live_audio():
+    audio = ring()
+    reader = RingReader(audio, "ru", policy="drop", max_lag_seconds=0.2)
+    audio.write(bytes(60))
+    send_all(reader)
+    assert reader.stats()["dropped_seconds"] == pytest.approx(0.4)
+    assert reader.stats()["overruns"] == 0
+    assert reader.to_ring_seconds(0.1) == pytest.approx(0.5)
+
+
+def test_failed_send_is_not_part_of_the_stream():
+    audio = ring()
+    reader = RingReader(audio, "en-US", max_chunk_seconds=0.2)
+    audio.write(bytes(40))
+    chunk = reader.next_chunk()
+    reader.advance(chunk, sent=False)
+    send_all(reader)
+    # The first 0.2 s never reached the connection, so its stream starts at ring time 0.2 s.
+    assert reader.to_ring_seconds(0.1) == pytest.approx(0.3)
+
+
+def test_rewind_replays_audio_within_the_same_stream():
+    audio = ring()
+    reader = RingReader(audio, "ru")
+    audio.write(bytes(60))
+    send_all(reader)
+    # Activated by the language gate: the last 0.2 s are sent again.
+    reader.rewind(0.2)
+    assert len(send_all(reader)) == 20
+    assert reader.to_ring_seconds(0.5) == pytest.approx(0.5)
+    assert reader.to_ring_seconds(0.7) == pytest.approx(0.5)
+    assert reader.to_ring_seconds(0.8) == pytest.approx(0.6)
+
+
+def test_reconnect_restarts_the_stream_clock():
+    audio = ring()
+    reader = RingReader(audio, "en-US")
+    audio.write(bytes(80))
+    send_all(reader)
+    # A replacement connection's timestamps start at 0 with 0.3 s of replayed audio.
+    reader.restart_stream(0.3)
+    audio.write(bytes(10))
+    assert len(send_all(reader)) == 40
+    assert reader.to_ring_seconds(0.0) == pytest.approx(0.5)
+    assert reader.to_ring_seconds(0.35) == pytest.approx(0.85)
+
+
+def test_rewind_stops_at_the_oldest_audio():
+    audio = ring(seconds=1.0)
+    reader = RingReader(audio, "en-US")
+    audio.write(bytes(150))
+    reader.restart_stream(5.0)
+    assert reader.position == audio.oldest_position == 50
+    assert reader.to_ring_seconds(0.0) == pytest.approx(0.5)
+
+
+def test_fanout_maps_each_connection_through_its_reader():
+    fanout = AudioFanout(ring=ring())
+    fanout.add_connection("en-US", send=None)
+    fanout.write(bytes(30))
+    fanout.add_connection("ru", send=None)
+    send_all(fanout.readers["en-US"])
+    send_all(fanout.readers["ru"])
+    assert fanout.to_source_time("en-US", 0.1) == pytest.approx(0.1)
+    assert fanout.to_source_time("ru", 0.1) == pytest.approx(0.4)
+    # Unknown connections keep their own clock.
+    assert fanout.to_source_time("de", 0.1) == 0.1
@@ -0,0 +1,133 @@
+# test_dialogue_journal.py
+import json
+import os
+from dialogue_journal import DialogueJournal, _STOP
+
+
+def entry(n):
+    return {"role": "user", "speaker": "0", "text": f"line {n}"}
+
+
+def write_entries(journal, entries):
+    journal.start()
+    for e in entries:
+        journal.append(e)
+
+
+def stop_without_compacting(journal):
+    # What a crash leaves behind: the writer has flushed, nothing was compacted.
+    journal.queue.put(_STOP)
+    journal._thread.join()
+    journal._thread = None
+    journal._file.close()
+    journal._file = None
+
+
+def test_journal_is_replayed_after_a_crash(tmp_path):
+    snapshot = str(tmp_path / "dialogue_entries.json")
+    journal = DialogueJournal(snapshot)
+    journal.load()
+    write_entries(journal, [entry(0), entry(1)])
+    stop_without_compacting(journal)
+
+    assert DialogueJournal(snapshot).load() == [entry(0), entry(1)]
+
+
+def test_close_compacts_into_the_snapshot(tmp_path):
+    snapshot = str(tmp_path / "dialogue_entries.json")
+    journal = DialogueJournal(snapshot)
+    entries = journal.load()
+    write_entries(journal, [entry(0), entry(1)])
+    journal.close(entries + [entry(0), entry(1)])
+
+    assert not os.path.exists(journal.journal_filename)
+    with open(snapshot, encoding="utf-8") as f:
+        assert json.load(f) == [entry(0), entry(1)]
+
+    # The next session appends after the compacted history.
+    journal = DialogueJournal(snapshot)
+    entries = journal.load()
+    write_entries(journal, [entry(2)])
+    stop_without_compacting(journal)
+    assert DialogueJournal(snapshot).load() == [entry(0), entry(1), entry(2)]
+
+
+def test_interrupted_compaction_does_not_duplicate_entries(tmp_path, monkeypatch):
+    snapshot = str(tmp_path / "dialogue_entries.json")
+    journal = DialogueJournal(snapshot)
+    entries = journal.load()
+    write_entries(journal, [entry(0), entry(1)])
+
+    # Crash after the snapshot is replaced but before the journal is removed.
+    def crash(path):
+        raise OSError("crashed")
+    monkeypatch.setattr(os, "remove", crash)
+    try:
+        journal.close(entries + [entry(0), entry(1)])
+    except OSError:
+        pass
+    monkeypatch.undo()
+    assert os.path.exists(journal.journal_filename)
+
+    journal = DialogueJournal(snapshot)
+    assert journal.load() == [entry(0), entry(1)]
+    # Appending to the leftover journal still lines up with the snapshot.
+    write_entries(journal, [entry(2)])
+    stop_without_compacting(journal)
+    assert DialogueJournal(snapshot).load() == [entry(0), entry(1), entry(2)]
+
+
+def test_torn_last_record_is_skipped(tmp_path):
+    snapshot = str(tmp_path / "dialogue_entries.json")
+    journal = DialogueJournal(snapshot)
+    journal.load()
+    write_entries(journal, [entry(0)])
+    stop_without_compacting(journal)
+    with open(journal.journal_filename, "a", encoding="utf-8") as f:
+        f.write('{"role": "user", "spea')
+
+    assert DialogueJournal(snapshot).load() == [entry(0)]
+
+
+def test_appends_after_a_torn_record_survive_a_reload(tmp_path):
+    snapshot = str(tmp_path / "dialogue_entries.json")
+    journal = DialogueJournal(snapshot)
+    journal.load()
+    write_entries(journal, [entry(0)])
+    stop_without_compacting(journal)
+    with open(journal.journal_filename, "a", encoding="utf-8") as f:
+        f.write('{"role": "user", "spea')
+
+    journal = DialogueJournal(snapshot)
+    assert journal.load() == [entry(0)]
+    write_entries(journal, [entry(1), entry(2)])
+    stop_without_compacting(journal)
+
+    assert DialogueJournal(snapshot).load() == [entry(0), entry(1), entry(2)]
+
+
+def test_appends_after_an_unterminated_record_survive_a_reload(tmp_path):
+    snapshot = str(tmp_path / "dialogue_entries.json")
+    journal = DialogueJournal(snapshot)
+    journal.load()
+    write_entries(journal, [entry(0)])
+    stop_without_compacting(journal)
+    with open(journal.journal_filename, "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry(1)))
+
+    journal = DialogueJournal(snapshot)
+    assert journal.load() == [entry(0), entry(1)]
+    write_entries(journal, [entry(2)])
+    stop_without_compacting(journal)
+
+    assert DialogueJournal(snapshot).load() == [entry(0), entry(1), entry(2)]
+
+
+def test_legacy_journal_without_header(tmp_path):
+    snapshot = str(tmp_path / "dialogue_entries.json")
+    with open(snapshot, "w", encoding="utf-8") as f:
+        json.dump([entry(0)], f)
+    with open(str(tmp_path / "dialogue_entries.jsonl"), "w", encoding="utf-8") as f:
+        f.write(json.dumps(entry(1)) + "\n")
+
+    assert DialogueJournal(snapshot).load() == [entry(0), entry(1)]
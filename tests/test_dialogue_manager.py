@@ -0,0 +1,123 @@
+# test_dialogue_manager.py
+from dialogue_manager import DialogueAggregator
+
+
+def line(language, text):
+    return [f"[Speaker: 0, Language: {language}]: {text}"]
+
+
+def test_finals_of_both_languages_make_one_entry(aggregator):
+    assert aggregator.submit_transcription("en-US", line("en-US", "hello there"), 0.0, 1.0, 0.9) == []
+    committed = aggregator.submit_transcription("ru", line("ru", "hello there"), 0.02, 1.01, 0.6)
+    assert len(committed) == 1 and committed[0]["language"] == "en-US"
+    assert [e.text for e in aggregator.entries] == ["hello there"]
+
+
+def test_late_secondary_final_is_absorbed(aggregator):
+    aggregator.submit_transcription("en-US", line("en-US", "hello there"), 0.0, 1.0, 0.9)
+    # The secondary language missed the merge window.
+    (first,) = aggregator.flush_expired(force=True)
+
+    (late,) = aggregator.submit_transcription("ru", line("ru", "hello there"), 0.05, 1.1, 0.7)
+    assert late["late"] and late["utterance_id"] == first["utterance_id"]
+    assert len(aggregator.entries) == 1
+    assert aggregator.late_finals == 1
+    assert not aggregator.pending_utterances
+
+
+def test_late_final_split_differently_is_absorbed(aggregator):
+    aggregator.submit_transcription("en-US", line("en-US", "one two three four"), 0.0, 2.0, 0.9)
+    aggregator.flush_expired(force=True)
+
+    # The other connection split the same speech into two finals.
+    assert aggregator.submit_transcription("ru", line("ru", "one two"), 0.0, 1.0, 0.7)[0]["late"]
+    assert aggregator.submit_transcription("ru", line("ru", "three four"), 1.0, 2.1, 0.7)[0]["late"]
+    assert len(aggregator.entries) == 1
+
+
+def test_split_final_while_pending_joins_the_utterance(aggregator):
+    aggregator.submit_transcription("en-US", line("en-US", "one two three four"), 0.0, 2.0, 0.5)
+    # Only the first half of the audio: the rest of the Russian transcription is still to come.
+    assert aggregator.submit_transcription("ru", line("ru", "one two"), 0.0, 1.0, 0.9) == []
+    (committed,) = aggregator.submit_transcription("ru", line("ru", "three four"), 1.0, 2.0, 0.9)
+    assert committed["language"] == "ru"
+    assert [e.text for e in aggregator.entries] == ["one two", "three four"]
+
+
+def test_transcription_missing_the_end_loses_on_expiry(aggregator):
+    aggregator.submit_transcription("en-US", line("en-US", "one two three four"), 0.0, 2.0, 0.5)
+    aggregator.submit_transcription("ru", line("ru", "one two"), 0.0, 1.0, 0.9)
+    (committed,) = aggregator.flush_expired(force=True)
+    assert committed["language"] == "en-US"
+    assert [e.text for e in aggregator.entries] == ["one two three four"]
+
+
+def test_next_utterance_right_after_a_commit_is_new(aggregator):
+    aggregator.submit_transcription("en-US", line("en-US", "first"), 0.0, 1.0, 0.9)
+    (first,) = aggregator.flush_expired(force=True)
+    # Starts within the merge tolerance of the last one, but is different audio.
+    assert aggregator.submit_transcription("en-US", line("en-US", "second"), 1.1, 2.0, 0.9) == []
+    (second,) = aggregator.flush_expired(force=True)
+    assert second["utterance_id"] != first["utterance_id"]
+    assert [e.text for e in aggregator.entries] == ["first", "second"]
+
+
+def test_background_load_keeps_live_entries_after_the_history(tmp_path, monkeypatch):
+    import json
+    import threading
+    import dialogue_journal
+    import prompt_window
+
+    filename = str(tmp_path / "dialogue_entries.json")
+    with open(filename, "w", encoding="utf-8") as f:
+        json.dump([f"[Speaker: 0, Language: en-US]: old line {i}" for i in range(50)], f)
+
+    release = threading.Event()
+    load = dialogue_journal.DialogueJournal.load
+
+    def slow_load(journal):
+        release.wait(5)
+        return load(journal)
+
+    aggregators = []
+    locked_while_tokenizing = []
+    count_tokens = prompt_window.count_tokens
+
+    def checking_count_tokens(text):
+        if threading.current_thread().name == "dialogue-load":
+            locked_while_tokenizing.append(aggregators[0].lock.locked())
+        return count_tokens(text)
+
+    monkeypatch.setattr(dialogue_journal.DialogueJournal, "load", slow_load)
+    monkeypatch.setattr(prompt_window, "count_tokens", checking_count_tokens)
+    aggregator = DialogueAggregator(["en-US"], filename=filename, background_load=True)
+    aggregators.append(aggregator)
+    try:
+        aggregator.append_speaker_entry("[Speaker: 1, Language: en-US]: said while loading")
+        release.set()
+        assert aggregator.loaded.wait(5)
+        texts = [entry.text for entry in aggregator.entries]
+        assert texts[:50] == [f"old line {i}" for i in range(50)]
+        assert texts[50:] == ["said while loading"]
+        assert aggregator.prompt_window.render().endswith("said while loading")
+        assert locked_while_tokenizing and not any(locked_while_tokenizing[:50])
+    finally:
+        aggregator.close()
+
+
+def test_time_lookup_is_per_session(tmp_path):
+    filename = str(tmp_path / "dialogue_entries.json")
+    first = DialogueAggregator(["en-US"], filename=filename)
+    first.session = 100.0
+    first.submit_transcription("en-US", line("en-US", "old"), 0.0, 1.0, 0.9)
+    first.close()
+
+    # A restarted run: its audio clock starts at 0 again.
+    second = DialogueAggregator(["en-US"], filename=filename)
+    second.submit_transcription("en-US", line("en-US", "new"), 0.0, 1.0, 0.9)
+    try:
+        assert [e.text for e in second.get_entries(start=0, end=2)] == ["new"]
+        assert [e.text for e in second.get_entries(start=0, end=2, session=100.0)] == ["old"]
+        assert [e.text for e in second.get_entries(language="en-US")] == ["old", "new"]
+    finally:
+        second.close()
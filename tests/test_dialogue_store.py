@@ -0,0 +1,54 @@
+# test_dialogue_store.py
+from dialogue_store import DialogueEntry, DialogueStore
+
+
+def line(text, start, session, speaker="0", language="en-US"):
+    return DialogueEntry("user", speaker, text, language=language, start=start, end=start + 0.5,
+                         utterance_id=f"{session}-{start}", session=session)
+
+
+def texts(entries):
+    return [entry.text for entry in entries]
+
+
+def test_between_keeps_sessions_apart():
+    store = DialogueStore([line("old 0", 0.0, 100.0), line("old 1", 1.0, 100.0)])
+    # The next run's audio clock starts at 0 again.
+    store.append(line("new 0", 0.0, 200.0))
+    store.append(line("new 1", 1.0, 200.0))
+
+    assert texts(store.between(0, 2)) == ["new 0", "new 1"]
+    assert texts(store.between(0, 2, session=100.0)) == ["old 0", "old 1"]
+    assert texts(store.between(0.5, 1.5, session=200.0)) == ["new 1"]
+    # Appending a later session never inserts into the middle of the index.
+    assert store._positions == [0, 1, 2, 3]
+
+
+def test_between_with_entries_from_logs_without_sessions():
+    store = DialogueStore([DialogueEntry.from_json({"role": "user", "speaker": "0", "text": "legacy", "start": 0.0})])
+    assert texts(store.between(0, 1)) == ["legacy"]
+    store.append(line("new", 0.0, 200.0))
+    assert texts(store.between(0, 1)) == ["new"]
+    assert store.latest_session() == 200.0
+
+
+def test_speaker_language_and_utterance_lookups():
+    store = DialogueStore([
+        line("hello", 0.0, 100.0),
+        line("privet", 1.0, 100.0, speaker="1", language="ru"),
+        DialogueEntry.gpt("/say English hi"),
+        line("bye", 2.0, 100.0),
+    ])
+
+    assert texts(store.by_speaker(0)) == ["hello", "bye"]
+    assert texts(store.by_speaker("GPT")) == ["/say English hi"]
+    assert texts(store.by_language("ru")) == ["privet"]
+    assert texts(store.by_language("en-US")) == ["hello", "bye"]
+    assert texts(store.by_utterance("100.0-1.0")) == ["privet"]
+    assert store.by_speaker("7") == [] and store.by_language("de") == []
+
+
+def test_session_round_trips_through_json():
+    entry = line("hello", 0.0, 123.5)
+    assert DialogueEntry.from_json(entry.to_json()).session == 123.5
+    assert "session" not in DialogueEntry.gpt("/say Nothing").to_json()
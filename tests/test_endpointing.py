@@ -0,0 +1,22 @@
+# test_endpointing.py
+import types
+from endpointing import AdaptiveEndpointer
+
+
+def words(speaker, *spans):
+    return [types.SimpleNamespace(speaker=speaker, start=start, end=end) for start, end in spans]
+
+
+def test_pauses_are_learned_per_language_and_speaker():
+    endpointer = AdaptiveEndpointer(default_delay=0.2, min_samples=2, max_delay=5.0)
+    # "Speaker 0" on en-US pauses 1 s between words; ru numbers its speakers independently.
+    endpointer.observe_final("en-US", words(0, (0.0, 0.5), (1.5, 2.0), (3.0, 3.5), (4.5, 5.0)))
+    endpointer.observe_final("ru", words(0, (0.0, 0.5), (0.7, 1.0)))
+
+    assert set(endpointer.pauses) == {("en-US", 0), ("ru", 0)}
+    assert len(endpointer.pauses[("en-US", 0)]) == 3
+    assert endpointer.delay_for("en-US", 0, speech_final=False) == 1.0
+    # Too few samples for ru speaker 0: not skewed by the en-US connection's speaker 0.
+    assert endpointer.delay_for("ru", 0, speech_final=False) == 0.2
+    # By default the latest final's language and speaker decide.
+    assert endpointer.delay_for(speech_final=False) == 0.2
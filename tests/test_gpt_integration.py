@@ -0,0 +1,109 @@
+# test_gpt_integration.py
+import asyncio
+import types
+from gpt_integration import StreamMetrics, stream_gpt4_response
+from output_sink import NullSink
+
+
+class FakeStream:
+    """Async iterator over content chunks, like an OpenAI stream."""
+
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.chunks:
+            raise StopAsyncIteration
+        await asyncio.sleep(0)
+        content = self.chunks.pop(0)
+        return types.SimpleNamespace(usage=None, choices=[types.SimpleNamespace(delta=types.SimpleNamespace(content=content))])
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeClient:
+    def __init__(self, chunks):
+        self.streams = []
+        self.chunks = chunks
+        self.chat = types.SimpleNamespace(completions=types.SimpleNamespace(create=self.create))
+
+    async def create(self, **kwargs):
+        stream = FakeStream(self.chunks)
+        self.streams.append(stream)
+        return stream
+
+
+class Recorder:
+    def __init__(self):
+        self.responses = []
+        self.segments = []
+
+    def add_gpt_response(self, text, partial=False):
+        self.responses.append((text, partial))
+
+    def on_segment(self, request_id, language, text):
+        self.segments.append(text)
+
+
+SAY = ["/say English ", "Hello there. ", "How are you?"]
+
+
+def speculative_request(client, recorder, gate, limiter, metrics, commit_timeout=5.0):
+    return asyncio.create_task(stream_gpt4_response(
+        "dialogue", recorder, 1, metrics=metrics, commit_gate=gate, sink=NullSink(),
+        on_segment=recorder.on_segment, openai_client=client, limiter=limiter, messages=[],
+        commit_timeout=commit_timeout))
+
+
+def test_confirmed_speculation_releases_held_segments():
+    async def run():
+        client, recorder, gate = FakeClient(SAY), Recorder(), asyncio.Event()
+        limiter = asyncio.Semaphore(1)
+        task = speculative_request(client, recorder, gate, limiter, StreamMetrics())
+        while not client.streams or client.streams[0].chunks:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.01)
+        # Waiting for the final: nothing delivered, stream closed and limiter slot free.
+        assert recorder.segments == []
+        assert client.streams[0].closed
+        assert not limiter.locked()
+        gate.set()
+        await task
+        return recorder
+
+    recorder = asyncio.run(run())
+    assert recorder.segments == ["Hello there.", "How are you?"]
+    assert recorder.responses == [("/say English Hello there. How are you?", False)]
+
+
+def test_unconfirmed_speculation_is_dropped_after_the_timeout():
+    async def run():
+        client, recorder, gate = FakeClient(SAY), Recorder(), asyncio.Event()
+        metrics = StreamMetrics()
+        await speculative_request(client, recorder, gate, asyncio.Semaphore(1), metrics, commit_timeout=0.05)
+        return recorder, metrics
+
+    recorder, metrics = asyncio.run(run())
+    assert recorder.segments == []
+    assert recorder.responses == []
+    assert metrics.requests_unconfirmed == 1
+    assert metrics.wasted_completion_tokens > 0
+
+
+def test_cancelled_speculation_drops_held_segments():
+    async def run():
+        client, recorder, gate = FakeClient(SAY), Recorder(), asyncio.Event()
+        task = speculative_request(client, recorder, gate, None, StreamMetrics())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return recorder
+
+    recorder = asyncio.run(run())
+    assert recorder.segments == []
+    assert recorder.responses == []
@@ -0,0 +1,84 @@
+# test_language_gate.py
+import time
+from language_gate import LanguageGate
+
+
+def gate(**kwargs):
+    changes = []
+    language_gate = LanguageGate("en-US", ["ru"], on_change=changes.append, **kwargs)
+    return language_gate, changes
+
+
+def test_secondary_wakes_after_a_low_confidence_streak():
+    language_gate, changes = gate(low_confidence=0.6, low_confidence_count=2)
+    assert language_gate.active_languages() == ["en-US"]
+    assert not language_gate.is_active("ru")
+
+    language_gate.observe_final("en-US", 0.4)
+    # A confident final breaks the streak.
+    language_gate.observe_final("en-US", 0.9)
+    language_gate.observe_final("en-US", 0.4)
+    assert not language_gate.is_active("ru")
+    language_gate.observe_final("en-US", 0.5)
+
+    assert language_gate.is_active("ru")
+    assert changes == [["en-US", "ru"]]
+    assert language_gate.stats()["activations"] == 1
+
+
+def test_secondary_wakes_on_a_detected_language():
+    language_gate, changes = gate()
+    # Deepgram detecting the primary's own language changes nothing.
+    language_gate.observe_final("en-US", 0.9, detected_language="en")
+    assert not language_gate.is_active("ru")
+    language_gate.observe_final("en-US", 0.9, detected_language="ru-RU")
+    assert language_gate.is_active("ru")
+    assert language_gate.decisions[-1]["reason"] == "primary detected language ru-RU"
+    assert changes == [["en-US", "ru"]]
+
+
+def test_replay_is_taken_once_per_activation():
+    language_gate, _ = gate(replay_seconds=3.0)
+    assert language_gate.take_replay("ru") == 0.0
+    language_gate.observe_final("en-US", 0.9, detected_language="ru")
+    assert language_gate.take_replay("ru") == 3.0
+    assert language_gate.take_replay("ru") == 0.0
+    # The primary never replays.
+    assert language_gate.take_replay("en-US") == 0.0
+
+
+def test_secondary_goes_idle_without_confident_finals():
+    language_gate, changes = gate(idle_timeout=0.2)
+    language_gate.observe_final("en-US", 0.9, detected_language="ru")
+    time.sleep(0.12)
+    # A confident secondary final keeps it awake; a low-confidence one does not.
+    language_gate.observe_final("ru", 0.8)
+    time.sleep(0.12)
+    assert language_gate.is_active("ru")
+    language_gate.observe_final("ru", 0.3)
+    time.sleep(0.25)
+
+    assert not language_gate.is_active("ru")
+    assert changes == [["en-US", "ru"], ["en-US"]]
+    assert language_gate.stats()["deactivations"] == 1
+    # Idled before its replay was taken: nothing to replay any more.
+    assert language_gate.take_replay("ru") == 0.0
+
+
+def test_on_change_updates_which_languages_the_aggregator_waits_for(aggregator):
+    language_gate = LanguageGate("en-US", ["ru"], on_change=aggregator.set_active_languages, idle_timeout=0.05)
+    aggregator.set_active_languages(language_gate.active_languages())
+
+    # Only the primary is live: its final commits the utterance on its own.
+    committed = aggregator.submit_transcription("en-US", ["[Speaker: 0, Language: en-US]: hello"], 0.0, 1.0, 0.9)
+    assert len(committed) == 1
+
+    language_gate.observe_final("en-US", 0.9, detected_language="ru")
+    assert aggregator.active_languages == ["en-US", "ru"]
+    # Now the utterance waits for the secondary too.
+    assert aggregator.submit_transcription("en-US", ["[Speaker: 0, Language: en-US]: privet"], 2.0, 3.0, 0.5) == []
+    assert len(aggregator.submit_transcription("ru", ["[Speaker: 0, Language: ru]: привет"], 2.0, 3.0, 0.9)) == 1
+
+    time.sleep(0.06)
+    assert not language_gate.is_active("ru")
+    assert aggregator.active_languages == ["en-US"]
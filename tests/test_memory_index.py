@@ -0,0 +1,46 @@
+# test_memory_index.py
+from memory_index import HashedNgramEmbedder, MemoryIndex
+
+
+class FlakyEmbedder(HashedNgramEmbedder):
+    """Fails on any batch containing a text with "boom" in it."""
+
+    def embed(self, texts):
+        if any("boom" in text for text in texts):
+            raise RuntimeError("embedding service unavailable")
+        return super().embed(texts)
+
+
+TEXTS = [
+    "[Speaker: 0, Language: en-US]: my sister lives in Lisbon",
+    "[Speaker: 1, Language: en-US]: boom, the embedder fails on this one",
+    "[Speaker: 0, Language: en-US]: the quarterly budget review is on friday",
+]
+
+
+def test_rows_stay_aligned_when_embedding_fails(tmp_path):
+    index = MemoryIndex(str(tmp_path / "dialogue_entries"), embedder=FlakyEmbedder(), batch_size=1)
+    index.open([])
+    index.start()
+    for text in TEXTS:
+        index.add(text)
+    index.close()
+
+    assert len(index) == len(TEXTS)
+    assert index.search("when is the budget review", k=1)[0][0] == 2
+    assert index.search("where does your sister live", k=1)[0][0] == 0
+
+    # The file on disk has one row per entry too, so a restart lines up.
+    reopened = MemoryIndex(str(tmp_path / "dialogue_entries"), embedder=FlakyEmbedder())
+    reopened.open([text.replace("boom", "bang") for text in TEXTS])
+    assert len(reopened) == len(TEXTS)
+    assert reopened.search("budget review friday", k=1)[0][0] == 2
+    reopened.close()
+
+
+def test_search_respects_limit(tmp_path):
+    index = MemoryIndex(str(tmp_path / "dialogue_entries"), embedder=HashedNgramEmbedder())
+    index.open([TEXTS[0], TEXTS[2]])
+    assert index.search("budget review", k=2, limit=1) == []
+    assert [row for row, _ in index.search("budget review", k=2)] == [1]
+    index.close()
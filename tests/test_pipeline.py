@@ -0,0 +1,96 @@
+# test_pipeline.py
+import asyncio
+import time
+from pipeline import GPTPipeline, _Speculation, _spoken_text
+
+
+def committed(utterance_id):
+    return {"utterance_id": utterance_id, "language": "en-US", "lines": ["[Speaker: 0, Language: en-US]: hi"],
+            "trace_id": None, "created": time.monotonic()}
+
+
+def test_utterance_triggers_only_once(aggregator):
+    async def run():
+        pipeline = GPTPipeline(aggregator)
+        pipeline._handle_committed([committed("a")])
+        assert pipeline._pending_final
+        pipeline._pending_final = False
+        # The same utterance reported again, e.g. a late final from the other language.
+        pipeline._handle_committed([committed("a")])
+        assert not pipeline._pending_final
+        assert pipeline.duplicate_triggers == 1
+        pipeline._handle_committed([committed("b")])
+        assert pipeline._pending_final
+
+    asyncio.run(run())
+
+
+def test_late_final_does_not_trigger_again(aggregator):
+    async def run():
+        pipeline = GPTPipeline(aggregator)
+        aggregator.submit_transcription("en-US", ["[Speaker: 0, Language: en-US]: hello"], 0.0, 1.0, 0.9)
+        pipeline._handle_committed(aggregator.flush_expired(force=True))
+        pipeline._pending_final = False
+        pipeline._handle_committed(aggregator.submit_transcription(
+            "ru", ["[Speaker: 0, Language: ru]: hello"], 0.0, 1.0, 0.6))
+        assert not pipeline._pending_final
+        assert pipeline.duplicate_triggers == 1
+        assert len(aggregator.entries) == 1
+
+    asyncio.run(run())
+
+
+def test_prompt_with_memory_recall_is_built_off_the_event_loop(aggregator, tmp_path):
+    import threading
+    from memory_index import HashedNgramEmbedder, MemoryIndex
+
+    threads = []
+
+    class RecordingIndex(MemoryIndex):
+        def search(self, query, k=4, limit=None, min_score=0.2):
+            threads.append(threading.current_thread())
+            return super().search(query, k, limit, min_score)
+
+    aggregator.memory_index = RecordingIndex(str(tmp_path / "memory"), embedder=HashedNgramEmbedder())
+    aggregator._open_memory()
+    aggregator.prompt_window.set_token_budget(aggregator.prompt_window.system_tokens + 20)
+    for i in range(10):
+        aggregator.append_speaker_entry(f"[Speaker: 0, Language: en-US]: line number {i}")
+    assert aggregator.prompt_window.start > 0
+
+    async def run():
+        pipeline = GPTPipeline(aggregator)
+        await pipeline._prompt_messages()
+
+    asyncio.run(run())
+    assert threads and threads[0] is not threading.main_thread()
+
+
+def test_speculation_hits_and_misses_are_counted(aggregator):
+    async def run():
+        pipeline = GPTPipeline(aggregator, speculative=True)
+        running = asyncio.get_running_loop().create_future()
+        pipeline._gpt_task = running
+
+        lines = ["[Speaker: 0, Language: en-US]: How are you?"]
+        pipeline._speculation = _Speculation("en-US", lines, _spoken_text(lines))
+        # Same words, different punctuation: the speculative response is kept.
+        assert pipeline._resolve_speculation(["[Speaker: 0, Language: en-US]: how are you"])
+        assert pipeline._speculation.confirmed.is_set()
+        # The other language finalizing the same utterance keeps it too, without counting again.
+        assert pipeline._resolve_speculation(["[Speaker: 0, Language: ru]: How are you?"])
+
+        pipeline._speculation = _Speculation("en-US", lines, _spoken_text(lines))
+        speculation = pipeline._speculation
+        assert not pipeline._resolve_speculation(["[Speaker: 0, Language: en-US]: How old are you?"])
+        assert not speculation.confirmed.is_set()
+        assert pipeline._speculation is None
+
+        # A final matching a speculation whose stream already ended starts a new request.
+        pipeline._speculation = _Speculation("en-US", lines, _spoken_text(lines))
+        running.set_result(None)
+        assert not pipeline._resolve_speculation(lines)
+        return pipeline.speculation_stats
+
+    stats = asyncio.run(run())
+    assert (stats.hits, stats.misses) == (1, 2)
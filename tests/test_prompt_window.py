@@ -0,0 +1,49 @@
+# test_prompt_window.py
+from dialogue_store import DialogueEntry
+from prompt_window import CUT_OFF_MARKER, PromptWindow
+
+
+def speaker(text, speaker_id=0):
+    return DialogueEntry("user", speaker_id, text, language="en-US")
+
+
+def test_messages_follow_entry_roles():
+    window = PromptWindow("system", token_budget=10000)
+    window.append_entry(speaker("hello"))
+    window.append_entry(speaker("anyone there?", 1))
+    window.append_entry(DialogueEntry.gpt("/say English Hi!"))
+    window.append_entry(speaker("tell me more"))
+    window.append_entry(DialogueEntry.gpt("/say English Well, it", partial=True))
+    # Legacy logs store GPT lines as formatted text; parsing gives them their role back.
+    window.append_entry(DialogueEntry.parse("[Speaker: GPT] /say English Sure."))
+
+    messages = window.render_messages()
+    assert [m["role"] for m in messages] == ["system", "user", "assistant", "user", "assistant", "assistant"]
+    assert messages[1]["content"] == ("[Speaker: 0, Language: en-US]: hello\n"
+                                      "[Speaker: 1, Language: en-US]: anyone there?")
+    assert messages[2]["content"] == "/say English Hi!"
+    assert messages[4]["content"] == "/say English Well, it" + CUT_OFF_MARKER
+    assert messages[5]["content"] == "/say English Sure."
+
+
+def test_speaker_text_that_looks_like_gpt_stays_a_user_message():
+    window = PromptWindow("system", token_budget=10000)
+    window.append_entry(DialogueEntry("user", "GPT", "I am not the assistant", language="en-US"))
+    assert window.render_messages()[1]["role"] == "user"
+
+
+def test_stable_prefix_grows_while_turns_are_appended():
+    window = PromptWindow("system", token_budget=10000)
+    window.append_entry(speaker("first"))
+    window.render_messages()
+    assert window.stable_prefix_tokens == 0
+
+    window.append_entry(DialogueEntry.gpt("/say English one"))
+    window.render_messages()
+    after_reply = window.stable_prefix_tokens
+    # The system message and the first user turn are unchanged.
+    assert after_reply == window.system_tokens + window._tokens[0]
+
+    window.append_entry(speaker("second"))
+    window.render_messages()
+    assert window.stable_prefix_tokens > after_reply
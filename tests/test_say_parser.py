@@ -0,0 +1,73 @@
+# test_say_parser.py
+from say_parser import SayParser
+
+
+def feed_all(parser, chunks):
+    return [parser.feed(chunk) for chunk in chunks]
+
+
+def test_say_command_split_across_chunks():
+    segments = []
+    parser = SayParser(lambda language, text: segments.append((language, text)))
+    assert feed_all(parser, ["/s", "ay", " Eng", "lish", " Hello", " there. How", " are you?"]) == [False] * 7
+    assert parser.command == "say" and parser.language == "English"
+    # "How are you?" has no whitespace after it yet, so it waits for finish().
+    assert segments == [("English", "Hello there.")]
+    parser.finish()
+    assert segments == [("English", "Hello there."), ("English", "How are you?")]
+
+
+def test_say_nothing_aborts_even_with_a_trailing_chunk():
+    parser = SayParser()
+    assert not parser.feed("/say No")
+    assert parser.feed("thing. Anything after this")
+    assert parser.command == "nothing" and parser.should_abort
+    assert parser.segments == []
+
+
+def test_pausing_aborts_as_soon_as_it_is_recognised():
+    parser = SayParser()
+    assert not parser.feed("/pau")
+    assert parser.feed("sing and some trailing text")
+    assert parser.command == "pausing"
+    assert parser.finish()
+
+
+def test_text_without_a_command():
+    parser = SayParser()
+    assert not parser.feed("Just talking.")
+    assert parser.command == "text"
+    assert not parser.finish()
+    # A command cut short by the end of the stream is plain text too.
+    parser = SayParser()
+    parser.feed("/sa")
+    assert not parser.finish()
+    assert parser.command == "text"
+
+
+def test_abbreviations_do_not_end_a_sentence():
+    parser = SayParser()
+    parser.feed("/say English Ask Dr. Smith, e.g. today. Then rest. ")
+    assert parser.segments == ["Ask Dr. Smith, e.g. today.", "Then rest."]
+
+
+def test_long_text_is_cut_at_the_last_word_or_clause_boundary():
+    parser = SayParser(max_segment_chars=20)
+    parser.feed("/say English one two three, four five six seven eight")
+    assert parser.segments == ["one two three, four"]
+    parser.feed(" nine")
+    assert parser.segments == ["one two three, four", "five six seven"]
+    parser.finish()
+    assert parser.segments[-1] == "eight nine"
+
+    parser = SayParser(max_segment_chars=20)
+    parser.feed("/say English one two, threefourfivesixseven")
+    assert parser.segments == ["one two,"]
+
+
+def test_finish_flushes_the_tail():
+    parser = SayParser()
+    parser.feed("/say Russian Привет. Как дела")
+    assert parser.segments == ["Привет."]
+    assert not parser.finish()
+    assert parser.segments == ["Привет.", "Как дела"]
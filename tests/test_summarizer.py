@@ -0,0 +1,61 @@
+# test_summarizer.py
+import json
+import openai
+import pytest
+from dialogue_manager import DialogueAggregator
+from fake_servers import FakeChatCompletionsServer
+from summarizer import ConversationSummarizer
+
+
+@pytest.fixture
+def fake_openai():
+    server = FakeChatCompletionsServer(response_text="They talked about the weather.").start()
+    try:
+        yield server
+    finally:
+        server.stop()
+
+
+@pytest.fixture
+def aggregator(tmp_path):
+    # A small budget so most of the dialogue has left the prompt window.
+    aggregator = DialogueAggregator(["en-US"], filename=str(tmp_path / "dialogue_entries.json"),
+                                    prompt_token_budget=900)
+    for i in range(40):
+        aggregator.append_speaker_entry(f"[Speaker: 0, Language: en-US]: sentence number {i} about the weather today")
+    yield aggregator
+    aggregator.close()
+
+
+def test_summarizer_folds_old_entries_against_a_stub_endpoint(fake_openai, aggregator):
+    client = openai.OpenAI(api_key="test", base_url=fake_openai.base_url)
+    summarizer = ConversationSummarizer(aggregator, client=client)
+    summary, pending, upto = aggregator.get_unsummarized_entries()
+    assert summary is None and pending and upto == aggregator.prompt_window.start
+
+    assert summarizer.summarize_once(force=True)
+
+    body = fake_openai.requests[-1]["body"]
+    assert "sentence number 0 " in body["messages"][1]["content"]
+    assert aggregator.summary == "They talked about the weather."
+    assert aggregator.summary_upto == upto
+    assert aggregator.prompt_window.pinned_prompt.endswith("They talked about the weather.\n")
+    with open(aggregator.summary_filename, encoding="utf-8") as f:
+        assert json.load(f) == {"summary": "They talked about the weather.", "upto": upto}
+    # Nothing new has left the window since.
+    assert not summarizer.summarize_once(force=True)
+
+
+def test_shorter_summary_does_not_pull_summarized_entries_back(aggregator):
+    window = aggregator.prompt_window
+    aggregator.set_summary("A long summary. " * 60, window.start)
+    upto = aggregator.summary_upto
+    start = window.start
+    assert start >= upto
+
+    aggregator.set_summary("Short.", upto)
+    assert window.start == upto
+    assert "sentence number 0 " not in window.render()
+    # A bigger budget does not reach behind the summary either.
+    aggregator.set_prompt_token_budget(100000)
+    assert window.start == upto
@@ -0,0 +1,27 @@
+# test_transcription.py
+from types import SimpleNamespace
+from transcription import build_speaker_runs
+
+
+def word(text, start, speaker=0, confidence=0.9):
+    return SimpleNamespace(word=text, start=start, end=start + 0.2, speaker=speaker, confidence=confidence)
+
+
+def test_runs_split_on_speaker_changes():
+    runs = build_speaker_runs([word("hi", 0.0), word("there", 0.3), word("hello", 0.6, speaker=1, confidence=0.5)],
+                              "en-US")
+    assert [run.line for run in runs] == ["[Speaker: 0, Language: en-US]: hi there",
+                                          "[Speaker: 1, Language: en-US]: hello"]
+    assert (runs[0].start, runs[0].end) == (0.0, 0.5)
+    assert runs[0].confidence == 0.9 and runs[1].confidence == 0.5
+
+
+def test_words_without_speaker_or_confidence():
+    words = [SimpleNamespace(word="no", start=0.0, end=0.2), SimpleNamespace(word="diarization", start=0.3, end=0.6)]
+    (run,) = build_speaker_runs(words, "ru")
+    assert run.line == "[Speaker: Unknown, Language: ru]: no diarization"
+    assert run.confidence == 0.0
+
+
+def test_empty_result():
+    assert build_speaker_runs([], "en-US") == []
@@ -0,0 +1,146 @@
+# test_tts.py
+import asyncio
+import sys
+import threading
+import time
+import types
+from tts import FakeTTSBackend, Pyttsx3Backend, TTSStage
+
+
+async def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.005)
+
+
+def test_barge_in_records_only_what_was_heard(aggregator):
+    async def run():
+        backend = FakeTTSBackend(synth_seconds=0.0, words_per_second=20.0)
+        stage = TTSStage(backend, aggregator)
+        await stage.start()
+        stage.submit(1, "English", "one two three four")
+        stage.submit(1, "English", "five six seven eight nine ten eleven twelve")
+        stage.complete(1, "/say English one two three four five six seven eight nine ten eleven twelve", False)
+        # Let the first sentence finish and the second get about half way (0.4 s long).
+        await wait_for(lambda: stage.segments_played == 1)
+        await asyncio.sleep(0.2)
+        stage.barge_in()
+        await stage.stop()
+        return stage, backend
+
+    stage, backend = asyncio.run(run())
+    assert stage.stats() == {"segments_played": 1, "segments_interrupted": 1, "barge_ins": 1}
+    assert backend.played[0] == ("one two three four", 0.2, True)
+    assert backend.played[1][2] is False
+    (entry,) = aggregator.entries
+    assert entry.partial
+    assert entry.text.startswith("/say English one two three four five")
+    assert "twelve" not in entry.text
+
+
+def test_newer_response_interrupts_the_older_one(aggregator):
+    async def run():
+        stage = TTSStage(FakeTTSBackend(synth_seconds=0.0, words_per_second=10.0), aggregator)
+        await stage.start()
+        stage.submit(1, "English", "a long sentence that keeps going for a while")
+        await wait_for(lambda: stage._playing is not None)
+        stage.submit(2, "English", "Short.")
+        stage.complete(1, "/say English a long sentence that keeps going for a while", True)
+        stage.complete(2, "/say English Short.", False)
+        await wait_for(lambda: len(aggregator.entries) == 2)
+        await stage.stop()
+
+    asyncio.run(run())
+    first, second = aggregator.entries
+    assert first.partial and "for a while" not in first.text
+    assert not second.partial and second.text == "/say English Short."
+
+
+class FailingBackend(FakeTTSBackend):
+    async def play(self, audio):
+        raise OSError("no audio device")
+
+
+def test_failed_playback_is_not_recorded_as_spoken(aggregator):
+    async def run():
+        stage = TTSStage(FailingBackend(synth_seconds=0.0), aggregator)
+        await stage.start()
+        stage.submit(1, "English", "Hello there.")
+        stage.complete(1, "/say English Hello there.", False)
+        await wait_for(lambda: len(aggregator.entries) == 1)
+        await stage.stop()
+        return stage
+
+    stage = asyncio.run(run())
+    assert stage.segments_played == 0
+    # Nothing was heard, so the response is kept as it came.
+    assert aggregator.entries[0].text == "/say English Hello there."
+
+
+class FakeEngine:
+    """Stands in for a pyttsx3 engine and checks it is only used from one thread."""
+
+    def __init__(self, seconds_per_sentence):
+        self.seconds = seconds_per_sentence
+        self.threads = set()
+        self.callback = None
+        self.speaking = None
+        self.spoken = []
+
+    def _call(self):
+        self.threads.add(threading.get_ident())
+
+    def setProperty(self, name, value):
+        self._call()
+
+    def connect(self, topic, callback):
+        self._call()
+        self.callback = callback
+
+    def startLoop(self, use_driver_loop):
+        self._call()
+        assert use_driver_loop is False
+
+    def endLoop(self):
+        self._call()
+
+    def say(self, text, name=None):
+        self._call()
+        self.speaking = (text, name, time.monotonic())
+
+    def stop(self):
+        self._call()
+        if self.speaking is not None:
+            text, name, _ = self.speaking
+            self.speaking = None
+            self.spoken.append((text, False))
+            self.callback(name, False)
+
+    def iterate(self):
+        self._call()
+        if self.speaking is not None and time.monotonic() - self.speaking[2] >= self.seconds:
+            text, name, _ = self.speaking
+            self.speaking = None
+            self.spoken.append((text, True))
+            self.callback(name, True)
+
+
+def test_pyttsx3_engine_runs_on_its_own_thread(monkeypatch):
+    engine = FakeEngine(seconds_per_sentence=0.05)
+    monkeypatch.setitem(sys.modules, "pyttsx3", types.SimpleNamespace(init=lambda: engine))
+
+    async def run():
+        backend = Pyttsx3Backend()
+        await backend.play("first")
+        playing = asyncio.create_task(backend.play("second"))
+        await asyncio.sleep(0.01)
+        playing.cancel()
+        await asyncio.gather(playing, return_exceptions=True)
+        # The stop is handled before the next sentence, which plays in full.
+        await asyncio.wait_for(backend.play("third"), 1.0)
+        backend.close()
+
+    asyncio.run(run())
+    assert engine.spoken == [("first", True), ("second", False), ("third", True)]
+    assert len(engine.threads) == 1 and threading.get_ident() not in engine.threads